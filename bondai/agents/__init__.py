@@ -7,7 +7,9 @@ from .messages import (
     ConversationMessage,
     ToolUsageMessage,
     AgentMessageList,
+    AgentMessageView,
     message_to_dict,
+    message_from_dict,
     USER_MEMBER_NAME,
 )
 from .util import (
@@ -36,6 +38,8 @@ __all__ = [
     "ConversationMessage",
     "ToolUsageMessage",
     "AgentMessageList",
+    "AgentMessageView",
     "message_to_dict",
+    "message_from_dict",
     "USER_MEMBER_NAME",
 ]
@@ -1,9 +1,15 @@
 import os
 import uuid
+import asyncio
+import functools
+import threading
 import traceback
+import contextvars
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Dict, List, Tuple, Callable
+from datetime import date, datetime
+from contextlib import nullcontext
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Tuple, Callable, Generator
 from bondai.util import EventMixin, Runnable, load_local_resource
 from bondai.tools import Tool, ResponseQueryTool
 from bondai.models import LLM, EmbeddingModel
@@ -14,6 +20,7 @@ from bondai.models.openai import (
     OpenAIEmbeddingModel,
     OpenAIModelNames,
     get_total_cost,
+    track_costs,
 )
 from .conversation_member import ConversationMember
 from .messages import AgentMessage, AgentMessageList, SystemMessage, ToolUsageMessage
@@ -26,8 +33,17 @@ from .util import (
     MaxStepsExceededException,
     ContextLengthExceededException,
     count_request_tokens,
+    count_message_tokens,
+    count_messages_tokens,
+    count_tools_tokens,
     format_llm_messages,
+    flatten_llm_messages,
+    get_context_window_start,
     execute_tool,
+    aexecute_tool,
+    DEFAULT_MAX_TOOL_WORKERS,
+    run_steps,
+    arun_steps,
 )
 
 
@@ -39,6 +55,9 @@ DEFAULT_SYSTEM_PROMPT_TEMPLATE = load_local_resource(
 DEFAULT_MESSAGE_PROMPT_TEMPLATE = load_local_resource(
     __file__, os.path.join("prompts", "agent_message_prompt_template.md")
 )
+DEFAULT_CONTEXT_PROMPT_TEMPLATE = load_local_resource(
+    __file__, os.path.join("prompts", "agent_context_prompt_template.md")
+)
 
 
 class FinalAnswerParameters(BaseModel):
@@ -76,6 +95,8 @@ class Agent(EventMixin, Runnable):
         max_tool_response_tokens=DEFAULT_MAX_TOOL_RESPONSE_TOKENS,
         enable_context_compression: bool = False,
         enable_final_answer_tool: bool = True,
+        tool_executor: Executor | None = None,
+        enable_stable_prompt_prefix: bool = False,
     ):
         Runnable.__init__(self)
         if allowed_events is None:
@@ -86,6 +107,7 @@ class Agent(EventMixin, Runnable):
                 AgentEventNames.STREAMING_CONTENT_UPDATED,
                 AgentEventNames.STREAMING_FUNCTION_UPDATED,
                 AgentEventNames.CONTEXT_COMPRESSION_REQUESTED,
+                AgentEventNames.CONTEXT_BUILT,
             ]
         EventMixin.__init__(self, allowed_events=allowed_events)
 
@@ -120,6 +142,15 @@ class Agent(EventMixin, Runnable):
         self._max_tool_retries = max_tool_retries
         self._max_tool_response_tokens = max_tool_response_tokens
         self._enable_context_compression = enable_context_compression
+        self._tool_token_counts: Dict[str, int] = {}
+        self._tool_executor: Executor | None = tool_executor
+        self._enable_stable_prompt_prefix = enable_stable_prompt_prefix
+        self._context_prompt_builder = JinjaPromptBuilder(
+            DEFAULT_CONTEXT_PROMPT_TEMPLATE
+        )
+        # The tools and messages of the last request, used to measure how much
+        # of each request repeats the start of the one before it.
+        self._last_request_prefix: Tuple[List[str], List[Dict]] = ([], [])
         if self._memory_manager:
             self._tools.extend(self._memory_manager.tools)
             self._system_prompt_sections.append(self._memory_manager)
@@ -129,7 +160,7 @@ class Agent(EventMixin, Runnable):
             )
         if self._message_prompt_builder is None:
             self._message_prompt_builder = JinjaPromptBuilder(
-                DEFAULT_MESSAGE_PROMPT_TEMPLATE
+                DEFAULT_MESSAGE_PROMPT_TEMPLATE, memoize_messages=True
             )
         if enable_final_answer_tool:
             self._tools.append(FinalAnswerTool())
@@ -182,67 +213,103 @@ class Agent(EventMixin, Runnable):
             if tool.name in state["tools"]:
                 tool.load_state(state["tools"][tool.name])
 
-    def _is_context_pressure_too_high(
-        self,
-        llm_messages: List[Dict[str, str]],
-        tools: List[Tool] | None = None,
-    ) -> float:
-        if tools is None:
-            tools = []
-        context_pressure_ratio = float(
-            count_request_tokens(self._llm, llm_messages, tools)
-        ) / float(self._max_context_length)
+    def _is_context_pressure_too_high(self, request_tokens: int) -> bool:
+        context_pressure_ratio = float(request_tokens) / float(self._max_context_length)
         return context_pressure_ratio > self._max_context_pressure_ratio
 
+    def _count_tools_tokens(self, tools: List[Tool]) -> int:
+        uncounted_tools = [t for t in tools if t.name not in self._tool_token_counts]
+        if uncounted_tools:
+            token_counts = count_tools_tokens(self._llm, uncounted_tools)
+            for tool, token_count in zip(uncounted_tools, token_counts):
+                self._tool_token_counts[tool.name] = token_count
+        return sum(self._tool_token_counts[t.name] for t in tools)
+
+    def _count_messages_tokens(
+        self, messages: List[AgentMessage], llm_messages: List[Dict[str, str]]
+    ) -> List[int]:
+        # Token counts are cached on each message (keyed by agent) so only
+        # new or edited messages are tokenized on each step.
+        token_counts = [m.get_token_count(self._id) for m in messages]
+        uncounted = [i for i, c in enumerate(token_counts) if c is None]
+        if uncounted:
+            new_token_counts = count_messages_tokens(
+                self._llm, [llm_messages[i] for i in uncounted]
+            )
+            for i, token_count in zip(uncounted, new_token_counts):
+                messages[i].set_token_count(self._id, token_count)
+                token_counts[i] = token_count
+        return token_counts
+
+    def _get_llm_functions(
+        self, tools: List[Tool], request_tokens: int | None, messages: List[Dict]
+    ) -> List[Dict]:
+        if request_tokens is None:
+            request_tokens = count_request_tokens(
+                llm=self._llm, messages=messages, tools=tools
+            )
+        if request_tokens > self._llm.max_tokens:
+            raise ContextLengthExceededException(
+                f"Context length ({request_tokens}) exceeds maximum tokens allowed by LLM: {self._llm.max_tokens}"
+            )
+
+        return list(map(lambda t: t.get_tool_function(), tools))
+
+    def _get_stream_callbacks(
+        self,
+        tools: List[Tool],
+        content_stream_callback: Callable[[str], None] | None = None,
+        function_stream_callback: Callable[[str], None] | None = None,
+    ) -> (Callable[[str], None], Callable[[str, str], None]):
+        def _function_stream_callback(function_name, arguments_buffer):
+            streaming_tools: [Tool] = [
+                t for t in tools if t.name == function_name and t.supports_streaming
+            ]
+            if len(streaming_tools) > 0:
+                tool: Tool = streaming_tools[0]
+                tool.handle_stream_update(arguments_buffer)
+            if function_stream_callback:
+                function_stream_callback(function_name, arguments_buffer)
+            self._trigger_event(
+                AgentEventNames.STREAMING_FUNCTION_UPDATED,
+                self,
+                function_name,
+                arguments_buffer,
+            )
+
+        def _content_stream_callback(content_buffer):
+            if content_stream_callback:
+                content_stream_callback(content_buffer)
+            self._trigger_event(
+                AgentEventNames.STREAMING_CONTENT_UPDATED, self, content_buffer
+            )
+
+        return _content_stream_callback, _function_stream_callback
+
     def _get_llm_response(
         self,
         messages: List[Dict] | None = None,
         tools: List[Tool] | None = None,
         content_stream_callback: Callable[[str], None] | None = None,
         function_stream_callback: Callable[[str], None] | None = None,
+        request_tokens: int | None = None,
     ) -> (str | None, Dict | None):
         if messages is None:
             messages = []
         if tools is None:
             tools = []
 
-        request_tokens = count_request_tokens(
-            llm=self._llm, messages=messages, tools=tools
-        )
-        if request_tokens > self._llm.max_tokens:
-            raise ContextLengthExceededException(
-                f"Context length ({request_tokens}) exceeds maximum tokens allowed by LLM: {self._llm.max_tokens}"
-            )
-
-        llm_functions = list(map(lambda t: t.get_tool_function(), tools))
+        llm_functions = self._get_llm_functions(tools, request_tokens, messages)
 
         if (
             self._llm.supports_streaming
         ):  # and (any([t.supports_streaming for t in tools]) or content_stream_callback):
-
-            def _function_stream_callback(function_name, arguments_buffer):
-                streaming_tools: [Tool] = [
-                    t for t in tools if t.name == function_name and t.supports_streaming
-                ]
-                if len(streaming_tools) > 0:
-                    tool: Tool = streaming_tools[0]
-                    tool.handle_stream_update(arguments_buffer)
-                if function_stream_callback:
-                    function_stream_callback(function_name, arguments_buffer)
-                self._trigger_event(
-                    AgentEventNames.STREAMING_FUNCTION_UPDATED,
-                    self,
-                    function_name,
-                    arguments_buffer,
-                )
-
-            def _content_stream_callback(content_buffer):
-                if content_stream_callback:
-                    content_stream_callback(content_buffer)
-                self._trigger_event(
-                    AgentEventNames.STREAMING_CONTENT_UPDATED, self, content_buffer
-                )
-
+            (
+                _content_stream_callback,
+                _function_stream_callback,
+            ) = self._get_stream_callbacks(
+                tools, content_stream_callback, function_stream_callback
+            )
             llm_response, llm_response_function = self._llm.get_streaming_completion(
                 messages=messages,
                 functions=llm_functions,
@@ -259,6 +326,47 @@ class Agent(EventMixin, Runnable):
 
         return llm_response, llm_response_function
 
+    async def _aget_llm_response(
+        self,
+        messages: List[Dict] | None = None,
+        tools: List[Tool] | None = None,
+        content_stream_callback: Callable[[str], None] | None = None,
+        function_stream_callback: Callable[[str], None] | None = None,
+        request_tokens: int | None = None,
+    ) -> (str | None, Dict | None):
+        if messages is None:
+            messages = []
+        if tools is None:
+            tools = []
+
+        llm_functions = self._get_llm_functions(tools, request_tokens, messages)
+
+        if not self._llm.supports_streaming:
+            return await self._llm.aget_completion(
+                messages=messages, functions=llm_functions
+            )
+
+        (
+            _content_stream_callback,
+            _function_stream_callback,
+        ) = self._get_stream_callbacks(
+            tools, content_stream_callback, function_stream_callback
+        )
+        llm_response, llm_response_function = None, None
+        async for update in self._llm.aget_streaming_completion(
+            messages=messages, functions=llm_functions
+        ):
+            if update.completion is not None:
+                llm_response, llm_response_function = update.completion
+            elif update.function_name is not None:
+                _function_stream_callback(
+                    update.function_name, update.function_arguments
+                )
+            elif update.content is not None:
+                _content_stream_callback(update.content)
+
+        return llm_response, llm_response_function
+
     def run(
         self,
         task: str,
@@ -267,6 +375,9 @@ class Agent(EventMixin, Runnable):
     ) -> ToolUsageMessage | str:
         if self._status == AgentStatus.RUNNING:
             raise AgentException("Cannot start agent while it is in a running state.")
+        # Stop requests are only reset here, when a run starts, so a stop()
+        # made at any point during the run is never lost.
+        self._stop_event.clear()
         self._status = AgentStatus.RUNNING
         try:
             return self._run_tool_loop(
@@ -279,6 +390,28 @@ class Agent(EventMixin, Runnable):
         finally:
             self._status = AgentStatus.IDLE
 
+    async def arun(
+        self,
+        task: str,
+        max_steps: int = None,
+        max_budget: float = None,
+    ) -> ToolUsageMessage | str:
+        """Runs the agent's task as a coroutine on the running event loop."""
+        if self._status == AgentStatus.RUNNING:
+            raise AgentException("Cannot start agent while it is in a running state.")
+        self._stop_event.clear()
+        self._status = AgentStatus.RUNNING
+        try:
+            return await self._arun_tool_loop(
+                tools=self._tools,
+                task=task,
+                starting_cost=get_total_cost(),
+                max_budget=max_budget,
+                max_steps=max_steps,
+            )
+        finally:
+            self._status = AgentStatus.IDLE
+
     def run_async(
         self,
         task: str,
@@ -293,14 +426,20 @@ class Agent(EventMixin, Runnable):
         self._start_execution_thread(target=self.run, args=args)
 
     def stop(self, timeout=10):
-        """Gracefully stops the thread, with a timeout."""
-        self._force_stop = True
+        """Gracefully stops the agent, waiting for its thread with a timeout."""
+        self._stop_event.set()
         for tool in self._tools:
             tool.stop()
 
         super().stop(timeout=timeout)
 
-    def _run_tool_loop(
+    def _run_tool_loop(self, **kwargs) -> ToolUsageMessage | str:
+        return run_steps(self._tool_loop_steps(**kwargs))
+
+    async def _arun_tool_loop(self, **kwargs) -> ToolUsageMessage | str:
+        return await arun_steps(self._tool_loop_steps(**kwargs))
+
+    def _tool_loop_steps(
         self,
         tools: List[Tool],
         starting_cost: float,
@@ -315,7 +454,10 @@ class Agent(EventMixin, Runnable):
         conversation_members: List[ConversationMember] | None = None,
         content_stream_callback: Callable[[str], None] | None = None,
         function_stream_callback: Callable[[str], None] | None = None,
-    ) -> ToolUsageMessage | str:
+    ) -> Generator[Tuple, object, ToolUsageMessage | str]:
+        # The tool loop is written once as a generator. Blocking work (LLM
+        # calls, tool execution and compression) is yielded as a step and
+        # fulfilled by run_steps (sync) or arun_steps (async).
         if addition_context_messages is None:
             addition_context_messages = []
         if conversation_members is None:
@@ -327,15 +469,17 @@ class Agent(EventMixin, Runnable):
         step_count = 0
         last_error_message = None
         local_messages = []
-        self._force_stop = False
         response_query_tool = ResponseQueryTool(
             llm=self._llm, embedding_model=self._embedding_model
         )
 
-        def append_message(message):
+        def append_message(message, keep_messages=()):
             if isinstance(message, SystemMessage):
                 system_messages = [
-                    m for m in local_messages if not isinstance(m, SystemMessage)
+                    m
+                    for m in local_messages
+                    if not isinstance(m, SystemMessage)
+                    and not any(m is k for k in keep_messages)
                 ]
                 for m in system_messages:
                     local_messages.remove(m)
@@ -346,7 +490,7 @@ class Agent(EventMixin, Runnable):
                 if self._memory_manager and self._memory_manager.conversation_memory:
                     self._memory_manager.conversation_memory.add(message)
 
-        while not self._force_stop:
+        while not self.stop_requested:
             step_count += 1
             if max_budget and get_total_cost() - starting_cost > max_budget:
                 raise BudgetExceededException()
@@ -360,16 +504,20 @@ class Agent(EventMixin, Runnable):
                 tools.append(response_query_tool)
 
             if self._enable_context_compression:
-                self._compress_llm_context(
-                    tools=tools,
-                    last_error_message=last_error_message,
-                    conversation_members=conversation_members,
-                    additional_context_messages=addition_context_messages
-                    + local_messages,
-                    prompt_vars=prompt_vars,
+                yield (
+                    self._compress_llm_context,
+                    self._acompress_llm_context,
+                    dict(
+                        tools=tools,
+                        last_error_message=last_error_message,
+                        conversation_members=conversation_members,
+                        additional_context_messages=addition_context_messages
+                        + local_messages,
+                        prompt_vars=prompt_vars,
+                    ),
                 )
 
-            llm_context = self._build_llm_context(
+            llm_context, request_tokens = self._build_llm_context(
                 messages=AgentMessageList(
                     self._messages + addition_context_messages + local_messages
                 ),
@@ -378,65 +526,109 @@ class Agent(EventMixin, Runnable):
                 last_error_message=last_error_message,
                 conversation_members=conversation_members,
                 prompt_vars=prompt_vars,
+                report_stable_prefix=True,
             )
 
-            llm_response_content, llm_response_function = self._get_llm_response(
-                messages=llm_context,
-                tools=tools,
-                content_stream_callback=content_stream_callback,
-                function_stream_callback=function_stream_callback,
+            llm_response_content, llm_response_function = yield (
+                self._get_llm_response,
+                self._aget_llm_response,
+                dict(
+                    messages=llm_context,
+                    tools=tools,
+                    content_stream_callback=content_stream_callback,
+                    function_stream_callback=function_stream_callback,
+                    request_tokens=request_tokens,
+                ),
             )
             # print(llm_response_content)
 
-            last_error_message = None
-            if llm_response_function and any(
-                [
-                    m.name == llm_response_function.get("tool_name")
-                    for m in conversation_members
-                ]
-            ):
-                message = f"""MessageSendFailure: You attempted to send a message to {llm_response_function.get('tool_name')} but this message failed.
-                To send a message to {llm_response_function.get('tool_name')} you must use the 'send_message' tool or use this format in your response:
-
-                ```
-                {llm_response_function.get('tool_name')}: Include your message here.)
-                ```
-                """
-                append_message(SystemMessage(message=message))
-            if llm_response_function:
-                tool_message = ToolUsageMessage(
-                    tool_name=llm_response_function["name"],
-                    tool_arguments=llm_response_function.get("arguments") or {},
-                )
-                self._trigger_event(AgentEventNames.TOOL_SELECTED, self, tool_message)
-                self._handle_llm_function(tool_message=tool_message, tools=tools)
+            # LLMs that support tool calls may select several functions per turn.
+            if isinstance(llm_response_function, list):
+                llm_response_functions = llm_response_function
+            elif llm_response_function:
+                llm_response_functions = [llm_response_function]
+            else:
+                llm_response_functions = []
 
-                if (
-                    isinstance(tool_message.tool_output, str)
-                    and self._llm.count_tokens(tool_message.tool_output)
-                    > self._max_tool_response_tokens
+            last_error_message = None
+            for llm_response_function in llm_response_functions:
+                if any(
+                    [
+                        m.name == llm_response_function.get("tool_name")
+                        for m in conversation_members
+                    ]
                 ):
-                    response_id = response_query_tool.add_response(
-                        tool_message.tool_output
-                    )
-                    tool_message.tool_output = f"The result from this tool was greater than {self._max_tool_response_tokens} tokens and could not be displayed. However, you can use the response_query tool to ask questions about the content of this response. Just use response_id = {response_id}."
+                    message = f"""MessageSendFailure: You attempted to send a message to {llm_response_function.get('tool_name')} but this message failed.
+                    To send a message to {llm_response_function.get('tool_name')} you must use the 'send_message' tool or use this format in your response:
 
-                append_message(tool_message)
-                if tool_message.success:
-                    error_count = 0
+                    ```
+                    {llm_response_function.get('tool_name')}: Include your message here.)
+                    ```
+                    """
+                    append_message(SystemMessage(message=message))
+            if llm_response_functions:
+                tool_messages = []
+                for llm_response_function in llm_response_functions:
+                    tool_message = ToolUsageMessage(
+                        tool_name=llm_response_function["name"],
+                        tool_arguments=llm_response_function.get("arguments") or {},
+                        tool_call_id=llm_response_function.get("id"),
+                    )
                     self._trigger_event(
-                        AgentEventNames.TOOL_COMPLETED, self, tool_message
+                        AgentEventNames.TOOL_SELECTED, self, tool_message
                     )
-                    if tool_message.agent_halted:
-                        return tool_message
-                else:
+                    tool_messages.append(tool_message)
+
+                yield (
+                    self._handle_llm_functions,
+                    self._ahandle_llm_functions,
+                    dict(tool_messages=tool_messages, tools=tools),
+                )
+
+                result_message = None
+                failed_messages = []
+                for tool_message in tool_messages:
+                    if (
+                        isinstance(tool_message.tool_output, str)
+                        and self._llm.count_tokens(tool_message.tool_output)
+                        > self._max_tool_response_tokens
+                    ):
+                        response_id = response_query_tool.add_response(
+                            tool_message.tool_output
+                        )
+                        tool_message.tool_output = f"The result from this tool was greater than {self._max_tool_response_tokens} tokens and could not be displayed. However, you can use the response_query tool to ask questions about the content of this response. Just use response_id = {response_id}."
+
+                    append_message(tool_message)
+                    if tool_message.success:
+                        self._trigger_event(
+                            AgentEventNames.TOOL_COMPLETED, self, tool_message
+                        )
+                        if tool_message.agent_halted and not result_message:
+                            result_message = tool_message
+                    else:
+                        failed_messages.append(tool_message)
+                        self._trigger_event(
+                            AgentEventNames.TOOL_ERROR, self, tool_message
+                        )
+
+                # A turn counts as one error however many of its calls failed,
+                # and the results of this turn's other calls stay in context.
+                if failed_messages:
                     error_count += 1
-                    last_error_message = str(tool_message.error)
+                    last_error_message = "\n".join(
+                        str(m.error) for m in failed_messages
+                    )
                     message = "ToolUsageError: Your last tool usage failed and MUST BE CORRECTED. If this error is not corrected you will not be able to proceed."
-                    append_message(SystemMessage(message=message))
-                    self._trigger_event(AgentEventNames.TOOL_ERROR, self, tool_message)
-                    if error_count >= max_tool_retries:
-                        return tool_message
+                    append_message(
+                        SystemMessage(message=message), keep_messages=tool_messages
+                    )
+                    if error_count >= max_tool_retries and not result_message:
+                        result_message = failed_messages[-1]
+                else:
+                    error_count = 0
+
+                if result_message:
+                    return result_message
             elif llm_response_content and return_conversational_responses:
                 return llm_response_content
             else:
@@ -446,8 +638,7 @@ class Agent(EventMixin, Runnable):
                 if error_count >= max_tool_retries:
                     raise AgentException(message)
 
-        if self._force_stop:
-            self._force_stop = False
+        if self.stop_requested:
             raise AgentException("Agent was forcibly stopped.")
 
     def _build_llm_context(
@@ -459,7 +650,8 @@ class Agent(EventMixin, Runnable):
         conversation_members: List[ConversationMember] | None = None,
         truncate_context: bool = True,
         prompt_vars: Dict | None = None,
-    ) -> (str | None, Dict | None):
+        report_stable_prefix: bool = False,
+    ) -> (List[Dict[str, str]], int):
         if tools is None:
             tools = []
         if conversation_members is None:
@@ -474,32 +666,108 @@ class Agent(EventMixin, Runnable):
             else:
                 prompt_sections.append(s)
 
-        system_prompt: str = self._system_prompt_builder(
-            conversation_members=conversation_members,
-            tools=tools,
-            task=task,
-            prompt_sections=prompt_sections,
-            error_message=last_error_message,
-            **prompt_vars,
-        )
+        context_message = None
+        if self._enable_stable_prompt_prefix:
+            # The system prompt only contains content that is stable between
+            # steps, so the tools, system prompt and history form a prefix that
+            # is repeated byte for byte and can be reused by prompt caching.
+            # The current time, the last error and prompt sections such as core
+            # memory are sent in a message after the history.
+            system_prompt: str = self._system_prompt_builder(
+                conversation_members=conversation_members,
+                tools=tools,
+                task=task,
+                prompt_sections=[],
+                error_message=None,
+                datetime=str(date.today()),
+                **prompt_vars,
+            )
+            context_message = {
+                "role": "system",
+                "content": self._context_prompt_builder(
+                    datetime=str(datetime.now()),
+                    error_message=last_error_message,
+                    prompt_sections=prompt_sections,
+                ).strip(),
+            }
+        else:
+            system_prompt: str = self._system_prompt_builder(
+                conversation_members=conversation_members,
+                tools=tools,
+                task=task,
+                prompt_sections=prompt_sections,
+                error_message=last_error_message,
+                **prompt_vars,
+            )
 
         # print(system_prompt)
         llm_context = format_llm_messages(
-            system_prompt, messages, self._message_prompt_builder
+            system_prompt,
+            messages,
+            self._message_prompt_builder,
+            use_tool_calls=self._llm.supports_tool_calls,
         )
+        tools_tokens = self._count_tools_tokens(tools)
+        system_tokens = count_message_tokens(self._llm, llm_context[0])
+        base_tokens = tools_tokens + system_tokens
+        if context_message:
+            base_tokens += count_message_tokens(self._llm, context_message)
+        message_tokens = self._count_messages_tokens(messages, llm_context[1:])
+        request_tokens = base_tokens + sum(message_tokens)
 
         if truncate_context:
-            reduced_messages = AgentMessageList(messages)
-            while (
-                self._is_context_pressure_too_high(llm_context, tools)
-                and len(reduced_messages) > 0
-            ):
-                reduced_messages.remove(reduced_messages[0])
-                llm_context = format_llm_messages(
-                    system_prompt, reduced_messages, self._message_prompt_builder
-                )
+            # Messages are rendered and counted once above; the largest suffix
+            # of messages that fits within the pressure limit is then kept.
+            start_index = get_context_window_start(
+                message_tokens,
+                self._max_context_length * self._max_context_pressure_ratio
+                - base_tokens,
+            )
+            if start_index > 0:
+                llm_context = llm_context[:1] + llm_context[start_index + 1 :]
+                message_tokens = message_tokens[start_index:]
+                request_tokens = base_tokens + sum(message_tokens)
+
+        if context_message:
+            llm_context.append(context_message)
+
+        if report_stable_prefix:
+            stable_prefix_tokens = self._get_stable_prefix_tokens(
+                tools, llm_context, [tools_tokens, system_tokens] + message_tokens
+            )
+            self._trigger_event(
+                AgentEventNames.CONTEXT_BUILT,
+                self,
+                request_tokens,
+                stable_prefix_tokens,
+            )
 
-        return llm_context
+        return flatten_llm_messages(llm_context), request_tokens
+
+    def _get_stable_prefix_tokens(
+        self,
+        tools: List[Tool],
+        llm_context: List[Dict[str, str]],
+        prefix_token_counts: List[int],
+    ) -> int:
+        # Returns the number of tokens at the start of this request that are
+        # identical to the last request: the tools, then each message up to the
+        # first one that differs. prefix_token_counts holds the token counts of
+        # the tools followed by those of the leading messages.
+        tool_names = [t.name for t in tools]
+        last_tool_names, last_llm_context = self._last_request_prefix
+        self._last_request_prefix = (tool_names, llm_context)
+        if tool_names != last_tool_names:
+            return 0
+
+        stable_prefix_tokens = prefix_token_counts[0]
+        for message, last_message, token_count in zip(
+            llm_context, last_llm_context, prefix_token_counts[1:]
+        ):
+            if message != last_message:
+                break
+            stable_prefix_tokens += token_count
+        return stable_prefix_tokens
 
     def _compress_llm_context(
         self,
@@ -520,7 +788,7 @@ class Agent(EventMixin, Runnable):
             self._messages + additional_context_messages
         )
 
-        llm_context = self._build_llm_context(
+        _, request_tokens = self._build_llm_context(
             messages=all_context_messages,
             tools=tools,
             last_error_message=last_error_message,
@@ -529,17 +797,29 @@ class Agent(EventMixin, Runnable):
             prompt_vars=prompt_vars,
         )
 
-        if self._is_context_pressure_too_high(llm_context, tools):
+        if self._is_context_pressure_too_high(request_tokens):
             # Try summarizing individual messages
             # TODO: Give the agent an opportunity to save information to Archival database
 
+            unsummarized_messages = [
+                m
+                for m in self._messages[:-1]
+                if not getattr(m, "message_summary", None)
+                and not getattr(m, "tool_output_summary", None)
+            ]
             summarize_messages(
                 llm=self._llm,
                 messages=self._messages[:-1],
                 message_prompt_builder=self._message_prompt_builder,
             )
-
-            llm_context = self._build_llm_context(
+            if self._memory_manager and self._memory_manager.conversation_memory:
+                for m in unsummarized_messages:
+                    if getattr(m, "message_summary", None) or getattr(
+                        m, "tool_output_summary", None
+                    ):
+                        self._memory_manager.conversation_memory.update(m)
+
+            _, request_tokens = self._build_llm_context(
                 messages=all_context_messages,
                 tools=tools,
                 last_error_message=last_error_message,
@@ -548,7 +828,7 @@ class Agent(EventMixin, Runnable):
                 prompt_vars=prompt_vars,
             )
 
-            if self._is_context_pressure_too_high(llm_context, tools):
+            if self._is_context_pressure_too_high(request_tokens):
                 # Try summarizing the entire conversation
 
                 last_message = self._messages[-1]
@@ -564,7 +844,7 @@ class Agent(EventMixin, Runnable):
                 all_context_messages = AgentMessageList(
                     self._messages + additional_context_messages
                 )
-                llm_context = self._build_llm_context(
+                _, request_tokens = self._build_llm_context(
                     messages=all_context_messages,
                     tools=tools,
                     last_error_message=last_error_message,
@@ -573,13 +853,13 @@ class Agent(EventMixin, Runnable):
                     prompt_vars=prompt_vars,
                 )
 
-                if self._is_context_pressure_too_high(llm_context, tools):
+                if self._is_context_pressure_too_high(request_tokens):
                     # Fire a message for group conversation compression
                     self._trigger_event(
                         AgentEventNames.CONTEXT_COMPRESSION_REQUESTED, self
                     )
 
-                    llm_context = self._build_llm_context(
+                    _, request_tokens = self._build_llm_context(
                         messages=all_context_messages,
                         tools=tools,
                         last_error_message=last_error_message,
@@ -588,31 +868,103 @@ class Agent(EventMixin, Runnable):
                         prompt_vars=prompt_vars,
                     )
 
-                    if self._is_context_pressure_too_high(llm_context, tools):
+                    if self._is_context_pressure_too_high(request_tokens):
                         print(
                             "Warning: Context compression failed to relieve pressure."
                         )
 
-    def _handle_llm_function(self, tool_message: ToolUsageMessage, tools: List[Tool]):
-        tool_starting_cost = get_total_cost()
+    async def _acompress_llm_context(self, **kwargs) -> List[AgentMessage]:
+        # Compression makes blocking summarization calls so it runs off the loop.
+        return await asyncio.to_thread(
+            functools.partial(self._compress_llm_context, **kwargs)
+        )
 
-        try:
-            tool_output = execute_tool(
-                tool_name=tool_message.tool_name,
-                tool_arguments=tool_message.tool_arguments,
-                tools=tools,
-            )
+    def _get_tool_semaphores(self, tools: List[Tool], semaphore_class) -> Dict:
+        return {
+            t.name: semaphore_class(t.max_concurrency)
+            for t in tools
+            if getattr(t, "max_concurrency", None)
+        }
 
-            agent_halted = False
-            if isinstance(tool_output, tuple):
-                tool_output, agent_halted = tool_output
+    def _handle_llm_functions(
+        self, tool_messages: List[ToolUsageMessage], tools: List[Tool]
+    ):
+        if len(tool_messages) == 1:
+            self._handle_llm_function(tool_message=tool_messages[0], tools=tools)
+            return
+
+        # Tool calls from the same turn are independent, so they run
+        # concurrently within each tool's max_concurrency limit.
+        semaphores = self._get_tool_semaphores(tools, threading.BoundedSemaphore)
+
+        def handle_llm_function(tool_message: ToolUsageMessage):
+            with semaphores.get(tool_message.tool_name, nullcontext()):
+                self._handle_llm_function(tool_message=tool_message, tools=tools)
 
-            tool_message.agent_halted = agent_halted
-            tool_message.tool_output = tool_output
-            tool_message.success = True
-        except Exception as e:
-            # traceback.print_exc()
-            tool_message.error = e
+        # The calls get their own executor rather than a shared one, since
+        # tools such as AgentTool run agents that make tool calls of their
+        # own, which could otherwise wait on each other for pool threads.
+        with ThreadPoolExecutor(
+            max_workers=min(len(tool_messages), DEFAULT_MAX_TOOL_WORKERS),
+            thread_name_prefix="bondai-tool",
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, handle_llm_function, m)
+                for m in tool_messages
+            ]
+            for future in futures:
+                future.result()
+
+    async def _ahandle_llm_functions(
+        self, tool_messages: List[ToolUsageMessage], tools: List[Tool]
+    ):
+        semaphores = self._get_tool_semaphores(tools, asyncio.Semaphore)
+
+        async def handle_llm_function(tool_message: ToolUsageMessage):
+            async with semaphores.get(tool_message.tool_name, nullcontext()):
+                await self._ahandle_llm_function(tool_message=tool_message, tools=tools)
+
+        await asyncio.gather(*[handle_llm_function(m) for m in tool_messages])
+
+    def _handle_llm_function(self, tool_message: ToolUsageMessage, tools: List[Tool]):
+        with track_costs() as tool_costs:
+            try:
+                tool_output = execute_tool(
+                    tool_name=tool_message.tool_name,
+                    tool_arguments=tool_message.tool_arguments,
+                    tools=tools,
+                )
+                self._set_tool_output(tool_message, tool_output)
+            except Exception as e:
+                # traceback.print_exc()
+                tool_message.error = e
+
+        tool_message.completed_at = datetime.now()
+        tool_message.cost = tool_costs.total_cost
+
+    async def _ahandle_llm_function(
+        self, tool_message: ToolUsageMessage, tools: List[Tool]
+    ):
+        with track_costs() as tool_costs:
+            try:
+                tool_output = await aexecute_tool(
+                    tool_name=tool_message.tool_name,
+                    tool_arguments=tool_message.tool_arguments,
+                    tools=tools,
+                    executor=self._tool_executor,
+                )
+                self._set_tool_output(tool_message, tool_output)
+            except Exception as e:
+                tool_message.error = e
 
         tool_message.completed_at = datetime.now()
-        tool_message.cost = get_total_cost() - tool_starting_cost
+        tool_message.cost = tool_costs.total_cost
+
+    def _set_tool_output(self, tool_message: ToolUsageMessage, tool_output):
+        agent_halted = False
+        if isinstance(tool_output, tuple):
+            tool_output, agent_halted = tool_output
+
+        tool_message.agent_halted = agent_halted
+        tool_message.tool_output = tool_output
+        tool_message.success = True
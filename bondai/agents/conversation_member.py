@@ -1,4 +1,6 @@
 import uuid
+import asyncio
+import functools
 from abc import ABC, abstractmethod
 from enum import Enum
 from typing import List, Callable
@@ -75,5 +77,27 @@ class ConversationMember(ABC):
     ):
         pass
 
+    async def asend_message(
+        self,
+        message: str | ConversationMessage,
+        sender_name: str = USER_MEMBER_NAME,
+        group_members: List | None = None,
+        group_messages: List[AgentMessage] | None = None,
+        max_attempts: int = DEFAULT_MAX_SEND_ATTEMPTS,
+        require_response: bool = True,
+    ) -> (str, str, bool):
+        # Default shim for members without a native async implementation.
+        return await asyncio.to_thread(
+            functools.partial(
+                self.send_message,
+                message=message,
+                sender_name=sender_name,
+                group_members=group_members,
+                group_messages=group_messages,
+                max_attempts=max_attempts,
+                require_response=require_response,
+            )
+        )
+
     def clear_messages(self):
         pass
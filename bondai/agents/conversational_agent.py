@@ -2,7 +2,7 @@ import os
 import traceback
 import json
 from datetime import datetime
-from typing import Dict, List, Callable
+from typing import Dict, List, Callable, Generator, Tuple
 from bondai.util import load_local_resource
 from bondai.tools import Tool
 from bondai.memory import MemoryManager
@@ -25,6 +25,8 @@ from .util import (
     AgentException,
     AgentEventNames,
     parse_response_content_message,
+    run_steps,
+    arun_steps,
 )
 from .prompts import DEFAULT_AGENT_NAME, DEFAULT_CONVERSATIONAL_INSTRUCTIONS
 from .conversation_member import ConversationMember, ConversationMemberEventNames
@@ -65,6 +67,7 @@ class ConversationalAgent(Agent, ConversationMember):
         enable_conversation_tools: bool = True,
         enable_conversational_content_responses: bool = True,
         enable_exit_conversation: bool = True,
+        enable_stable_prompt_prefix: bool = False,
         quiet: bool = True,
     ):
         if llm is None:
@@ -97,6 +100,7 @@ class ConversationalAgent(Agent, ConversationMember):
             max_tool_retries=max_tool_retries,
             enable_context_compression=enable_context_compression,
             enable_final_answer_tool=False,
+            enable_stable_prompt_prefix=enable_stable_prompt_prefix,
             allowed_events=[
                 AgentEventNames.CONTEXT_COMPRESSION_REQUESTED,
                 AgentEventNames.TOOL_SELECTED,
@@ -104,6 +108,7 @@ class ConversationalAgent(Agent, ConversationMember):
                 AgentEventNames.TOOL_COMPLETED,
                 AgentEventNames.STREAMING_CONTENT_UPDATED,
                 AgentEventNames.STREAMING_FUNCTION_UPDATED,
+                AgentEventNames.CONTEXT_BUILT,
                 ConversationMemberEventNames.MESSAGE_RECEIVED,
                 ConversationMemberEventNames.MESSAGE_ERROR,
                 ConversationMemberEventNames.MESSAGE_COMPLETED,
@@ -162,6 +167,47 @@ class ConversationalAgent(Agent, ConversationMember):
         max_attempts: int = DEFAULT_MAX_SEND_ATTEMPTS,
         require_response: bool = True,
     ) -> ConversationMessage | None:
+        return run_steps(
+            self._send_message_steps(
+                message=message,
+                sender_name=sender_name,
+                group_members=group_members,
+                group_messages=group_messages,
+                max_attempts=max_attempts,
+                require_response=require_response,
+            )
+        )
+
+    async def asend_message(
+        self,
+        message: str | ConversationMessage,
+        sender_name: str = USER_MEMBER_NAME,
+        group_members: List[ConversationMember] | None = None,
+        group_messages: List[AgentMessage] | None = None,
+        max_attempts: int = DEFAULT_MAX_SEND_ATTEMPTS,
+        require_response: bool = True,
+    ) -> ConversationMessage | None:
+        """Sends a message to the agent as a coroutine on the running event loop."""
+        return await arun_steps(
+            self._send_message_steps(
+                message=message,
+                sender_name=sender_name,
+                group_members=group_members,
+                group_messages=group_messages,
+                max_attempts=max_attempts,
+                require_response=require_response,
+            )
+        )
+
+    def _send_message_steps(
+        self,
+        message: str | ConversationMessage,
+        sender_name: str = USER_MEMBER_NAME,
+        group_members: List[ConversationMember] | None = None,
+        group_messages: List[AgentMessage] | None = None,
+        max_attempts: int = DEFAULT_MAX_SEND_ATTEMPTS,
+        require_response: bool = True,
+    ) -> Generator[Tuple, object, ConversationMessage | None]:
         if group_members is None:
             group_members = []
         if group_messages is None:
@@ -192,6 +238,9 @@ class ConversationalAgent(Agent, ConversationMember):
 
         attempts = 0
         starting_cost = get_total_cost()
+        # Reset once per message. The tool loop never resets it, so a stop()
+        # made while the message is handled is never lost.
+        self._stop_event.clear()
         self._status = AgentStatus.RUNNING
         self._messages.add(agent_message)
         if self._memory_manager and self._memory_manager.conversation_memory:
@@ -208,6 +257,8 @@ class ConversationalAgent(Agent, ConversationMember):
             agent_message.error = error
             agent_message.cost = get_total_cost() - starting_cost
             agent_message.completed_at = datetime.now()
+            if self._memory_manager and self._memory_manager.conversation_memory:
+                self._memory_manager.conversation_memory.update(agent_message)
             if success:
                 self._trigger_event(
                     ConversationMemberEventNames.MESSAGE_COMPLETED, self, agent_message
@@ -238,7 +289,7 @@ class ConversationalAgent(Agent, ConversationMember):
             complete_agent_message(success=True)
             return
 
-        while not self._force_stop:
+        while not self.stop_requested:
             try:
                 attempts += 1
                 if attempts > max_attempts:
@@ -255,7 +306,7 @@ class ConversationalAgent(Agent, ConversationMember):
                     "enable_exit_conversation": self._enable_exit_conversation,
                 }
 
-                tool_result = self._run_tool_loop(
+                tool_result = yield from self._tool_loop_steps(
                     addition_context_messages=group_messages,
                     tools=self._tools,
                     conversation_members=group_members,
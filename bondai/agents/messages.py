@@ -1,6 +1,9 @@
 import uuid
+import bisect
+import itertools
 from abc import ABC
-from typing import List, Dict, Set
+from collections.abc import Sequence
+from typing import List, Dict, Hashable, Tuple
 from datetime import datetime
 from dataclasses import dataclass, field, is_dataclass
 
@@ -17,6 +20,26 @@ class AgentMessage(ABC):
     role: str | None = field(default=None)
     timestamp: datetime = field(default_factory=lambda: datetime.now())
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Any change to a public field (e.g. a summary or tool output being set)
+        # invalidates the cached token counts and prompts for this message.
+        if not name.startswith("_"):
+            self.__dict__.pop("_token_counts", None)
+            self.__dict__.pop("_prompts", None)
+
+    def get_token_count(self, cache_key: Hashable) -> int | None:
+        return self.__dict__.get("_token_counts", {}).get(cache_key)
+
+    def set_token_count(self, cache_key: Hashable, token_count: int):
+        self.__dict__.setdefault("_token_counts", {})[cache_key] = token_count
+
+    def get_cached_prompt(self, cache_key: Hashable) -> str | None:
+        return self.__dict__.get("_prompts", {}).get(cache_key)
+
+    def set_cached_prompt(self, cache_key: Hashable, prompt: str):
+        self.__dict__.setdefault("_prompts", {})[cache_key] = prompt
+
 
 @dataclass
 class SystemMessage(AgentMessage):
@@ -50,6 +73,7 @@ class ConversationMessage(AgentMessage):
 class ToolUsageMessage(AgentMessage):
     role: str = field(default="function")
     tool_name: str | None = field(default=None)
+    tool_call_id: str | None = field(default=None)
     tool_arguments: Dict | None = field(default=None)
     tool_output: str | None = field(default=None)
     tool_output_summary: str | None = field(default=None)
@@ -81,7 +105,7 @@ def message_to_dict(message: AgentMessage) -> Dict:
     message_dict = {
         k: custom_serialization(v)
         for k, v in message.__dict__.items()
-        if k != "children"
+        if k != "children" and not k.startswith("_")
     }
     message_dict["type"] = type(message).__name__  # Add the type for deserialization
     if "children" in message.__dict__:
@@ -92,57 +116,208 @@ def message_to_dict(message: AgentMessage) -> Dict:
     return message_dict
 
 
+def message_from_dict(data: Dict) -> AgentMessage:
+    """
+    Create an AgentMessage object from a dictionary created by message_to_dict.
+    """
+    item = dict(data)
+    item_type = item.pop("type")
+    if item_type == "ConversationMessage":
+        message = ConversationMessage(**item)
+    elif item_type == "ToolUsageMessage":
+        message = ToolUsageMessage(**item)
+    elif item_type == "SystemMessage":
+        message = SystemMessage(**item)
+    elif item_type == "SummaryMessage":
+        message = SummaryMessage(**item)
+    # elif item_type == 'MemoryWarningMessage':
+    #     message = MemoryWarningMessage(**item)
+    else:
+        raise ValueError(f"Unknown message type: {item_type}")
+
+    if "timestamp" in item:
+        message.timestamp = datetime.fromisoformat(item["timestamp"])
+    if "completed_at" in item and item["completed_at"]:
+        message.completed_at = datetime.fromisoformat(item["completed_at"])
+    return message
+
+
+class AgentMessageView(Sequence):
+    """
+    A read-only view over slices of one or more message lists, returned when
+    slicing or concatenating an AgentMessageList. Views do not copy the
+    underlying lists, so they should not be used after those lists change.
+    """
+
+    def __init__(self, segments: List[Tuple[List[AgentMessage], int, int]]):
+        self._segments = [s for s in segments if s[2] > s[1]]
+        self._length = sum(stop - start for _, start, stop in self._segments)
+
+    @staticmethod
+    def _get_segments(
+        other: "List[AgentMessage] | AgentMessageList | AgentMessageView",
+    ) -> List[Tuple[List[AgentMessage], int, int]]:
+        if isinstance(other, AgentMessageView):
+            return other._segments
+        elif isinstance(other, AgentMessageList):
+            return [(other._items, 0, len(other._items))]
+        elif isinstance(other, list):
+            return [(other, 0, len(other))]
+        else:
+            raise TypeError(
+                f"Unsupported operand type(s) for +: 'AgentMessageView' and '{type(other).__name__}'"
+            )
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return list(self)[index]
+
+            segments = []
+            for items, segment_start, segment_stop in self._segments:
+                segment_length = segment_stop - segment_start
+                if start < segment_length and stop > 0:
+                    segments.append(
+                        (
+                            items,
+                            segment_start + max(start, 0),
+                            segment_start + min(stop, segment_length),
+                        )
+                    )
+                start -= segment_length
+                stop -= segment_length
+            return AgentMessageView(segments)
+
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("AgentMessageView index out of range")
+        for items, segment_start, segment_stop in self._segments:
+            if index < segment_stop - segment_start:
+                return items[segment_start + index]
+            index -= segment_stop - segment_start
+
+    def __add__(self, other):
+        return AgentMessageView(self._segments + self._get_segments(other))
+
+    def __radd__(self, other):
+        return AgentMessageView(self._get_segments(other) + self._segments)
+
+    def __iter__(self):
+        for items, start, stop in self._segments:
+            for i in range(start, stop):
+                yield items[i]
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return f"AgentMessageView({list(self)!r})"
+
+
 class AgentMessageList:
     def __init__(self, messages: List[AgentMessage] | None = None):
+        # Messages are kept sorted by timestamp with a parallel list of
+        # timestamps for bisection, plus an id index for membership checks.
         self._items: List[AgentMessage] = []
-        self._ids: Set[str] = set()
+        self._timestamps: List[datetime] = []
+        self._messages_by_id: Dict[str, AgentMessage] = {}
         if messages:
-            for message in messages:
-                self.add(message)
+            self.extend(messages)
 
     def add(self, item: AgentMessage):
-        if item.id not in self._ids:
-            self._ids.add(item.id)
-            self._items.append(item)
-            self._items = list(sorted(self._items, key=lambda x: x.timestamp))
+        if item.id not in self._messages_by_id:
+            self._messages_by_id[item.id] = item
+            # Messages usually arrive in timestamp order so this is almost
+            # always an append.
+            index = bisect.bisect_right(self._timestamps, item.timestamp)
+            self._items.insert(index, item)
+            self._timestamps.insert(index, item.timestamp)
+
+    def extend(self, items: "List[AgentMessage] | AgentMessageList | AgentMessageView"):
+        new_items = []
+        for item in items:
+            if item.id not in self._messages_by_id:
+                self._messages_by_id[item.id] = item
+                new_items.append(item)
+
+        if new_items:
+            first_new_index = len(self._items)
+            self._items.extend(new_items)
+            self._timestamps.extend(item.timestamp for item in new_items)
+            if any(
+                a > b
+                for a, b in itertools.pairwise(
+                    self._timestamps[max(first_new_index - 1, 0) :]
+                )
+            ):
+                # A single stable sort (near linear for the sorted runs produced
+                # by concatenated lists) instead of one insert per message.
+                self._items.sort(key=lambda x: x.timestamp)
+                self._timestamps = [item.timestamp for item in self._items]
+
+    def get(self, message_id: str) -> AgentMessage | None:
+        return self._messages_by_id.get(message_id)
+
+    def index(self, item: AgentMessage) -> int:
+        message = self._messages_by_id.get(item.id)
+        if message is not None:
+            index = bisect.bisect_left(self._timestamps, message.timestamp)
+            while (
+                index < len(self._items)
+                and self._timestamps[index] == message.timestamp
+            ):
+                if self._items[index] is message:
+                    return index
+                index += 1
+        raise ValueError(f"Message {item.id} is not in the list.")
 
     def remove(self, item: AgentMessage):
-        if item.id in self._ids:
-            self._ids.remove(item.id)
-            self._items.remove(item)
+        if item.id in self._messages_by_id:
+            index = self.index(item)
+            del self._messages_by_id[item.id]
+            del self._items[index]
+            del self._timestamps[index]
 
     def remove_after(self, timestamp: datetime, inclusive: bool = True):
         if inclusive:
-            self._items = [item for item in self._items if item.timestamp <= timestamp]
+            index = bisect.bisect_right(self._timestamps, timestamp)
         else:
-            self._items = [item for item in self._items if item.timestamp < timestamp]
-        self._ids = set([item.id for item in self._items])
+            index = bisect.bisect_left(self._timestamps, timestamp)
+
+        for i in range(index, len(self._items)):
+            del self._messages_by_id[self._items[i].id]
+        del self._items[index:]
+        del self._timestamps[index:]
 
     def clear(self):
         self._items = []
-        self._ids = set()
-
-    def __getitem__(self, index: int):
+        self._timestamps = []
+        self._messages_by_id = {}
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._items))
+            if step == 1:
+                return AgentMessageView([(self._items, start, stop)])
         return self._items[index]
 
-    def __add__(self, other: List[AgentMessage] | "AgentMessageList"):
-        if isinstance(other, AgentMessageList):
-            # If the other object is also an AgentMessageList, extend with its items
-            return self._items + other._items
-        elif isinstance(other, list):
-            # If the other object is a list, just concatenate the lists
-            return self._items + other
-        else:
+    def __add__(
+        self, other: "List[AgentMessage] | AgentMessageList | AgentMessageView"
+    ) -> AgentMessageView:
+        if not isinstance(other, (list, AgentMessageList, AgentMessageView)):
             # If the other object is neither, raise an exception
             raise TypeError(
                 f"Unsupported operand type(s) for +: 'AgentMessageList' and '{type(other).__name__}'"
             )
+        return AgentMessageView([(self._items, 0, len(self._items))]) + other
 
     def __iter__(self):
         return iter(self._items)
 
     def __contains__(self, item):
-        return item.id in self._ids
+        return item.id in self._messages_by_id
 
     def __len__(self):
         return len(self._items)
@@ -158,27 +333,4 @@ class AgentMessageList:
         """
         Create an AgentMessageList from a list of dictionaries.
         """
-        list_instance = cls()
-        for item in data:
-            item_type = item["type"]
-            del item["type"]
-            if item_type == "ConversationMessage":
-                message = ConversationMessage(**item)
-            elif item_type == "ToolUsageMessage":
-                message = ToolUsageMessage(**item)
-            elif item_type == "SystemMessage":
-                message = SystemMessage(**item)
-            elif item_type == "SummaryMessage":
-                message = SummaryMessage(**item)
-            # elif item_type == 'MemoryWarningMessage':
-            #     message = MemoryWarningMessage(**item)
-            else:
-                raise ValueError(f"Unknown message type: {item_type}")
-
-            if "timestamp" in item:
-                message.timestamp = datetime.fromisoformat(item["timestamp"])
-            if "completed_at" in item and item["completed_at"]:
-                message.completed_at = datetime.fromisoformat(item["completed_at"])
-            list_instance.add(message)
-
-        return list_instance
+        return cls([message_from_dict(item) for item in data])
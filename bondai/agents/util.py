@@ -1,8 +1,15 @@
 import json
+import bisect
+import asyncio
+import contextvars
 import inspect
+import functools
+import itertools
+import threading
 import traceback
 from enum import Enum
-from typing import List, Dict, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, List, Dict, Callable, Generator
 from bondai.models import LLM
 from bondai.tools import Tool
 from .messages import AgentMessage
@@ -36,6 +43,73 @@ class AgentEventNames(Enum):
     TOOL_COMPLETED: str = "tool_completed"
     STREAMING_CONTENT_UPDATED: str = "streaming_content_updated"
     STREAMING_FUNCTION_UPDATED: str = "streaming_function_updated"
+    CONTEXT_BUILT: str = "context_built"
+
+
+DEFAULT_MAX_TOOL_WORKERS = 32
+
+_tool_executor: ThreadPoolExecutor | None = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """Returns the bounded executor shared by all agents for running sync tools from async loops."""
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(
+                max_workers=DEFAULT_MAX_TOOL_WORKERS,
+                thread_name_prefix="bondai-tool",
+            )
+        return _tool_executor
+
+
+def run_steps(steps: Generator) -> Any:
+    """
+    Drives a step generator synchronously. Each yielded step is a
+    (handler, async_handler, kwargs) tuple; the handler's result (or error)
+    is sent back into the generator and its return value is returned.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                if error:
+                    step = steps.throw(error)
+                else:
+                    step = steps.send(result)
+            except StopIteration as e:
+                return e.value
+
+            handler, _, kwargs = step
+            try:
+                result, error = handler(**kwargs), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        steps.close()
+
+
+async def arun_steps(steps: Generator) -> Any:
+    """Drives a step generator on the event loop, awaiting each step's async handler."""
+    result, error = None, None
+    try:
+        while True:
+            try:
+                if error:
+                    step = steps.throw(error)
+                else:
+                    step = steps.send(result)
+            except StopIteration as e:
+                return e.value
+
+            _, async_handler, kwargs = step
+            try:
+                result, error = await async_handler(**kwargs), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        steps.close()
 
 
 def count_request_tokens(
@@ -50,31 +124,40 @@ def count_request_tokens(
     return message_tokens + functions_tokens
 
 
+def count_message_tokens(llm: LLM, llm_message: Dict[str, str]) -> int:
+    return llm.count_tokens(json.dumps(llm_message))
+
+
+def count_messages_tokens(llm: LLM, llm_messages: List[Dict[str, str]]) -> List[int]:
+    return llm.count_tokens_many([json.dumps(m) for m in llm_messages])
+
+
+def count_tools_tokens(llm: LLM, tools: List[Tool]) -> List[int]:
+    return llm.count_tokens_many([json.dumps(t.get_tool_function()) for t in tools])
+
+
+def get_context_window_start(token_counts: List[int], max_tokens: float) -> int:
+    """
+    Returns the index of the first message in the largest suffix of messages
+    whose combined token count does not exceed max_tokens.
+    """
+    prefix_sums = list(itertools.accumulate(token_counts, initial=0))
+    excess_tokens = prefix_sums[-1] - max_tokens
+    if excess_tokens <= 0:
+        return 0
+    return min(bisect.bisect_left(prefix_sums, excess_tokens), len(token_counts))
+
+
 def execute_tool(
     tool_name: str,
     tools: List[Tool],
     tool_arguments: Dict = {},
 ):
-    selected_tool = next((t for t in tools if t.name == tool_name), None)
-    if not selected_tool:
-        raise AgentException(
-            f"You attempted to use a tool: '{tool_name}'. This tool does not exist."
-        )
+    selected_tool = get_selected_tool(tool_name, tools)
 
     try:
-        if tool_supports_unpacking(selected_tool.run):
-            errors = validate_tool_params(selected_tool.run, tool_arguments)
-            if len(errors) > 0:
-                raise AgentException(
-                    f"The following errors occurred using '{tool_name}': {', '.join(errors)}"
-                )
-            output = selected_tool.run(**tool_arguments)
-        else:
-            output = selected_tool.run(tool_arguments)
-
-        if not output or (isinstance(output, str) and len(output.strip()) == 0):
-            output = f"Tool '{tool_name}' ran successfully with no output."
-        return output
+        output = call_tool_function(tool_name, selected_tool.run, tool_arguments)
+        return format_tool_output(tool_name, output)
     except Exception as e:
         # print(e)
         # traceback.print_exc()
@@ -83,6 +166,64 @@ def execute_tool(
         )
 
 
+async def aexecute_tool(
+    tool_name: str,
+    tools: List[Tool],
+    tool_arguments: Dict = {},
+    executor: Executor | None = None,
+):
+    selected_tool = get_selected_tool(tool_name, tools)
+
+    if not tool_supports_async(selected_tool):
+        # Sync tools run in a bounded executor so they never block the loop.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor or get_tool_executor(),
+            contextvars.copy_context().run,
+            functools.partial(
+                execute_tool,
+                tool_name=tool_name,
+                tools=[selected_tool],
+                tool_arguments=tool_arguments,
+            ),
+        )
+
+    try:
+        output = await call_tool_function(tool_name, selected_tool.arun, tool_arguments)
+        return format_tool_output(tool_name, output)
+    except Exception as e:
+        raise AgentException(
+            f"The following error occurred using '{tool_name}': {str(e)}"
+        )
+
+
+def get_selected_tool(tool_name: str, tools: List[Tool]) -> Tool:
+    selected_tool = next((t for t in tools if t.name == tool_name), None)
+    if not selected_tool:
+        raise AgentException(
+            f"You attempted to use a tool: '{tool_name}'. This tool does not exist."
+        )
+    return selected_tool
+
+
+def call_tool_function(tool_name: str, func: Callable, tool_arguments: Dict):
+    if tool_supports_unpacking(func):
+        errors = validate_tool_params(func, tool_arguments)
+        if len(errors) > 0:
+            raise AgentException(
+                f"The following errors occurred using '{tool_name}': {', '.join(errors)}"
+            )
+        return func(**tool_arguments)
+    else:
+        return func(tool_arguments)
+
+
+def format_tool_output(tool_name: str, output):
+    if not output or (isinstance(output, str) and len(output.strip()) == 0):
+        output = f"Tool '{tool_name}' ran successfully with no output."
+    return output
+
+
 def validate_tool_params(func, params):
     errors = []
     sig = inspect.signature(func)
@@ -105,6 +246,10 @@ def validate_tool_params(func, params):
     return errors
 
 
+def tool_supports_async(tool: Tool) -> bool:
+    return inspect.iscoroutinefunction(getattr(tool, "arun", None))
+
+
 def tool_supports_unpacking(func):
     sig = inspect.signature(func)
     parameters = list(sig.parameters.values())
@@ -138,7 +283,15 @@ def format_llm_messages(
     system_prompt: str,
     messages: List[AgentMessage],
     message_prompt_builder: Callable[..., str],
-) -> List[Dict[str, str]]:
+    use_tool_calls: bool = False,
+) -> List[Dict | List[Dict]]:
+    """
+    Returns the system prompt followed by one entry per message. If
+    use_tool_calls is set, a tool usage with a tool call id is formatted as
+    a list holding the assistant message requesting the tool call and the
+    tool message with its result, so the entries must be expanded with
+    flatten_llm_messages before they are sent.
+    """
     llm_messages = [{"role": "system", "content": system_prompt}]
 
     for message in messages:
@@ -146,10 +299,50 @@ def format_llm_messages(
             message=message, message_type=message.__class__.__name__
         ).strip()
         if message.role == "function":
-            llm_messages.append(
-                {"role": message.role, "name": message.tool_name, "content": content}
-            )
+            tool_call_id = getattr(message, "tool_call_id", None)
+            if use_tool_calls and tool_call_id:
+                llm_messages.append(
+                    [
+                        {
+                            "role": "assistant",
+                            "content": None,
+                            "tool_calls": [
+                                {
+                                    "id": tool_call_id,
+                                    "type": "function",
+                                    "function": {
+                                        "name": message.tool_name,
+                                        "arguments": json.dumps(
+                                            message.tool_arguments or {}
+                                        ),
+                                    },
+                                }
+                            ],
+                        },
+                        {
+                            "role": "tool",
+                            "tool_call_id": tool_call_id,
+                            "content": content,
+                        },
+                    ]
+                )
+            else:
+                llm_messages.append(
+                    {
+                        "role": message.role,
+                        "name": message.tool_name,
+                        "content": content,
+                    }
+                )
         else:
             llm_messages.append({"role": message.role, "content": content})
 
     return llm_messages
+
+
+def flatten_llm_messages(llm_messages: List[Dict | List[Dict]]) -> List[Dict]:
+    return [
+        m
+        for entry in llm_messages
+        for m in (entry if isinstance(entry, list) else [entry])
+    ]
@@ -8,6 +8,7 @@ from .archival.datasources import (
     InMemoryArchivalMemoryDataSource,
     PersistentArchivalMemoryDataSource,
 )
+from .archival.indexes import ArchivalIndexType, ArchivalMemoryIndex
 from .archival.tools import ArchivalMemoryInsertTool, ArchivalMemorySearchTool
 from .conversation.datasources import (
     ConversationMemoryDataSource,
@@ -37,6 +38,8 @@ __all__ = [
     "ArchivalMemoryDataSource",
     "PersistentArchivalMemoryDataSource",
     "InMemoryArchivalMemoryDataSource",
+    "ArchivalIndexType",
+    "ArchivalMemoryIndex",
     "ArchivalMemoryInsertTool",
     "ArchivalMemorySearchTool",
     "ConversationMemoryDataSource",
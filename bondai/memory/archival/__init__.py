@@ -1,9 +1,13 @@
 from .datasources import ArchivalMemoryDataSource, PersistentArchivalMemoryDataSource
+from .indexes import ArchivalIndexType, ArchivalMemoryIndex, evaluate_index
 from .tools import ArchivalMemoryInsertTool, ArchivalMemorySearchTool
 
 __all__ = [
     "ArchivalMemoryDataSource",
     "PersistentArchivalMemoryDataSource",
+    "ArchivalIndexType",
+    "ArchivalMemoryIndex",
+    "evaluate_index",
     "ArchivalMemoryInsertTool",
     "ArchivalMemorySearchTool",
 ]
@@ -1,11 +1,24 @@
 import os
 import json
+import threading
 import numpy as np
-import faiss
-from typing import List
+from typing import Any, Dict, List, Tuple
 from abc import ABC, abstractmethod
 from bondai.models import EmbeddingModel
 from bondai.models.openai import OpenAIEmbeddingModel, OpenAIModelNames
+from .indexes import ArchivalIndexType, ArchivalMemoryIndex, evaluate_index
+from .search_sessions import (
+    SearchSession,
+    SearchSessionCache,
+    DEFAULT_SEARCH_SESSION_TTL,
+    DEFAULT_SEARCH_SESSION_PAGES,
+)
+
+DEFAULT_COMPACTION_MIN_ROWS = 1000
+DEFAULT_INDEX_CHECKPOINT_MIN_RECORDS = 1000
+DEFAULT_INDEX_CHECKPOINT_RATIO = 0.1
+
+_search_sessions_lock = threading.Lock()
 
 
 class ArchivalMemoryDataSource(ABC):
@@ -15,156 +28,530 @@ class ArchivalMemoryDataSource(ABC):
         pass
 
     @abstractmethod
-    def insert(self, content: str):
+    def insert(self, content: str) -> int:
         pass
 
     @abstractmethod
-    def insert_bulk(self, content: List[str]):
+    def insert_bulk(self, content: List[str]) -> List[int]:
+        pass
+
+    def remove(self, memory_id: int):
         pass
 
     @abstractmethod
     def search(self, query: str, page: int = 0) -> List[str]:
         pass
 
+    def open_search_session(self, query: str) -> str:
+        """
+        Returns a cursor id that get_search_page can be called with to page
+        through the results for query. By default pages are retrieved with
+        search.
+        """
+        search_sessions = self._get_search_sessions()
+        session = search_sessions.find(query)
+        if session is None:
+            session = search_sessions.add(SearchSession(query=query))
+        return session.cursor
+
+    def get_search_page(
+        self, cursor: str, page: int = 0, query: str | None = None
+    ) -> List[str] | None:
+        """
+        Returns a page of results, or None if the cursor has expired or, when
+        query is given, was opened for a different query.
+        """
+        session = self._get_search_session(cursor, query)
+        if session is None:
+            return None
+        return self.search(session.query, page)
+
     @abstractmethod
     def clear(self):
         pass
 
+    def _get_search_session(
+        self, cursor: str, query: str | None = None
+    ) -> SearchSession | None:
+        session = self._get_search_sessions().get(cursor)
+        if session is None or (query is not None and session.query != query):
+            return None
+        return session
 
-class PersistentArchivalMemoryDataSource(ArchivalMemoryDataSource):
+    def _get_search_sessions(self) -> SearchSessionCache:
+        with _search_sessions_lock:
+            if getattr(self, "_search_sessions", None) is None:
+                self._search_sessions = SearchSessionCache()
+            return self._search_sessions
+
+
+class InMemoryArchivalMemoryDataSource(ArchivalMemoryDataSource):
     def __init__(
         self,
-        file_path: str = "./.memory/archival-memory.json",
         embedding_model: EmbeddingModel | None = None,
         page_size=10,
+        index_type: ArchivalIndexType | str = ArchivalIndexType.FLAT,
+        index_params: Dict[str, Any] | None = None,
+        search_session_ttl: float = DEFAULT_SEARCH_SESSION_TTL,
     ):
         if embedding_model is None:
             embedding_model = OpenAIEmbeddingModel(
                 OpenAIModelNames.TEXT_EMBEDDING_ADA_002
             )
 
-        self._file_path = file_path
         self._embedding_model = embedding_model
         self._page_size = page_size
-        self._data = self._load_data()
-        self._index = faiss.IndexFlatL2(self._embedding_model.embedding_size)
-        self._rebuild_index()
+        self._index_type = ArchivalIndexType(index_type)
+        self._index_params = index_params or {}
+        self._data: Dict[int, str] = {}
+        # Ids are never reused, even after the memories are removed.
+        self._next_id = 0
+        # Guards the index and the stored memories, since tools may insert
+        # and search concurrently.
+        self._lock = threading.RLock()
+        self._index = self._create_index()
+        # Incremented whenever the index changes so that search sessions know
+        # to refresh their candidates.
+        self._index_version = 0
+        self._search_sessions = SearchSessionCache(ttl=search_session_ttl)
 
     @property
     def size(self) -> int:
         return len(self._data)
 
+    @property
+    def index(self) -> ArchivalMemoryIndex:
+        return self._index
+
+    def _create_index(self) -> ArchivalMemoryIndex:
+        return ArchivalMemoryIndex(
+            self._embedding_model.embedding_size,
+            index_type=self._index_type,
+            **self._index_params,
+        )
+
+    def _create_embeddings(self, content: List[str]) -> np.ndarray:
+        embeddings = self._embedding_model.create_embedding(content)
+        return np.array(embeddings, dtype="float32").reshape(len(content), -1)
+
+    def insert(self, content: str) -> int:
+        return self.insert_bulk([content])[0]
+
+    def insert_bulk(self, content: List[str]) -> List[int]:
+        if not content:
+            return []
+        return self._add(content, self._create_embeddings(content))
+
+    def _add(self, content: List[str], embeddings: np.ndarray) -> List[int]:
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + len(content), dtype="int64")
+            self._next_id += len(content)
+            self._index.add(embeddings, ids)
+            self._index_version += 1
+            for memory_id, c in zip(ids.tolist(), content):
+                self._data[memory_id] = c
+            return ids.tolist()
+
+    def remove(self, memory_id: int):
+        with self._lock:
+            if memory_id in self._data:
+                del self._data[memory_id]
+                self._index.remove(np.array([memory_id], dtype="int64"))
+                self._index_version += 1
+
+    def search(self, query: str, page: int = 0) -> List[str]:
+        return self.get_search_page(self.open_search_session(query), page)
+
+    def open_search_session(self, query: str) -> str:
+        """
+        Returns a cursor id that get_search_page can be called with to page
+        through the results for query. A live session for the same query is
+        reused, so paging does not embed the query again.
+        """
+        session = self._search_sessions.find(query)
+        if session is None:
+            session = self._search_sessions.add(
+                SearchSession(
+                    query=query, query_embedding=self._create_embeddings([query])
+                )
+            )
+        return session.cursor
+
+    def get_search_page(
+        self, cursor: str, page: int = 0, query: str | None = None
+    ) -> List[str] | None:
+        session = self._get_search_session(cursor, query)
+        if session is None:
+            return None
+        return self._get_session_page(session, page)
+
+    def _get_session_page(self, session: SearchSession, page: int) -> List[str]:
+        with self._lock:
+            start_idx = page * self._page_size
+            end_idx = start_idx + self._page_size
+
+            version, ids = session.version, session.ids
+            if version != self._index_version or (
+                end_idx > len(ids) and len(ids) < self.size
+            ):
+                # Several pages of candidates are fetched at once; they are only
+                # searched again when the index changes or paging runs past them.
+                version = self._index_version
+                k = max(
+                    end_idx,
+                    len(ids) * 2,
+                    self._page_size * DEFAULT_SEARCH_SESSION_PAGES,
+                )
+                _, results = self._index.search(session.query_embedding, k)
+                ids = [i for i in results[0].tolist() if i != -1]
+                session.version, session.ids = version, ids
+
+            return [self._data[i] for i in ids[start_idx:end_idx] if i in self._data]
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._index = self._create_index()
+            self._index_version += 1
+
+
+class PersistentArchivalMemoryDataSource(InMemoryArchivalMemoryDataSource):
+    """
+    Stores archival memories in two files: a JSON Lines log of memory metadata
+    at file_path and a sidecar of raw float32 embeddings (one row per memory).
+    Inserts append to both files and add to the index incrementally, so their
+    cost does not depend on the size of the archive. Removals are logged as
+    tombstones and dead embedding rows are compacted away once they outnumber
+    the live ones. Archives in the previous JSON format are migrated on load.
+
+    The search index is checkpointed to a third file together with the log
+    offset it reflects. On load the checkpoint is memory-mapped and only the
+    log records written after it are applied, so opening an archive does not
+    read its embeddings or rebuild its index.
+    """
+
+    def __init__(
+        self,
+        file_path: str = "./.memory/archival-memory.json",
+        embedding_model: EmbeddingModel | None = None,
+        page_size=10,
+        index_type: ArchivalIndexType | str = ArchivalIndexType.FLAT,
+        index_params: Dict[str, Any] | None = None,
+        search_session_ttl: float = DEFAULT_SEARCH_SESSION_TTL,
+    ):
+        InMemoryArchivalMemoryDataSource.__init__(
+            self,
+            embedding_model=embedding_model,
+            page_size=page_size,
+            index_type=index_type,
+            index_params=index_params,
+            search_session_ttl=search_session_ttl,
+        )
+        self._file_path = file_path
+        base_path = os.path.splitext(file_path)[0]
+        self._embeddings_file_path = f"{base_path}.embeddings.f32"
+        self._index_file_path = f"{base_path}.index"
+        self._index_state_file_path = f"{base_path}.index.json"
+        self._rows: Dict[int, int] = {}
+        self._row_count = 0
+        self._records_since_checkpoint = 0
+        self._load_data()
+
+    @property
+    def _row_size(self) -> int:
+        return self._embedding_model.embedding_size * np.dtype("float32").itemsize
+
     def _load_data(self):
+        legacy_data = self._load_legacy_data()
+        if legacy_data is not None:
+            content = [d["content"] for d in legacy_data]
+            embeddings = np.array(
+                [d["embedding"] for d in legacy_data], dtype="float32"
+            ).reshape(len(content), self._embedding_model.embedding_size)
+            self._write_files(content, embeddings)
+            return
+
+        embeddings = self._load_embeddings()
+        checkpoint = self._load_index_checkpoint()
+        checkpoint_offset = checkpoint["log_offset"] if checkpoint else 0
+        memories: Dict[int, Tuple[int, str]] = {}
+        checkpoint_ids = set()
+        checkpoint_reached = checkpoint_offset == 0
+        offset = 0
         try:
-            with open(self._file_path, "r") as file:
+            with open(self._file_path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        # Terminate a torn final write so appends start cleanly.
+                        self._append_records([])
+                    offset += len(line)
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+                        # Skip blank lines and a torn final write from a crash.
+                        continue
+                    if record["op"] == "insert":
+                        memories[record["id"]] = (record["row"], record["content"])
+                        self._next_id = max(self._next_id, record["id"] + 1)
+                    elif record["op"] == "remove":
+                        memories.pop(record["id"], None)
+                    elif record["op"] == "next_id":
+                        self._next_id = max(self._next_id, record["next_id"])
+                    if offset == checkpoint_offset:
+                        checkpoint_ids = set(memories.keys())
+                        checkpoint_reached = True
+                    elif offset > checkpoint_offset:
+                        self._records_since_checkpoint += 1
+        except FileNotFoundError:
+            return
+
+        # Metadata written without its embedding row (an interrupted insert)
+        # is dropped.
+        memories = {
+            memory_id: (row, content)
+            for memory_id, (row, content) in memories.items()
+            if row < len(embeddings)
+        }
+        self._data = {
+            memory_id: content for memory_id, (_, content) in memories.items()
+        }
+        self._rows = {memory_id: row for memory_id, (row, _) in memories.items()}
+
+        if not checkpoint_reached or not self._read_index_checkpoint(checkpoint):
+            # Without a usable checkpoint the index is rebuilt from scratch and
+            # a new checkpoint is written.
+            checkpoint_ids = set()
+            self._records_since_checkpoint = None
+
+        removed_ids = checkpoint_ids - memories.keys()
+        if removed_ids:
+            self._index.remove(np.array(list(removed_ids), dtype="int64"))
+        added_ids = [
+            memory_id for memory_id in memories if memory_id not in checkpoint_ids
+        ]
+        if added_ids:
+            rows = np.array([self._rows[memory_id] for memory_id in added_ids])
+            self._index.add(embeddings[rows], np.array(added_ids, dtype="int64"))
+        self._checkpoint_index_if_needed()
+
+    def _load_legacy_data(self) -> List[Dict] | None:
+        # Returns the contents of an archive written in the legacy JSON array
+        # format, or None if the file does not exist or is already a log.
+        try:
+            with open(self._file_path, "r", encoding="utf-8") as file:
+                first_char = file.read(1)
+                while first_char and first_char.isspace():
+                    first_char = file.read(1)
+                if first_char != "[":
+                    return None
+                file.seek(0)
                 return json.load(file)
         except FileNotFoundError:
-            return []
+            return None
+
+    def _load_embeddings(self) -> np.ndarray:
+        embedding_size = self._embedding_model.embedding_size
+        try:
+            file_size = os.path.getsize(self._embeddings_file_path)
+        except FileNotFoundError:
+            file_size = 0
 
-    def _save_data(self):
-        os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
-        with open(self._file_path, "w") as file:
-            json.dump(self._data, file, indent=4)
+        self._row_count = file_size // self._row_size
+        if file_size % self._row_size:
+            # Drop a partially written row so later appends stay aligned.
+            os.truncate(self._embeddings_file_path, self._row_count * self._row_size)
+        if self._row_count == 0:
+            return np.empty((0, embedding_size), dtype="float32")
 
-    def _rebuild_index(self):
-        self._index = faiss.IndexFlatL2(self._embedding_model.embedding_size)
-        if self._data:
-            embeddings = np.array([d["embedding"] for d in self._data]).astype(
-                "float32"
-            )
-            self._index.add(embeddings)
+        return np.memmap(
+            self._embeddings_file_path,
+            dtype="float32",
+            mode="r",
+            shape=(self._row_count, embedding_size),
+        )
 
-    def insert(self, content: str):
-        embedding = self._embedding_model.create_embedding(content)
-        self._data.append({"content": content, "embedding": embedding})
-        self._save_data()
-        self._rebuild_index()  # Rebuild the index with the new data
+    def _add(self, content: List[str], embeddings: np.ndarray) -> List[int]:
+        with self._lock:
+            self._ensure_directory()
+            first_row = self._row_count
+            with open(self._embeddings_file_path, "ab") as file:
+                file.write(np.ascontiguousarray(embeddings, dtype="float32").tobytes())
+            self._row_count += len(content)
 
-    def insert_bulk(self, content: List[str]):
-        embeddings = self._embedding_model.create_embedding(content)
-        for i, c in enumerate(content):
-            self._data.append({"content": c, "embedding": embeddings[i]})
-        self._save_data()
-        self._rebuild_index()
+            ids = InMemoryArchivalMemoryDataSource._add(self, content, embeddings)
+            records = []
+            for i, (memory_id, c) in enumerate(zip(ids, content)):
+                self._rows[memory_id] = first_row + i
+                records.append(
+                    {
+                        "op": "insert",
+                        "id": memory_id,
+                        "row": first_row + i,
+                        "content": c,
+                    }
+                )
+            self._append_records(records)
+            self._checkpoint_index_if_needed()
+            return ids
 
-    def search(self, query: str, page: int = 0) -> List[str]:
-        query_embedding = np.array(
-            self._embedding_model.create_embedding(query)
-        ).astype("float32")
-        _, indices = self._index.search(query_embedding, self._page_size * (page + 1))
-        result_indices = indices[0][
-            page * self._page_size : (page + 1) * self._page_size
-        ]
-        return [self._data[i]["content"] for i in result_indices if i < len(self._data)]
+    def remove(self, memory_id: int):
+        with self._lock:
+            if memory_id in self._data:
+                InMemoryArchivalMemoryDataSource.remove(self, memory_id)
+                del self._rows[memory_id]
+                self._append_records([{"op": "remove", "id": memory_id}])
+                self._compact_if_needed()
+                self._checkpoint_index_if_needed()
 
     def clear(self):
-        self._data = []
-        self._save_data()
-        self._rebuild_index()
+        with self._lock:
+            InMemoryArchivalMemoryDataSource.clear(self)
+            self._rows = {}
+            self._write_files([], np.empty((0, self._embedding_model.embedding_size)))
 
+    def compact(self):
+        """Rewrites both files so that they only contain live memories."""
+        with self._lock:
+            embeddings = self._load_embeddings()
+            ids = list(self._data.keys())
+            rows = np.array([self._rows[memory_id] for memory_id in ids], dtype="int64")
+            live_embeddings = np.array(embeddings[rows], dtype="float32")
+            del embeddings
+            self._write_files(
+                [self._data[memory_id] for memory_id in ids], live_embeddings, ids
+            )
 
-class InMemoryArchivalMemoryDataSource(ArchivalMemoryDataSource):
-    def __init__(self, embedding_model: EmbeddingModel | None = None, page_size=10):
-        if embedding_model is None:
-            embedding_model = OpenAIEmbeddingModel(
-                OpenAIModelNames.TEXT_EMBEDDING_ADA_002
+    def evaluate_index(self, sample_size: int = 100, k: int = 10) -> Dict[str, float]:
+        """
+        Reports the recall@k and per-query latency of the configured index
+        against exact search, using a sample of stored memories as queries.
+        """
+        with self._lock:
+            if not self._data:
+                return {"recall": 1.0, "latency_ms": 0.0, "flat_latency_ms": 0.0}
+
+            embeddings = self._load_embeddings()
+            ids = np.array(list(self._rows.keys()), dtype="int64")
+            live_embeddings = np.array(embeddings[list(self._rows.values())])
+            del embeddings
+            sample = np.random.default_rng().choice(
+                len(ids), size=min(sample_size, len(ids)), replace=False
+            )
+            return evaluate_index(
+                self._index, live_embeddings, ids, live_embeddings[sample], k=k
             )
 
-        self._embedding_model = embedding_model
-        self._page_size = page_size
-        self._data = []
-        self._embeddings = []
-        self._index = faiss.IndexFlatL2(self._embedding_model.embedding_size)
+    def save_index(self):
+        """Checkpoints the search index so that it can be mapped on load."""
+        with self._lock:
+            self._ensure_directory()
+            # The state file is removed first so a crash while the index file is
+            # being replaced can not pair the new index with the old state.
+            self._remove_index_checkpoint()
 
-    @property
-    def size(self) -> int:
-        return len(self._data)
+            temp_index_file_path = f"{self._index_file_path}.tmp"
+            index_state = self._index.write(temp_index_file_path)
+            os.replace(temp_index_file_path, self._index_file_path)
 
-    def insert(self, content: str):
-        embedding = np.array(self._embedding_model.create_embedding(content)).astype(
-            "float32"
-        )
-        self._data.append(content)
-        self._embeddings.append(embedding)
-        self._rebuild_index()
+            try:
+                log_offset = os.path.getsize(self._file_path)
+            except FileNotFoundError:
+                log_offset = 0
+            temp_state_file_path = f"{self._index_state_file_path}.tmp"
+            with open(temp_state_file_path, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "log_offset": log_offset,
+                        "row_count": self._row_count,
+                        "index": index_state,
+                    },
+                    file,
+                )
+            os.replace(temp_state_file_path, self._index_state_file_path)
+            self._records_since_checkpoint = 0
+
+    def _remove_index_checkpoint(self):
+        try:
+            os.remove(self._index_state_file_path)
+        except FileNotFoundError:
+            pass
 
-    def insert_bulk(self, content: List[str]):
-        content_embeddings = np.array(
-            self._embedding_model.create_embedding(content)
-        ).astype("float32")
+    def _load_index_checkpoint(self) -> Dict[str, Any] | None:
+        try:
+            with open(self._index_state_file_path, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+        if checkpoint["row_count"] > self._row_count:
+            return None
+        return checkpoint
 
-        for i, c in enumerate(content):
-            self._data.append(c)
-            self._embeddings.append(content_embeddings[i])
+    def _read_index_checkpoint(self, checkpoint: Dict[str, Any] | None) -> bool:
+        if checkpoint is None:
+            return False
+        try:
+            return self._index.read(self._index_file_path, checkpoint["index"])
+        except RuntimeError:
+            # A missing or unreadable index file.
+            return False
 
-        self._rebuild_index()
+    def _checkpoint_index_if_needed(self):
+        if self._records_since_checkpoint is None:
+            self.save_index()
+        elif self._records_since_checkpoint >= max(
+            DEFAULT_INDEX_CHECKPOINT_MIN_RECORDS,
+            len(self._data) * DEFAULT_INDEX_CHECKPOINT_RATIO,
+        ):
+            self.save_index()
 
-    def _rebuild_index(self):
-        self._index = faiss.IndexFlatL2(self._embedding_model.embedding_size)
-        if self._data:
-            embeddings = np.array(self._embeddings).astype("float32")
-            self._index.add(embeddings)
+    def _compact_if_needed(self):
+        dead_rows = self._row_count - len(self._data)
+        if dead_rows >= max(DEFAULT_COMPACTION_MIN_ROWS, len(self._data)):
+            self.compact()
 
-    def search(self, query: str, page: int = 0) -> List[str]:
-        print(f"Searching archival memory for: {query}")
-        query_embedding = np.array(
-            self._embedding_model.create_embedding(query)
-        ).astype("float32")
-        start_idx = (
-            page * self._page_size
-        )  # Calculate the starting index for the current page
-        end_idx = (
-            start_idx + self._page_size
-        )  # Calculate the ending index for the current page
-
-        # Fetch results for the specific page
-        _, indices = self._index.search(query_embedding, end_idx)
-
-        # Return the slice of results for the current page
-        results = [self._data[i] for i in indices[0][start_idx:end_idx]]
-        return results
+    def _write_files(
+        self, content: List[str], embeddings: np.ndarray, ids: List[int] | None = None
+    ):
+        # Both files are written to temporary paths and then atomically
+        # replaced; the index and in-memory state are rebuilt to match.
+        if ids is None:
+            ids = list(range(len(content)))
+        # Rewriting the log drops the records of removed memories, so the next
+        # id is recorded first to keep ids from being reused.
+        self._next_id = max([self._next_id] + [memory_id + 1 for memory_id in ids])
+        self._ensure_directory()
+        self._remove_index_checkpoint()
 
-    def clear(self):
-        self._data = []
-        self._embeddings = []
-        self._rebuild_index()
+        temp_embeddings_file_path = f"{self._embeddings_file_path}.tmp"
+        with open(temp_embeddings_file_path, "wb") as file:
+            file.write(np.ascontiguousarray(embeddings, dtype="float32").tobytes())
+
+        temp_file_path = f"{self._file_path}.tmp"
+        with open(temp_file_path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"op": "next_id", "next_id": self._next_id}) + "\n")
+            for row, (memory_id, c) in enumerate(zip(ids, content)):
+                record = {"op": "insert", "id": memory_id, "row": row, "content": c}
+                file.write(json.dumps(record) + "\n")
+
+        os.replace(temp_embeddings_file_path, self._embeddings_file_path)
+        os.replace(temp_file_path, self._file_path)
+
+        self._index = self._create_index()
+        self._index_version += 1
+        if content:
+            self._index.add(embeddings, np.array(ids, dtype="int64"))
+        self._data = dict(zip(ids, content))
+        self._rows = {memory_id: row for row, memory_id in enumerate(ids)}
+        self._row_count = len(content)
+        self.save_index()
+
+    def _append_records(self, records: List[Dict]):
+        with open(self._file_path, "a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(r) + "\n" for r in records) or "\n")
+        if self._records_since_checkpoint is not None:
+            self._records_since_checkpoint += len(records)
+
+    def _ensure_directory(self):
+        directory = os.path.dirname(self._file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
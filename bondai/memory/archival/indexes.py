@@ -0,0 +1,265 @@
+import time
+import numpy as np
+import faiss
+from enum import Enum
+from typing import Any, Dict
+
+DEFAULT_NLIST = 1024
+DEFAULT_NPROBE = 16
+DEFAULT_PQ_M = 64
+DEFAULT_PQ_NBITS = 8
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_SEARCH = 64
+# FAISS warns when a quantizer is trained on fewer than 39 points per centroid.
+MIN_TRAINING_POINTS_PER_LIST = 39
+
+
+class ArchivalIndexType(Enum):
+    FLAT = "flat"
+    IVF_FLAT = "ivf_flat"
+    IVF_PQ = "ivf_pq"
+    HNSW = "hnsw"
+
+
+class ArchivalMemoryIndex:
+    """
+    Wraps the FAISS index used by archival memory. Memories are added and
+    removed by id regardless of the index type.
+
+    IVF indexes need training, so vectors are kept in a flat index until
+    train_size of them exist; the IVF index is then trained on those vectors
+    and replaces the flat one. HNSW graphs do not support deletion, so removed
+    ids are excluded at search time and the graph is rebuilt once removed
+    vectors outnumber live ones.
+
+    Indexes can be written to disk and memory-mapped when read back. A mapped
+    index is shared between processes and is only loaded into memory when it
+    is first modified.
+    """
+
+    def __init__(
+        self,
+        embedding_size: int,
+        index_type: ArchivalIndexType | str = ArchivalIndexType.FLAT,
+        nlist: int = DEFAULT_NLIST,
+        nprobe: int = DEFAULT_NPROBE,
+        pq_m: int = DEFAULT_PQ_M,
+        pq_nbits: int = DEFAULT_PQ_NBITS,
+        hnsw_m: int = DEFAULT_HNSW_M,
+        ef_search: int = DEFAULT_EF_SEARCH,
+        train_size: int | None = None,
+    ):
+        self._embedding_size = embedding_size
+        self._index_type = ArchivalIndexType(index_type)
+        self._nlist = nlist
+        self._nprobe = nprobe
+        self._pq_m = pq_m
+        self._pq_nbits = pq_nbits
+        self._hnsw_m = hnsw_m
+        self._ef_search = ef_search
+        if train_size is None:
+            centroids = nlist
+            if self._index_type == ArchivalIndexType.IVF_PQ:
+                centroids = max(nlist, 2**pq_nbits)
+            train_size = centroids * MIN_TRAINING_POINTS_PER_LIST
+        self._train_size = train_size
+        self._params = {
+            "index_type": self._index_type.value,
+            "embedding_size": embedding_size,
+            "nlist": nlist,
+            "pq_m": pq_m,
+            "pq_nbits": pq_nbits,
+            "hnsw_m": hnsw_m,
+            "train_size": train_size,
+        }
+        self.reset()
+
+    @property
+    def index_type(self) -> ArchivalIndexType:
+        return self._index_type
+
+    @property
+    def is_trained(self) -> bool:
+        return self._trained
+
+    @property
+    def size(self) -> int:
+        return self._index.ntotal - len(self._removed_ids)
+
+    @property
+    def nprobe(self) -> int:
+        return self._nprobe
+
+    @nprobe.setter
+    def nprobe(self, nprobe: int):
+        self._nprobe = nprobe
+        self._apply_search_params()
+
+    @property
+    def ef_search(self) -> int:
+        return self._ef_search
+
+    @ef_search.setter
+    def ef_search(self, ef_search: int):
+        self._ef_search = ef_search
+        self._apply_search_params()
+
+    def reset(self):
+        self._mapped_file_path = None
+        self._removed_ids = set()
+        if self._index_type == ArchivalIndexType.HNSW:
+            self._index = self._create_hnsw_index()
+            self._trained = True
+        else:
+            self._index = self._create_flat_index()
+            self._trained = self._index_type == ArchivalIndexType.FLAT
+        self._apply_search_params()
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray):
+        self._ensure_writable()
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        self._index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+        if not self._trained and self._index.ntotal >= self._train_size:
+            self._train()
+
+    def remove(self, ids: np.ndarray):
+        self._ensure_writable()
+        ids = np.asarray(ids, dtype="int64")
+        if self._index_type != ArchivalIndexType.HNSW:
+            self._index.remove_ids(ids)
+            return
+
+        self._removed_ids.update(ids.tolist())
+        if len(self._removed_ids) > self._index.ntotal - len(self._removed_ids):
+            self._rebuild_hnsw_index()
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        if not self._removed_ids:
+            return self._index.search(queries, k)
+
+        removed_ids = faiss.IDSelectorBatch(
+            np.array(list(self._removed_ids), dtype="int64")
+        )
+        selector = faiss.IDSelectorNot(removed_ids)
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=self._ef_search)
+        return self._index.search(queries, k, params=params)
+
+    def write(self, file_path: str) -> Dict[str, Any]:
+        """
+        Writes the index to file_path and returns the state needed to read it
+        back with read().
+        """
+        faiss.write_index(self._index, file_path)
+        return {
+            "params": self._params,
+            "trained": self._trained,
+            "removed_ids": sorted(self._removed_ids),
+        }
+
+    def read(self, file_path: str, state: Dict[str, Any], mmap: bool = True) -> bool:
+        """
+        Replaces the index with one written by write(). Returns False, leaving
+        the index unchanged, if it was written with different parameters.
+        """
+        if state.get("params") != self._params:
+            return False
+
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        self._index = faiss.read_index(file_path, flags)
+        self._mapped_file_path = file_path if mmap else None
+        self._trained = state["trained"]
+        self._removed_ids = set(state["removed_ids"])
+        self._apply_search_params()
+        return True
+
+    def _ensure_writable(self):
+        # Memory-mapped indexes are read-only, so they are loaded into memory
+        # before their first modification.
+        if self._mapped_file_path is not None:
+            self._index = faiss.read_index(self._mapped_file_path)
+            self._mapped_file_path = None
+            self._apply_search_params()
+
+    def _create_flat_index(self) -> faiss.Index:
+        return faiss.IndexIDMap(faiss.IndexFlatL2(self._embedding_size))
+
+    def _create_hnsw_index(self) -> faiss.Index:
+        return faiss.IndexIDMap(faiss.IndexHNSWFlat(self._embedding_size, self._hnsw_m))
+
+    def _create_ivf_index(self) -> faiss.Index:
+        quantizer = faiss.IndexFlatL2(self._embedding_size)
+        if self._index_type == ArchivalIndexType.IVF_PQ:
+            return faiss.IndexIVFPQ(
+                quantizer, self._embedding_size, self._nlist, self._pq_m, self._pq_nbits
+            )
+        return faiss.IndexIVFFlat(quantizer, self._embedding_size, self._nlist)
+
+    def _train(self):
+        embeddings, ids = self._get_vectors()
+        index = self._create_ivf_index()
+        index.train(embeddings)
+        index.add_with_ids(embeddings, ids)
+        self._index = index
+        self._trained = True
+        self._apply_search_params()
+
+    def _rebuild_hnsw_index(self):
+        embeddings, ids = self._get_vectors()
+        live = ~np.isin(ids, np.array(list(self._removed_ids), dtype="int64"))
+        self._removed_ids = set()
+        self._index = self._create_hnsw_index()
+        self._apply_search_params()
+        if live.any():
+            self._index.add_with_ids(
+                np.ascontiguousarray(embeddings[live]), np.ascontiguousarray(ids[live])
+            )
+
+    def _get_vectors(self):
+        # Both the flat and HNSW indexes store the raw vectors, wrapped in an
+        # IndexIDMap that maps their sequential positions to memory ids.
+        embeddings = self._index.index.reconstruct_n(0, self._index.ntotal)
+        ids = faiss.vector_to_array(self._index.id_map).astype("int64")
+        return embeddings, ids
+
+    def _apply_search_params(self):
+        if self._index_type == ArchivalIndexType.HNSW:
+            faiss.downcast_index(self._index.index).hnsw.efSearch = self._ef_search
+        elif self._trained and self._index_type != ArchivalIndexType.FLAT:
+            self._index.nprobe = self._nprobe
+
+
+def evaluate_index(
+    index: ArchivalMemoryIndex,
+    embeddings: np.ndarray,
+    ids: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+) -> Dict[str, float]:
+    """
+    Measures the recall@k and search latency of an index against an exact
+    flat index built from the same embeddings.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    flat_index = faiss.IndexIDMap(faiss.IndexFlatL2(embeddings.shape[1]))
+    flat_index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+
+    start = time.perf_counter()
+    _, expected_ids = flat_index.search(queries, k)
+    flat_latency = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    _, actual_ids = index.search(queries, k)
+    latency = (time.perf_counter() - start) / len(queries)
+
+    hits = sum(
+        len(set(expected[expected != -1]) & set(actual[actual != -1]))
+        for expected, actual in zip(expected_ids, actual_ids)
+    )
+    total = int((expected_ids != -1).sum())
+    return {
+        "recall": hits / total if total else 1.0,
+        "latency_ms": latency * 1000,
+        "flat_latency_ms": flat_latency * 1000,
+    }
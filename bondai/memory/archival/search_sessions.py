@@ -0,0 +1,100 @@
+import time
+import uuid
+import threading
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+DEFAULT_SEARCH_SESSION_TTL = 300.0
+DEFAULT_MAX_SEARCH_SESSIONS = 256
+# Number of pages of candidates fetched when a search session is created.
+DEFAULT_SEARCH_SESSION_PAGES = 5
+
+
+@dataclass
+class SearchSession:
+    query: str
+    query_embedding: np.ndarray | None = None
+    cursor: str = field(default_factory=lambda: str(uuid.uuid4()))
+    # Ranked candidate ids and the index version they were retrieved at.
+    ids: List[int] = field(default_factory=list)
+    version: int = -1
+    expires_at: float = 0.0
+
+
+class SearchSessionCache:
+    """
+    Holds search sessions by cursor id so that follow-up pages of a search
+    reuse its query embedding and ranked candidates. Sessions expire ttl
+    seconds after they were last used and the least recently used session is
+    evicted once max_sessions exist.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_SEARCH_SESSION_TTL,
+        max_sessions: int = DEFAULT_MAX_SEARCH_SESSIONS,
+    ):
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        self._sessions: OrderedDict[str, SearchSession] = OrderedDict()
+        self._cursors_by_query: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired()
+            return len(self._sessions)
+
+    def add(self, session: SearchSession) -> SearchSession:
+        with self._lock:
+            self._evict_expired()
+            session.expires_at = time.monotonic() + self._ttl
+            self._sessions[session.cursor] = session
+            self._cursors_by_query[session.query] = session.cursor
+            while len(self._sessions) > self._max_sessions:
+                self._remove(next(iter(self._sessions)))
+            return session
+
+    def get(self, cursor: str) -> SearchSession | None:
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(cursor)
+            if session is not None:
+                self._touch(session)
+            return session
+
+    def find(self, query: str) -> SearchSession | None:
+        """Returns the most recent live session for query, if any."""
+        with self._lock:
+            self._evict_expired()
+            cursor = self._cursors_by_query.get(query)
+            if cursor is None:
+                return None
+            session = self._sessions[cursor]
+            self._touch(session)
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._cursors_by_query.clear()
+
+    def _touch(self, session: SearchSession):
+        session.expires_at = time.monotonic() + self._ttl
+        self._sessions.move_to_end(session.cursor)
+
+    def _evict_expired(self):
+        # Sessions are kept in order of last use, so expired ones are first.
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires_at > now:
+                break
+            self._remove(session.cursor)
+
+    def _remove(self, cursor: str):
+        session = self._sessions.pop(cursor)
+        if self._cursors_by_query.get(session.query) == cursor:
+            del self._cursors_by_query[session.query]
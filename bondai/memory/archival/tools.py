@@ -20,6 +20,7 @@ class ArchivalMemoryInsertTool(Tool):
             ARCHIVAL_MEMORY_INSERT_TOOL_NAME,
             ARCHIVAL_MEMORY_INSERT_TOOL_DESCRIPTION,
             ArchivalMemoryInsertToolParameters,
+            max_concurrency=1,
         )
         self._datasource = datasource
 
@@ -31,13 +32,15 @@ ARCHIVAL_MEMORY_SEARCH_TOOL_NAME = "archival_memory_search"
 ARCHIVAL_MEMORY_SEARCH_TOOL_DESCRIPTION = (
     "Use the archival_memory_search tool to search archival memory using semantic (embedding-based) search. "
     "- query: String to search for. \n"
-    "- page: Allows you to page through results. Only use on a follow-up query. Defaults to 0 (first page)."
+    "- page: Allows you to page through results. Only use on a follow-up query. Defaults to 0 (first page). \n"
+    "- cursor: The cursor returned by a previous search. Pass it with the next page number to continue paging through its results."
 )
 
 
 class ArchivalMemorySearchToolParameters(BaseModel):
     query: str
     page: int = 0
+    cursor: str | None = None
 
 
 class ArchivalMemorySearchTool(Tool):
@@ -49,6 +52,19 @@ class ArchivalMemorySearchTool(Tool):
         )
         self._datasource = datasource
 
-    def run(self, query: str, page: int = 0) -> str:
-        results = self._datasource.search(query, page)
-        return "\n".join(results)
+    def run(self, query: str, page: int = 0, cursor: str | None = None) -> str:
+        results = None
+        if cursor:
+            results = self._datasource.get_search_page(cursor, page, query=query)
+        if results is None:
+            # No cursor was given, it has expired or it was opened for a
+            # different query.
+            cursor = self._datasource.open_search_session(query)
+            results = self._datasource.get_search_page(cursor, page)
+
+        if not results:
+            return ""
+        return (
+            "\n".join(results)
+            + f"\n\n(cursor: {cursor}. Use this cursor with page={page + 1} to see more results.)"
+        )
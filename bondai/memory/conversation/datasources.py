@@ -1,16 +1,25 @@
 import os
 import json
+import time
+import threading
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List
+from typing import Dict, List
 from bondai.agents.messages import (
     AgentMessage,
     AgentMessageList,
     ConversationMessage,
     SystemMessage,
     ToolUsageMessage,
+    message_to_dict,
+    message_from_dict,
 )
 
+DEFAULT_FSYNC_BATCH_SIZE = 64
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_COMPACTION_MIN_RECORDS = 1000
+DEFAULT_COMPACTION_RATIO = 2.0
+
 
 def format_messages(messages: List[AgentMessage]) -> str:
     results = []
@@ -38,6 +47,10 @@ class ConversationMemoryDataSource(ABC):
     def remove(self, message: AgentMessage):
         pass
 
+    def update(self, message: AgentMessage):
+        """Stores changes made to a message after it was added."""
+        pass
+
     def remove_after(self, timestamp: datetime, inclusive: bool = True):
         pass
 
@@ -71,6 +84,11 @@ class InMemoryConversationMemoryDataSource(ConversationMemoryDataSource):
     def remove(self, message: AgentMessage):
         self._data.remove(message)
 
+    def update(self, message: AgentMessage):
+        if message in self._data and self._data.get(message.id) is not message:
+            self._data.remove(message)
+            self._data.add(message)
+
     def remove_after(self, timestamp: datetime, inclusive: bool = True):
         self._data.remove_after(timestamp, inclusive=inclusive)
 
@@ -115,37 +133,246 @@ class InMemoryConversationMemoryDataSource(ConversationMemoryDataSource):
 
 
 class PersistentConversationMemoryDataSource(InMemoryConversationMemoryDataSource):
+    """
+    Stores conversation history in an append-only JSON Lines log. Every add,
+    update, remove and remove_after appends a single record (removals are
+    tombstones), so writes stay O(1) regardless of history length. Changes
+    made to a message after it was added are stored when update is called
+    with it, and the last record for a message wins. The log is compacted to
+    the live messages once it holds more than compaction_ratio records per
+    live message, fsyncs are batched and history is only read from disk the
+    first time it is needed. Files written in the previous JSON array format
+    are migrated on first use.
+    """
+
     def __init__(
-        self, file_path: str = "./.memory/conversation-memory.json", page_size=10
+        self,
+        file_path: str = "./.memory/conversation-memory.json",
+        page_size=10,
+        fsync_batch_size: int = DEFAULT_FSYNC_BATCH_SIZE,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        compaction_min_records: int = DEFAULT_COMPACTION_MIN_RECORDS,
+        compaction_ratio: float = DEFAULT_COMPACTION_RATIO,
     ):
         InMemoryConversationMemoryDataSource.__init__(self, page_size=page_size)
         self._file_path = file_path
-        self._data = AgentMessageList.from_dict(self._load_data())
+        self._fsync_batch_size = fsync_batch_size
+        self._fsync_interval = fsync_interval
+        self._compaction_min_records = compaction_min_records
+        self._compaction_ratio = compaction_ratio
+        self._data = None
+        self._lock = threading.RLock()
+        self._log_file = None
+        self._record_count = 0
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+
+    @property
+    def messages(self) -> List[AgentMessage]:
+        return self._get_data()
+
+    def add(self, message: AgentMessage):
+        with self._lock:
+            if self._data is not None:
+                if message in self._data:
+                    return
+                self._data.add(message)
+            self._append_record({"op": "add", "message": message_to_dict(message)})
+
+    def remove(self, message: AgentMessage):
+        with self._lock:
+            if self._data is not None:
+                self._data.remove(message)
+            self._append_record({"op": "remove", "id": message.id})
+
+    def update(self, message: AgentMessage):
+        with self._lock:
+            if self._data is not None:
+                if message not in self._data:
+                    return
+                super().update(message)
+            self._append_record(
+                {
+                    "op": "update",
+                    "id": message.id,
+                    "message": message_to_dict(message),
+                }
+            )
+
+    def remove_after(self, timestamp: datetime, inclusive: bool = True):
+        with self._lock:
+            if self._data is not None:
+                self._data.remove_after(timestamp, inclusive=inclusive)
+            self._append_record(
+                {
+                    "op": "remove_after",
+                    "timestamp": timestamp.isoformat(),
+                    "inclusive": inclusive,
+                }
+            )
 
-    def _load_data(self):
+    def search(
+        self,
+        query: str,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        page: int = 0,
+    ) -> List[AgentMessage]:
+        self._get_data()
+        return super().search(
+            query, start_date=start_date, end_date=end_date, page=page
+        )
+
+    def clear(self):
+        with self._lock:
+            self._data = AgentMessageList()
+            # Everything before a clear is dead, so rewrite the log instead of
+            # appending a tombstone.
+            self.compact()
+
+    def flush(self):
+        """Flushes and fsyncs any log records that have not been synced yet."""
+        with self._lock:
+            if self._log_file is not None and self._unsynced_records > 0:
+                self._log_file.flush()
+                os.fsync(self._log_file.fileno())
+            self._unsynced_records = 0
+            self._last_fsync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._log_file is not None:
+                self.flush()
+                self._log_file.close()
+                self._log_file = None
+
+    def compact(self):
+        """Rewrites the log so that it only contains the live messages."""
+        with self._lock:
+            data = self._get_data()
+            self.close()
+            self._ensure_directory()
+            temp_file_path = f"{self._file_path}.tmp"
+            with open(temp_file_path, "w", encoding="utf-8") as file:
+                for message in data:
+                    record = {"op": "add", "message": message_to_dict(message)}
+                    file.write(json.dumps(record) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file_path, self._file_path)
+            self._record_count = len(data)
+
+    def _get_data(self) -> AgentMessageList:
+        with self._lock:
+            if self._data is None:
+                self._data = AgentMessageList()
+                legacy_data = self._load_data()
+                if legacy_data is not None:
+                    self._data = AgentMessageList.from_dict(legacy_data)
+                    self.compact()
+                else:
+                    self._replay_log()
+                    self._compact_if_needed()
+            return self._data
+
+    def _load_data(self) -> List[Dict] | None:
+        # Returns the contents of a file written in the legacy JSON array
+        # format, or None if the file does not exist or is already a log.
         try:
-            with open(self._file_path, "r") as file:
+            with open(self._file_path, "r", encoding="utf-8") as file:
+                first_char = file.read(1)
+                while first_char and first_char.isspace():
+                    first_char = file.read(1)
+                if first_char != "[":
+                    return None
+                file.seek(0)
                 return json.load(file)
         except FileNotFoundError:
-            return []
+            return None
 
-    def _save_data(self):
-        os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
-        with open(self._file_path, "w") as file:
-            json.dump(self._data.to_dict(), file, indent=4)
+    def _replay_log(self):
+        self._record_count = 0
+        try:
+            with open(self._file_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        # A torn final write from a crash; the record was never synced.
+                        continue
+                    self._apply_record(record)
+                    self._record_count += 1
+        except FileNotFoundError:
+            pass
 
-    def add(self, message: str) -> None:
-        super().add(message)
-        self._save_data()
+    def _apply_record(self, record: Dict):
+        op = record["op"]
+        if op == "add":
+            message = message_from_dict(record["message"])
+            # Messages added again before the log was loaded are duplicated
+            # in it, and the last copy is the most recent.
+            self._data.remove(message)
+            self._data.add(message)
+        elif op == "update":
+            # Updates to messages that have since been removed are ignored.
+            if self._data.get(record["id"]) is not None:
+                message = message_from_dict(record["message"])
+                self._data.remove(message)
+                self._data.add(message)
+        elif op == "remove":
+            message = self._data.get(record["id"])
+            if message:
+                self._data.remove(message)
+        elif op == "remove_after":
+            self._data.remove_after(
+                datetime.fromisoformat(record["timestamp"]),
+                inclusive=record["inclusive"],
+            )
+        else:
+            raise ValueError(f"Unknown conversation memory log operation: {op}")
 
-    def remove(self, message: str) -> None:
-        super().remove(message)
-        self._save_data()
+    def _append_record(self, record: Dict):
+        if self._log_file is None:
+            if self._data is None and self._load_data() is not None:
+                # Migrate a legacy JSON file before appending to it.
+                self._get_data()
+            self._ensure_directory()
+            self._log_file = open(self._file_path, "a", encoding="utf-8")
+            if not self._ends_with_newline():
+                # Terminate a torn final record so it doesn't swallow this one.
+                self._log_file.write("\n")
 
-    def remove_after(self, timestamp: datetime, inclusive: bool = True):
-        super().remove_after(timestamp, inclusive=inclusive)
-        self._save_data()
+        self._log_file.write(json.dumps(record) + "\n")
+        self._log_file.flush()
+        self._record_count += 1
+        self._unsynced_records += 1
 
-    def clear(self):
-        super().clear()
-        self._save_data()
+        if (
+            self._unsynced_records >= self._fsync_batch_size
+            or time.monotonic() - self._last_fsync >= self._fsync_interval
+        ):
+            self.flush()
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if (
+            self._data is not None
+            and self._record_count >= self._compaction_min_records
+            and self._record_count > self._compaction_ratio * len(self._data)
+        ):
+            self.compact()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self._file_path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() == 0:
+                return True
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def _ensure_directory(self):
+        directory = os.path.dirname(self._file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
@@ -23,6 +23,7 @@ class CoreMemoryAppendTool(Tool):
             CORE_MEMORY_APPEND_TOOL_NAME,
             CORE_MEMORY_APPEND_TOOL_DESCRIPTION,
             CoreMemoryAppendParameters,
+            max_concurrency=1,
         )
         self._datasource = datasource
 
@@ -56,6 +57,7 @@ class CoreMemoryReplaceTool(Tool):
             CORE_MEMORY_REPLACE_TOOL_NAME,
             CORE_MEMORY_REPLACE_TOOL_DESCRIPTION,
             CoreMemoryReplaceParameters,
+            max_concurrency=1,
         )
         self._datasource = datasource
 
@@ -1,7 +1,11 @@
 from .embedding_model import EmbeddingModel
-from .llm import LLM
+from .caching_embedding_model import CachingEmbeddingModel
+from .llm import LLM, StreamingCompletionUpdate, replay_completion
 
 __all__ = [
     "EmbeddingModel",
+    "CachingEmbeddingModel",
     "LLM",
+    "StreamingCompletionUpdate",
+    "replay_completion",
 ]
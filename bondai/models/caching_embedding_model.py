@@ -0,0 +1,135 @@
+import threading
+import numpy as np
+from typing import Dict, List
+from .embedding_model import EmbeddingModel
+from bondai.util.caching import EmbeddingCache, InMemoryEmbeddingCache
+
+
+class CachingEmbeddingModel(EmbeddingModel):
+    """
+    Wraps an EmbeddingModel and caches its embeddings by (model, text), so
+    repeated chunks and queries are only embedded once. Batch requests only
+    send the texts that missed the cache to the wrapped model. Embeddings are
+    always returned as a list of embeddings, one per input text.
+    """
+
+    def __init__(
+        self,
+        embedding_model: EmbeddingModel,
+        cache: EmbeddingCache | None = None,
+        model_name: str | None = None,
+    ):
+        self._embedding_model = embedding_model
+        self._cache = cache if cache is not None else InMemoryEmbeddingCache()
+        self._model_name = model_name if model_name else embedding_model.model_name
+        self._hits = 0
+        self._misses = 0
+        self._counter_lock = threading.Lock()
+
+    @property
+    def embedding_model(self) -> EmbeddingModel:
+        return self._embedding_model
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def stats(self) -> Dict[str, int | float]:
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self._hits = 0
+            self._misses = 0
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @property
+    def max_tokens(self) -> int:
+        return self._embedding_model.max_tokens
+
+    @property
+    def embedding_size(self) -> int:
+        return self._embedding_model.embedding_size
+
+    def count_tokens(self, prompt: str) -> int:
+        return self._embedding_model.count_tokens(prompt)
+
+    def count_tokens_many(self, prompts: List[str]) -> List[int]:
+        return self._embedding_model.count_tokens_many(prompts)
+
+    @property
+    def supports_tokenization(self) -> bool:
+        return self._embedding_model.supports_tokenization
+
+    def encode(self, prompt: str) -> List[int]:
+        return self._embedding_model.encode(prompt)
+
+    def decode(self, tokens: List[int]) -> str:
+        return self._embedding_model.decode(tokens)
+
+    def is_token_boundary(self, tokens: List[int], index: int) -> bool:
+        return self._embedding_model.is_token_boundary(tokens, index)
+
+    def create_embedding(self, prompt: str | List[str]) -> List[List[float]]:
+        texts = prompt if isinstance(prompt, list) else [prompt]
+        embeddings, misses = self._get_cached_embeddings(texts)
+        if misses:
+            self._save_embeddings(
+                misses, embeddings, self._embedding_model.create_embedding(misses)
+            )
+        return [embeddings[text].tolist() for text in texts]
+
+    async def acreate_embedding(self, prompt: str | List[str]) -> List[List[float]]:
+        texts = prompt if isinstance(prompt, list) else [prompt]
+        embeddings, misses = self._get_cached_embeddings(texts)
+        if misses:
+            self._save_embeddings(
+                misses,
+                embeddings,
+                await self._embedding_model.acreate_embedding(misses),
+            )
+        return [embeddings[text].tolist() for text in texts]
+
+    def _get_cached_embeddings(self, texts: List[str]):
+        # Duplicate texts in one request are only looked up and embedded once.
+        unique_texts = list(dict.fromkeys(texts))
+        cached = self._cache.get_cache_items(self._model_name, unique_texts)
+        embeddings = {
+            text: embedding
+            for text, embedding in zip(unique_texts, cached)
+            if embedding is not None
+        }
+        misses = [text for text in unique_texts if text not in embeddings]
+        with self._counter_lock:
+            self._hits += len(texts) - len(misses)
+            self._misses += len(misses)
+        return embeddings, misses
+
+    def _save_embeddings(
+        self,
+        texts: List[str],
+        embeddings: Dict[str, np.ndarray],
+        new_embeddings: List[List[float]],
+    ):
+        new_embeddings = np.array(new_embeddings, dtype="float32").reshape(
+            len(texts), -1
+        )
+        self._cache.save_cache_items(self._model_name, texts, list(new_embeddings))
+        embeddings.update(zip(texts, new_embeddings))
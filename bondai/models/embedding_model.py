@@ -1,6 +1,10 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List
 
+# A character is at most 4 bytes of UTF-8, so it spans at most 4 tokens.
+MAX_TOKENS_PER_CHARACTER = 4
+
 
 class EmbeddingModel(ABC):
     @property
@@ -13,6 +17,11 @@ class EmbeddingModel(ABC):
     def embedding_size() -> int:
         pass
 
+    @property
+    def model_name(self) -> str:
+        # Identifies the model in cache keys.
+        return type(self).__name__
+
     @abstractmethod
     def create_embedding(prompt: str) -> List[float] | List[List[float]]:
         pass
@@ -20,3 +29,37 @@ class EmbeddingModel(ABC):
     @abstractmethod
     def count_tokens(prompt: str) -> int:
         pass
+
+    def count_tokens_many(self, prompts: List[str]) -> List[int]:
+        return [self.count_tokens(p) for p in prompts]
+
+    @property
+    def supports_tokenization(self) -> bool:
+        # Models that expose their tokenizer let text be split on token
+        # boundaries without re-counting tokens. encode, decode and
+        # is_token_boundary are only used if this is True.
+        return False
+
+    def encode(self, prompt: str) -> List[int]:
+        pass
+
+    def decode(self, tokens: List[int]) -> str:
+        pass
+
+    def is_token_boundary(self, tokens: List[int], index: int) -> bool:
+        """
+        Returns whether tokens can be split before index without splitting a
+        character. A character split across tokens decodes as U+FFFD on both
+        sides of the split.
+        """
+        if index <= 0 or index >= len(tokens):
+            return True
+        before = self.decode(tokens[max(index - MAX_TOKENS_PER_CHARACTER, 0) : index])
+        after = self.decode(tokens[index : index + MAX_TOKENS_PER_CHARACTER])
+        return not before.endswith("\ufffd") and not after.startswith("\ufffd")
+
+    async def acreate_embedding(
+        self, prompt: str | List[str]
+    ) -> List[float] | List[List[float]]:
+        # Default shim for models without a native async implementation.
+        return await asyncio.to_thread(self.create_embedding, prompt)
@@ -1,5 +1,62 @@
+import json
+import asyncio
+import functools
 from abc import ABC, abstractmethod
-from typing import Dict, List, Callable
+from dataclasses import dataclass
+from typing import Dict, List, Callable, Tuple, AsyncIterator, Iterator
+
+
+@dataclass
+class StreamingCompletionUpdate:
+    """
+    A single update from LLM.aget_streaming_completion. 'content' holds newly
+    streamed content, 'function_name'/'function_arguments' hold the function
+    call buffers received so far and 'completion' is set on the final update
+    with the same (content, function) result returned by get_completion.
+    """
+
+    content: str | None = None
+    function_name: str | None = None
+    function_arguments: str | None = None
+    completion: Tuple[str, Dict | None] | None = None
+
+
+def replay_completion(
+    completion: Tuple[str, Dict | List[Dict] | None], chunk_size: int | None = None
+) -> Iterator[StreamingCompletionUpdate]:
+    """
+    Yields the updates a live stream would have produced for a completion,
+    such as one read from a cache: the content in chunks of chunk_size
+    characters, the buffers of each function call as its arguments grow by
+    chunk_size characters, and finally the completion itself. If chunk_size
+    is None the content and each function call are sent in a single update.
+    """
+    content, function = completion[0], completion[1]
+    if content:
+        step = chunk_size or len(content)
+        for start in range(0, len(content), step):
+            yield StreamingCompletionUpdate(content=content[start : start + step])
+
+    if isinstance(function, list):
+        functions = function
+    elif function:
+        functions = [function]
+    else:
+        functions = []
+    for function in functions:
+        arguments = function.get("arguments")
+        if arguments is None:
+            arguments = ""
+        elif not isinstance(arguments, str):
+            arguments = json.dumps(arguments)
+        step = chunk_size or len(arguments) or 1
+        for end in range(min(step, len(arguments)), len(arguments) + step, step):
+            yield StreamingCompletionUpdate(
+                function_name=function["name"],
+                function_arguments=arguments[: min(end, len(arguments))],
+            )
+
+    yield StreamingCompletionUpdate(completion=completion)
 
 
 class LLM(ABC):
@@ -13,6 +70,12 @@ class LLM(ABC):
     def supports_streaming() -> bool:
         return False
 
+    @property
+    def supports_tool_calls(self) -> bool:
+        # When True, completions return a list of functions (one per tool
+        # call) instead of a single function.
+        return False
+
     @abstractmethod
     def get_completion(
         messages: List[Dict] | None = None,
@@ -34,3 +97,66 @@ class LLM(ABC):
     @abstractmethod
     def count_tokens(prompt: str) -> int:
         pass
+
+    def count_tokens_many(self, prompts: List[str]) -> List[int]:
+        return [self.count_tokens(p) for p in prompts]
+
+    async def aget_completion(
+        self,
+        messages: List[Dict] | None = None,
+        functions: List[Dict] | None = None,
+        **kwargs
+    ) -> (str, Dict | None):
+        # Default shim for LLMs without a native async implementation.
+        return await asyncio.to_thread(
+            functools.partial(
+                self.get_completion, messages=messages, functions=functions, **kwargs
+            )
+        )
+
+    async def aget_streaming_completion(
+        self,
+        messages: List[Dict] | None = None,
+        functions: List[Dict] | None = None,
+        **kwargs
+    ) -> AsyncIterator[StreamingCompletionUpdate]:
+        # Default shim for LLMs without a native async implementation. The
+        # synchronous stream runs in a worker thread and its callbacks are
+        # forwarded to this event loop.
+        loop = asyncio.get_running_loop()
+        updates = asyncio.Queue()
+
+        def content_stream_callback(content):
+            loop.call_soon_threadsafe(
+                updates.put_nowait, StreamingCompletionUpdate(content=content)
+            )
+
+        def function_stream_callback(function_name, function_arguments):
+            loop.call_soon_threadsafe(
+                updates.put_nowait,
+                StreamingCompletionUpdate(
+                    function_name=function_name, function_arguments=function_arguments
+                ),
+            )
+
+        completion_task = loop.create_task(
+            asyncio.to_thread(
+                functools.partial(
+                    self.get_streaming_completion,
+                    messages=messages,
+                    functions=functions,
+                    content_stream_callback=content_stream_callback,
+                    function_stream_callback=function_stream_callback,
+                    **kwargs
+                )
+            )
+        )
+        completion_task.add_done_callback(lambda _: updates.put_nowait(None))
+
+        while True:
+            update = await updates.get()
+            if update is None:
+                break
+            yield update
+
+        yield StreamingCompletionUpdate(completion=completion_task.result())
@@ -5,7 +5,15 @@ from .openai_wrapper import (
     reset_total_cost,
     enable_logging,
     disable_logging,
+    configure_http_pool,
+    close_clients,
+    aclose_clients,
+    track_costs,
+    CostTracker,
+    configure_embedding_scheduler,
+    get_embedding_scheduler,
 )
+from .embedding_scheduler import EmbeddingScheduler
 from .openai_models import (
     OpenAIConnectionType,
     OpenAIModelNames,
@@ -24,6 +32,14 @@ __all__ = [
     "reset_total_cost",
     "enable_logging",
     "disable_logging",
+    "configure_http_pool",
+    "close_clients",
+    "aclose_clients",
+    "track_costs",
+    "CostTracker",
+    "configure_embedding_scheduler",
+    "get_embedding_scheduler",
+    "EmbeddingScheduler",
     "OpenAIConnectionType",
     "OpenAIModelNames",
     "OpenAIModelFamilyType",
@@ -0,0 +1,273 @@
+import re
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, List, Mapping, Tuple
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+# The embeddings API accepts up to 2048 inputs per request.
+DEFAULT_MAX_BATCH_SIZE = 2048
+DEFAULT_MAX_BATCH_TOKENS = 100000
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_INITIAL_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+RETRYABLE_EXCEPTIONS = (
+    RateLimitError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+)
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+EmbeddingResult = Tuple[List[List[float]], Mapping[str, str]]
+
+
+def parse_duration(value: str) -> float:
+    """Parses a rate limit reset duration such as "1s", "6m0s" or "20ms"."""
+    return sum(
+        float(amount) * _DURATION_UNITS[unit]
+        for amount, unit in _DURATION_PATTERN.findall(value)
+    )
+
+
+class RateLimitState:
+    """
+    Tracks the remaining request and token budgets reported by the
+    x-ratelimit-* response headers for one API key and model. Requests
+    reserve their share of the budget before they are sent, so concurrent
+    callers wait for the budget to reset instead of being rejected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._remaining_requests: int | None = None
+        self._remaining_tokens: int | None = None
+        self._requests_reset_at = 0.0
+        self._tokens_reset_at = 0.0
+        self._blocked_until = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserves budget for a request of tokens tokens. Returns 0 if the
+        request can be sent now, or the number of seconds to wait before
+        trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._requests_reset_at <= now:
+                self._remaining_requests = None
+            if self._tokens_reset_at <= now:
+                self._remaining_tokens = None
+
+            wait = max(self._blocked_until - now, 0.0)
+            if self._remaining_requests is not None and self._remaining_requests < 1:
+                wait = max(wait, self._requests_reset_at - now)
+            # A request larger than the whole budget is sent once it resets.
+            if self._remaining_tokens is not None and self._remaining_tokens < tokens:
+                wait = max(wait, self._tokens_reset_at - now)
+            if wait > 0:
+                return wait
+
+            if self._remaining_requests is not None:
+                self._remaining_requests -= 1
+            if self._remaining_tokens is not None:
+                self._remaining_tokens -= tokens
+            return 0.0
+
+    def update(self, headers: Mapping[str, str]):
+        now = time.monotonic()
+        with self._lock:
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if remaining_requests is not None:
+                self._remaining_requests = int(remaining_requests)
+                self._requests_reset_at = now + parse_duration(
+                    headers.get("x-ratelimit-reset-requests", "")
+                )
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None:
+                self._remaining_tokens = int(remaining_tokens)
+                self._tokens_reset_at = now + parse_duration(
+                    headers.get("x-ratelimit-reset-tokens", "")
+                )
+
+    def block(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class EmbeddingScheduler:
+    """
+    Sends embedding requests on behalf of every OpenAIEmbeddingModel. Inputs
+    are packed into batches of up to max_batch_size inputs and
+    max_batch_tokens tokens, which are sent concurrently within the rate
+    limits reported by the API and retried with exponential backoff when they
+    fail transiently. Embeddings are returned in input order.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+        max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        initial_backoff: float = DEFAULT_INITIAL_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._rate_limits: Dict[Hashable, RateLimitState] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def get_rate_limit_state(self, key: Hashable) -> RateLimitState:
+        with self._lock:
+            state = self._rate_limits.get(key)
+            if state is None:
+                state = self._rate_limits[key] = RateLimitState()
+            return state
+
+    def create_batches(self, token_counts: List[int]) -> List[Tuple[int, int, int]]:
+        """
+        Packs consecutive inputs into batches. Returns (start, end, tokens)
+        for each batch.
+        """
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for i, token_count in enumerate(token_counts):
+            if i > start and (
+                i - start >= self.max_batch_size
+                or batch_tokens + token_count > self.max_batch_tokens
+            ):
+                batches.append((start, i, batch_tokens))
+                start = i
+                batch_tokens = 0
+            batch_tokens += token_count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts), batch_tokens))
+        return batches
+
+    def embed(
+        self,
+        texts: List[str],
+        token_counts: List[int],
+        request: Callable[[List[str]], EmbeddingResult],
+        rate_limit_key: Hashable,
+    ) -> List[List[float]]:
+        state = self.get_rate_limit_state(rate_limit_key)
+        batches = self.create_batches(token_counts)
+
+        def send(batch: Tuple[int, int, int]) -> List[List[float]]:
+            start, end, tokens = batch
+            return self._send(state, texts[start:end], tokens, request)
+
+        if len(batches) == 1:
+            return send(batches[0])
+
+        # Batches run in a copy of the caller's context so costs are tracked.
+        executor = self._get_executor()
+        futures = [
+            executor.submit(contextvars.copy_context().run, send, batch)
+            for batch in batches
+        ]
+        return [embedding for future in futures for embedding in future.result()]
+
+    async def aembed(
+        self,
+        texts: List[str],
+        token_counts: List[int],
+        request: Callable[[List[str]], Awaitable[EmbeddingResult]],
+        rate_limit_key: Hashable,
+    ) -> List[List[float]]:
+        state = self.get_rate_limit_state(rate_limit_key)
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def send(batch: Tuple[int, int, int]) -> List[List[float]]:
+            start, end, tokens = batch
+            async with semaphore:
+                return await self._asend(state, texts[start:end], tokens, request)
+
+        results = await asyncio.gather(
+            *[send(batch) for batch in self.create_batches(token_counts)]
+        )
+        return [embedding for result in results for embedding in result]
+
+    def _send(
+        self,
+        state: RateLimitState,
+        texts: List[str],
+        tokens: int,
+        request: Callable[[List[str]], EmbeddingResult],
+    ) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            while (wait := state.reserve(tokens)) > 0:
+                time.sleep(wait)
+            try:
+                embeddings, headers = request(texts)
+            except RETRYABLE_EXCEPTIONS as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._get_backoff(state, e, attempt))
+                continue
+            state.update(headers)
+            return embeddings
+
+    async def _asend(
+        self,
+        state: RateLimitState,
+        texts: List[str],
+        tokens: int,
+        request: Callable[[List[str]], Awaitable[EmbeddingResult]],
+    ) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            while (wait := state.reserve(tokens)) > 0:
+                await asyncio.sleep(wait)
+            try:
+                embeddings, headers = await request(texts)
+            except RETRYABLE_EXCEPTIONS as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._get_backoff(state, e, attempt))
+                continue
+            state.update(headers)
+            return embeddings
+
+    def _get_backoff(self, state: RateLimitState, e: Exception, attempt: int) -> float:
+        response = getattr(e, "response", None)
+        headers = response.headers if response is not None else {}
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                # Other requests for the same key wait out the rate limit too.
+                state.block(float(retry_after))
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Exponential backoff with full jitter.
+        backoff = min(self.initial_backoff * 2**attempt, self.max_backoff)
+        return random.uniform(0, backoff)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_concurrent_requests,
+                    thread_name_prefix="bondai-embeddings",
+                )
+            return self._executor
@@ -1,16 +1,35 @@
+import json
+import hashlib
 from typing import List, Dict
 from bondai.models import EmbeddingModel
+from bondai.util.single_flight import SingleFlight, DEFAULT_WAIT_TIMEOUT
 from .openai_models import ModelConfig, OpenAIModelType, OpenAIModelNames
-from .openai_wrapper import create_embedding, count_tokens, get_max_tokens
+from .openai_wrapper import (
+    create_embedding,
+    acreate_embedding,
+    count_tokens,
+    count_tokens_many,
+    encode_tokens,
+    decode_tokens,
+    is_token_boundary,
+    get_max_tokens,
+    _get_client_key,
+)
 from .openai_connection_params import OpenAIConnectionParams
 from . import default_openai_connection_params as DefaultOpenAIConnectionParams
 
+# Shared by every OpenAIEmbeddingModel so identical requests made at the same
+# time, such as the same query from several agents, share one API call.
+_embedding_requests = SingleFlight()
+
 
 class OpenAIEmbeddingModel(EmbeddingModel):
     def __init__(
         self,
         model: OpenAIModelNames = OpenAIModelNames.TEXT_EMBEDDING_ADA_002,
         connection_params: OpenAIConnectionParams | None = None,
+        enable_request_coalescing: bool = True,
+        request_coalescing_timeout: float | None = DEFAULT_WAIT_TIMEOUT,
     ):
         self._model = model.value if isinstance(model, OpenAIModelNames) else model
         self._connection_params = (
@@ -24,6 +43,12 @@ class OpenAIEmbeddingModel(EmbeddingModel):
 
         if not self._connection_params:
             raise Exception("Connection parameters not set for OpenAIEmbeddingModel.")
+        self._enable_request_coalescing = enable_request_coalescing
+        self._request_coalescing_timeout = request_coalescing_timeout
+
+    @property
+    def model_name(self) -> str:
+        return self._model
 
     @property
     def embedding_size(self) -> int:
@@ -34,9 +59,57 @@ class OpenAIEmbeddingModel(EmbeddingModel):
         return get_max_tokens(self._model)
 
     def create_embedding(self, prompt: str) -> List[float] | List[List[float]]:
-        return create_embedding(
-            prompt, connection_params=self._connection_params, model=self._model
+        def request():
+            return create_embedding(
+                prompt, connection_params=self._connection_params, model=self._model
+            )
+
+        if not self._enable_request_coalescing:
+            return request()
+        return _embedding_requests.do(
+            self._get_request_key(prompt),
+            request,
+            timeout=self._request_coalescing_timeout,
         )
 
+    async def acreate_embedding(
+        self, prompt: str | List[str]
+    ) -> List[float] | List[List[float]]:
+        async def request():
+            return await acreate_embedding(
+                prompt, connection_params=self._connection_params, model=self._model
+            )
+
+        if not self._enable_request_coalescing:
+            return await request()
+        return await _embedding_requests.ado(
+            self._get_request_key(prompt),
+            request,
+            timeout=self._request_coalescing_timeout,
+        )
+
+    def _get_request_key(self, prompt: str | List[str]) -> str:
+        key_str = json.dumps(
+            [self._model, _get_client_key(self._connection_params), prompt],
+            default=str,
+        )
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
     def count_tokens(self, prompt: str) -> int:
         return count_tokens(prompt, self._model)
+
+    def count_tokens_many(self, prompts: List[str]) -> List[int]:
+        return count_tokens_many(prompts, self._model)
+
+    @property
+    def supports_tokenization(self) -> bool:
+        return True
+
+    def encode(self, prompt: str) -> List[int]:
+        return encode_tokens(prompt, self._model)
+
+    def decode(self, tokens: List[int]) -> str:
+        return decode_tokens(tokens, self._model)
+
+    def is_token_boundary(self, tokens: List[int], index: int) -> bool:
+        return is_token_boundary(tokens, index, self._model)
@@ -1,11 +1,22 @@
-from typing import Dict, List, Callable
-from bondai.models import LLM
+import copy
+import json
+import asyncio
+import hashlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Callable, AsyncIterator
+from bondai.models import LLM, StreamingCompletionUpdate, replay_completion
 from bondai.util.caching import LLMCache
+from bondai.util.single_flight import SingleFlight, DEFAULT_WAIT_TIMEOUT
 from .openai_wrapper import (
     get_streaming_completion,
     get_completion,
+    aget_streaming_completion,
+    aget_completion,
     count_tokens,
+    count_tokens_many,
     get_max_tokens,
+    _get_client_key,
+    DEFAULT_TEMPERATURE,
 )
 from .openai_connection_params import (
     OpenAIConnectionParams,
@@ -18,6 +29,10 @@ from .openai_models import (
     OpenAIModelFamilyType,
 )
 
+# Shared by every OpenAILLM so identical requests from different agents are
+# coalesced.
+_completion_requests = SingleFlight()
+
 
 class OpenAILLM(LLM):
     def __init__(
@@ -25,8 +40,21 @@ class OpenAILLM(LLM):
         model: OpenAIModelNames | str,
         connection_params: OpenAIConnectionParams = None,
         cache: LLMCache = None,
+        enable_tool_calls: bool = False,
+        cache_replay_chunk_size: int | None = None,
+        enable_request_coalescing: bool = False,
+        request_coalescing_timeout: float | None = DEFAULT_WAIT_TIMEOUT,
     ):
         self._cache = cache
+        # Cached responses to streaming requests are replayed through the
+        # stream callbacks in chunks of this many characters.
+        self._cache_replay_chunk_size = cache_replay_chunk_size
+        # Concurrent identical requests share a single API call and result.
+        # Only requests with a temperature of 0 and a single choice are
+        # coalesced, since sampled requests should get their own completions.
+        # Waiting requests make their own API call after the timeout.
+        self._enable_request_coalescing = enable_request_coalescing
+        self._request_coalescing_timeout = request_coalescing_timeout
 
         self._model = model.value if isinstance(model, OpenAIModelNames) else model
         if ModelConfig[self._model]["model_type"] != OpenAIModelType.LLM:
@@ -46,6 +74,12 @@ class OpenAILLM(LLM):
         if not self._connection_params:
             raise Exception(f"Connection parameters not set for model {self._model}.")
 
+        if enable_tool_calls and not ModelConfig[self._model].get(
+            "supports_tool_calls"
+        ):
+            raise Exception(f"Model {self._model} does not support tool calls.")
+        self._enable_tool_calls = enable_tool_calls
+
     @property
     def max_tokens(self) -> int:
         return get_max_tokens(self._model)
@@ -54,9 +88,16 @@ class OpenAILLM(LLM):
     def supports_streaming(self) -> bool:
         return True
 
+    @property
+    def supports_tool_calls(self) -> bool:
+        return self._enable_tool_calls
+
     def count_tokens(self, prompt: str) -> int:
         return count_tokens(prompt, self._model)
 
+    def count_tokens_many(self, prompts: List[str]) -> List[int]:
+        return count_tokens_many(prompts, self._model)
+
     def get_completion(
         self,
         messages: List[Dict] | None = None,
@@ -68,33 +109,104 @@ class OpenAILLM(LLM):
         if functions is None:
             functions = []
 
+        input_parameters = self._get_cache_input_parameters(messages, functions, kwargs)
         if self._cache:
-            input_parameters = {"messages": messages, "functions": functions, **kwargs}
             cache_item = self._cache.get_cache_item(input_parameters=input_parameters)
             if cache_item:
                 return cache_item
 
-        result = get_completion(
-            connection_params=self._connection_params,
-            messages=messages,
-            functions=functions,
-            model=self._model,
-            **kwargs,
+        def request():
+            result = get_completion(
+                connection_params=self._connection_params,
+                messages=messages,
+                functions=functions,
+                model=self._model,
+                use_tool_calls=self._enable_tool_calls,
+                **kwargs,
+            )
+            if self._cache:
+                self._cache.save_cache_item(
+                    input_parameters=input_parameters, response=result
+                )
+            return result
+
+        if not self._should_coalesce(kwargs):
+            return request()
+        return _completion_requests.do(
+            self._get_request_key(input_parameters),
+            request,
+            timeout=self._request_coalescing_timeout,
         )
 
+    def get_streaming_completion(
+        self,
+        messages: List[Dict] | None = None,
+        functions: List[Dict] | None = None,
+        content_stream_callback: Callable[[str], None] = None,
+        function_stream_callback: Callable[[str], None] = None,
+        **kwargs,
+    ) -> (str, Dict | None):
+        if messages is None:
+            messages = []
+        if functions is None:
+            functions = []
+
+        def replay(completion):
+            for update in replay_completion(completion, self._cache_replay_chunk_size):
+                if update.content and content_stream_callback:
+                    content_stream_callback(update.content)
+                if update.function_name and function_stream_callback:
+                    function_stream_callback(
+                        update.function_name, update.function_arguments
+                    )
+            return completion
+
+        input_parameters = self._get_cache_input_parameters(messages, functions, kwargs)
         if self._cache:
-            self._cache.save_cache_item(
-                input_parameters=input_parameters, response=result
+            cache_item = self._cache.get_cache_item(input_parameters=input_parameters)
+            if cache_item:
+                return replay(cache_item)
+
+        future = None
+        if self._should_coalesce(kwargs):
+            request_key = self._get_request_key(input_parameters)
+            future, leader = _completion_requests.join(request_key)
+            if not leader:
+                # The identical request in flight is replayed once it completes.
+                try:
+                    completion = future.result(timeout=self._request_coalescing_timeout)
+                    return replay(copy.deepcopy(completion))
+                except FutureTimeoutError:
+                    future = None
+
+        try:
+            result = get_streaming_completion(
+                connection_params=self._connection_params,
+                messages=messages,
+                functions=functions,
+                model=self._model,
+                use_tool_calls=self._enable_tool_calls,
+                content_stream_callback=content_stream_callback,
+                function_stream_callback=function_stream_callback,
+                **kwargs,
             )
+            if self._cache:
+                self._cache.save_cache_item(
+                    input_parameters=input_parameters, response=result
+                )
+        except BaseException as e:
+            if future:
+                _completion_requests.finish(request_key, future, error=e)
+            raise
+        if future:
+            _completion_requests.finish(request_key, future, result=result)
 
         return result
 
-    def get_streaming_completion(
+    async def aget_completion(
         self,
         messages: List[Dict] | None = None,
         functions: List[Dict] | None = None,
-        content_stream_callback: Callable[[str], None] = None,
-        function_stream_callback: Callable[[str], None] = None,
         **kwargs,
     ) -> (str, Dict | None):
         if messages is None:
@@ -102,25 +214,135 @@ class OpenAILLM(LLM):
         if functions is None:
             functions = []
 
+        input_parameters = self._get_cache_input_parameters(messages, functions, kwargs)
         if self._cache:
-            input_parameters = {"messages": messages, "functions": functions, **kwargs}
             cache_item = self._cache.get_cache_item(input_parameters=input_parameters)
             if cache_item:
                 return cache_item
 
-        result = get_streaming_completion(
-            connection_params=self._connection_params,
-            messages=messages,
-            functions=functions,
-            model=self._model,
-            content_stream_callback=content_stream_callback,
-            function_stream_callback=function_stream_callback,
-            **kwargs,
+        async def request():
+            result = await aget_completion(
+                connection_params=self._connection_params,
+                messages=messages,
+                functions=functions,
+                model=self._model,
+                use_tool_calls=self._enable_tool_calls,
+                **kwargs,
+            )
+            if self._cache:
+                self._cache.save_cache_item(
+                    input_parameters=input_parameters, response=result
+                )
+            return result
+
+        if not self._should_coalesce(kwargs):
+            return await request()
+        return await _completion_requests.ado(
+            self._get_request_key(input_parameters),
+            request,
+            timeout=self._request_coalescing_timeout,
         )
 
+    async def aget_streaming_completion(
+        self,
+        messages: List[Dict] | None = None,
+        functions: List[Dict] | None = None,
+        **kwargs,
+    ) -> AsyncIterator[StreamingCompletionUpdate]:
+        if messages is None:
+            messages = []
+        if functions is None:
+            functions = []
+
+        input_parameters = self._get_cache_input_parameters(messages, functions, kwargs)
         if self._cache:
-            self._cache.save_cache_item(
-                input_parameters=input_parameters, response=result
-            )
+            cache_item = self._cache.get_cache_item(input_parameters=input_parameters)
+            if cache_item:
+                for update in replay_completion(
+                    cache_item, self._cache_replay_chunk_size
+                ):
+                    yield update
+                return
 
-        return result
+        future = None
+        if self._should_coalesce(kwargs):
+            request_key = self._get_request_key(input_parameters)
+            future, leader = _completion_requests.join(request_key)
+            if not leader:
+                # The identical request in flight is replayed once it completes.
+                try:
+                    completion = await SingleFlight.await_future(
+                        future, self._request_coalescing_timeout
+                    )
+                except asyncio.TimeoutError:
+                    future = None
+                else:
+                    for update in replay_completion(
+                        copy.deepcopy(completion), self._cache_replay_chunk_size
+                    ):
+                        yield update
+                    return
+
+        try:
+            async for update in aget_streaming_completion(
+                connection_params=self._connection_params,
+                messages=messages,
+                functions=functions,
+                model=self._model,
+                use_tool_calls=self._enable_tool_calls,
+                **kwargs,
+            ):
+                if update.completion:
+                    if self._cache:
+                        self._cache.save_cache_item(
+                            input_parameters=input_parameters,
+                            response=update.completion,
+                        )
+                    if future:
+                        _completion_requests.finish(
+                            request_key, future, result=update.completion
+                        )
+                yield update
+        except Exception as e:
+            if future:
+                _completion_requests.finish(request_key, future, error=e)
+            raise
+        finally:
+            # The stream may be cancelled or closed before it completes.
+            if future:
+                _completion_requests.finish(
+                    request_key,
+                    future,
+                    error=RuntimeError("The streaming completion was not finished."),
+                )
+
+    def _should_coalesce(self, kwargs: Dict) -> bool:
+        return (
+            self._enable_request_coalescing
+            and kwargs.get("temperature", DEFAULT_TEMPERATURE) == 0
+            and kwargs.get("n", 1) == 1
+        )
+
+    def _get_request_key(self, input_parameters: Dict) -> str:
+        # Requests are only coalesced with identical requests to the same
+        # model and endpoint.
+        key_str = json.dumps(
+            {
+                "model": self._model,
+                "connection": _get_client_key(self._connection_params),
+                "input_parameters": input_parameters,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
+    def _get_cache_input_parameters(
+        self, messages: List[Dict], functions: List[Dict], kwargs: Dict
+    ) -> Dict:
+        input_parameters = {"messages": messages, "functions": functions, **kwargs}
+        if self._enable_tool_calls:
+            # Tool call completions return a list of functions so they are
+            # cached separately from single function completions.
+            input_parameters["tool_calls"] = True
+        return input_parameters
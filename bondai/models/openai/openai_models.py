@@ -56,6 +56,7 @@ ModelConfig = {
         "max_tokens": 128000,
         "input_price_per_token": 0.00001,
         "output_price_per_token": 0.00003,
+        "supports_tool_calls": True,
     },
     OpenAIModelNames.GPT35_TURBO.value: {
         "model_type": OpenAIModelType.LLM,
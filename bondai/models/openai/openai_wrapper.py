@@ -1,12 +1,25 @@
 import json
+import httpx
+import asyncio
 import tiktoken
-from typing import Dict, List, Callable
-from openai import OpenAI, AzureOpenAI
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from weakref import WeakKeyDictionary
+from typing import Dict, List, Callable, Tuple, AsyncIterator, Iterator
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
+from bondai.models import StreamingCompletionUpdate
 from .openai_connection_params import OpenAIConnectionParams
 from .openai_models import ModelConfig, OpenAIModelType, OpenAIConnectionType
+from .embedding_scheduler import EmbeddingScheduler
 from bondai.util import ModelLogger
 
 DEFAULT_TEMPERATURE = 0.1
+TOKENIZER_THREADS = 8
+MIN_TOKENIZER_BATCH_SIZE = 16
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
 
 embedding_tokens = 0
 embedding_costs = 0.0
@@ -15,6 +28,25 @@ gpt_costs = 0.0
 
 logger = None
 
+_costs_lock = threading.Lock()
+_cost_trackers: ContextVar[Tuple["CostTracker", ...]] = ContextVar(
+    "cost_trackers", default=()
+)
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+_http_limits = httpx.Limits(
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+)
+_clients: WeakKeyDictionary = WeakKeyDictionary()
+_async_clients: WeakKeyDictionary = WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+_embedding_scheduler = EmbeddingScheduler()
+
 
 def enable_logging(model_logger: ModelLogger):
     global logger
@@ -26,6 +58,126 @@ def disable_logging():
     logger = None
 
 
+def configure_http_pool(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+):
+    global _http_limits
+    _http_limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    # Existing clients may still have requests in flight, so they are released
+    # rather than closed and new requests use clients with the new limits.
+    with _clients_lock:
+        _clients.clear()
+        _async_clients.clear()
+
+
+def close_clients():
+    with _clients_lock:
+        clients = [client for _, client in _clients.values()]
+        async_clients = [
+            (loop, client)
+            for loop, loop_clients in _async_clients.items()
+            for _, client in loop_clients.values()
+        ]
+        _clients.clear()
+        _async_clients.clear()
+
+    for client in clients:
+        client.close()
+    # Async clients can only be closed from their own event loop, so closing
+    # is scheduled there. Clients of closed loops are just released.
+    for loop, client in async_clients:
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+
+
+async def aclose_clients():
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _async_clients.pop(loop, {})
+        clients = [client for _, client in loop_clients.values()]
+    for client in clients:
+        await client.close()
+
+
+def _get_client_key(connection_params: OpenAIConnectionParams) -> Tuple:
+    return (
+        connection_params.connection_type,
+        connection_params.api_key,
+        connection_params.api_version,
+        connection_params.azure_endpoint,
+        connection_params.azure_deployment,
+    )
+
+
+def _create_client(
+    connection_params: OpenAIConnectionParams, async_client: bool = False
+) -> OpenAI | AzureOpenAI | AsyncOpenAI | AsyncAzureOpenAI:
+    if async_client:
+        http_client = httpx.AsyncClient(limits=_http_limits)
+    else:
+        http_client = httpx.Client(limits=_http_limits)
+
+    if connection_params.connection_type == OpenAIConnectionType.AZURE:
+        client_class = AsyncAzureOpenAI if async_client else AzureOpenAI
+        return client_class(
+            api_key=connection_params.api_key,
+            api_version=connection_params.api_version,
+            azure_endpoint=connection_params.azure_endpoint,
+            azure_deployment=connection_params.azure_deployment,
+            http_client=http_client,
+        )
+    else:
+        client_class = AsyncOpenAI if async_client else OpenAI
+        return client_class(
+            api_key=connection_params.api_key,
+            http_client=http_client,
+        )
+
+
+def _get_client(connection_params: OpenAIConnectionParams) -> OpenAI | AzureOpenAI:
+    # Clients (and their connection pools) are reused for as long as the
+    # connection parameters are unchanged. Calling configure_openai_connection
+    # or configure_azure_connection on the parameters changes the key and
+    # causes a new client to be created.
+    client_key = _get_client_key(connection_params)
+    with _clients_lock:
+        cached = _clients.get(connection_params)
+        if cached and cached[0] == client_key:
+            return cached[1]
+
+        # The previous client is not closed since other threads may still be
+        # using it. Its connections are closed once it is garbage collected.
+        client = _create_client(connection_params)
+        _clients[connection_params] = (client_key, client)
+        return client
+
+
+def _get_async_client(
+    connection_params: OpenAIConnectionParams,
+) -> AsyncOpenAI | AsyncAzureOpenAI:
+    # httpx async connection pools are bound to the event loop that created
+    # them so async clients are cached per running loop.
+    loop = asyncio.get_running_loop()
+    client_key = _get_client_key(connection_params)
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, WeakKeyDictionary())
+        cached = loop_clients.get(connection_params)
+        if cached and cached[0] == client_key:
+            return cached[1]
+
+        # As with _get_client, the previous client is left to be garbage
+        # collected since other tasks may still be using it.
+        client = _create_client(connection_params, async_client=True)
+        loop_clients[connection_params] = (client_key, client)
+        return client
+
+
 def get_gpt_tokens() -> int:
     return gpt_tokens
 
@@ -48,10 +200,33 @@ def get_total_cost() -> float:
 
 def reset_total_cost():
     global embedding_costs, embedding_tokens, gpt_costs, gpt_tokens
-    embedding_costs = 0.0
-    embedding_tokens = 0
-    gpt_costs = 0.0
-    gpt_tokens = 0
+    with _costs_lock:
+        embedding_costs = 0.0
+        embedding_tokens = 0
+        gpt_costs = 0.0
+        gpt_tokens = 0
+
+
+class CostTracker:
+    """Accumulates the cost of the API calls made inside a track_costs() block."""
+
+    def __init__(self):
+        self.total_cost: float = 0.0
+
+
+@contextmanager
+def track_costs() -> Iterator[CostTracker]:
+    """
+    Tracks the cost of API calls made in the current context. Unlike deltas of
+    get_total_cost(), tracked costs are not mixed up by calls made concurrently
+    from other threads or tasks.
+    """
+    tracker = CostTracker()
+    token = _cost_trackers.set(_cost_trackers.get() + (tracker,))
+    try:
+        yield tracker
+    finally:
+        _cost_trackers.reset(token)
 
 
 def calculate_cost(model_name: str, usage: Dict):
@@ -61,14 +236,20 @@ def calculate_cost(model_name: str, usage: Dict):
         model = ModelConfig[model_name]
         token_count = usage["total_tokens"]
 
-        if model["model_type"] == OpenAIModelType.LLM:
-            gpt_tokens += token_count
-            gpt_costs += (usage["prompt_tokens"] * model["input_price_per_token"]) + (
-                usage["completion_tokens"] * model["output_price_per_token"]
-            )
-        else:
-            embedding_tokens += token_count
-            embedding_costs += token_count * model["price_per_token"]
+        with _costs_lock:
+            if model["model_type"] == OpenAIModelType.LLM:
+                cost = (usage["prompt_tokens"] * model["input_price_per_token"]) + (
+                    usage["completion_tokens"] * model["output_price_per_token"]
+                )
+                gpt_tokens += token_count
+                gpt_costs += cost
+            else:
+                cost = token_count * model["price_per_token"]
+                embedding_tokens += token_count
+                embedding_costs += cost
+
+            for tracker in _cost_trackers.get():
+                tracker.total_cost += cost
     # else:
     #     print(f"Unknown model: {model_name}")
 
@@ -77,36 +258,120 @@ def get_max_tokens(model: str) -> int:
     return ModelConfig[model]["max_tokens"]
 
 
-def count_tokens(prompt: str, model: Dict) -> int:
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(prompt))
+def get_encoding(model: str) -> tiktoken.Encoding:
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(model)
+            if encoding is None:
+                encoding = tiktoken.encoding_for_model(model)
+                _encodings[model] = encoding
+    return encoding
+
+
+def count_tokens(prompt: str, model: str) -> int:
+    return len(get_encoding(model).encode(prompt))
+
+
+def encode_tokens(prompt: str, model: str) -> List[int]:
+    return get_encoding(model).encode(prompt)
+
+
+def decode_tokens(tokens: List[int], model: str) -> str:
+    return get_encoding(model).decode(tokens)
+
+
+def is_token_boundary(tokens: List[int], index: int, model: str) -> bool:
+    if index <= 0 or index >= len(tokens):
+        return True
+    # Tokens are byte sequences, and a token that starts with a UTF-8
+    # continuation byte continues a character from the previous token.
+    token_bytes = get_encoding(model).decode_single_token_bytes(tokens[index])
+    return token_bytes[0] & 0xC0 != 0x80
+
+
+def count_tokens_many(prompts: List[str], model: str) -> List[int]:
+    encoding = get_encoding(model)
+    if len(prompts) < MIN_TOKENIZER_BATCH_SIZE:
+        return [len(encoding.encode(p)) for p in prompts]
+    tokens = encoding.encode_batch(prompts, num_threads=TOKENIZER_THREADS)
+    return [len(t) for t in tokens]
+
+
+def configure_embedding_scheduler(**kwargs):
+    """
+    Replaces the scheduler used for all embedding requests. Accepts the
+    arguments of EmbeddingScheduler.
+    """
+    global _embedding_scheduler
+    _embedding_scheduler = EmbeddingScheduler(**kwargs)
+
+
+def get_embedding_scheduler() -> EmbeddingScheduler:
+    return _embedding_scheduler
 
 
 def create_embedding(
-    text: str,
+    text: str | List[str],
     connection_params: OpenAIConnectionParams,
     model: str = "text-embedding-ada-002",
     **kwargs,
-) -> [float]:
+) -> List[List[float]]:
+    texts = text if isinstance(text, list) else [text]
+
+    def request(batch: List[str]):
+        params = _get_embedding_params(batch, connection_params, model)
+        response = _get_client(connection_params).embeddings.with_raw_response.create(
+            **params, **kwargs
+        )
+        return _handle_embedding_response(response.parse(), model), response.headers
+
+    return _embedding_scheduler.embed(
+        texts,
+        count_tokens_many(texts, model),
+        request,
+        (_get_client_key(connection_params), model),
+    )
+
+
+async def acreate_embedding(
+    text: str | List[str],
+    connection_params: OpenAIConnectionParams,
+    model: str = "text-embedding-ada-002",
+    **kwargs,
+) -> List[List[float]]:
+    texts = text if isinstance(text, list) else [text]
+
+    async def request(batch: List[str]):
+        params = _get_embedding_params(batch, connection_params, model)
+        client = _get_async_client(connection_params)
+        response = await client.embeddings.with_raw_response.create(**params, **kwargs)
+        return _handle_embedding_response(response.parse(), model), response.headers
+
+    return await _embedding_scheduler.aembed(
+        texts,
+        count_tokens_many(texts, model),
+        request,
+        (_get_client_key(connection_params), model),
+    )
+
+
+def _get_embedding_params(
+    text: str, connection_params: OpenAIConnectionParams, model: str
+) -> Dict:
     params = {
         "input": text if isinstance(text, list) else [text],
     }
 
     if connection_params.connection_type == OpenAIConnectionType.AZURE:
-        client = AzureOpenAI(
-            api_key=connection_params.api_key,
-            api_version=connection_params.api_version,
-            azure_endpoint=connection_params.azure_endpoint,
-        )
         params["model"] = connection_params.azure_deployment
     else:
-        client = OpenAI(
-            api_key=connection_params.api_key,
-        )
         params["model"] = model
 
-    response = client.embeddings.create(**params, **kwargs)
+    return params
+
 
+def _handle_embedding_response(response, model: str) -> List[List[float]]:
     calculate_cost(
         model,
         {
@@ -117,12 +382,7 @@ def create_embedding(
         },
     )
 
-    embeddings = [d.embedding for d in response.data]
-
-    if len(embeddings) > 0:
-        return embeddings
-    else:
-        return embeddings[0]
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
 
 
 def get_completion(
@@ -130,8 +390,9 @@ def get_completion(
     messages: List[Dict] | None = None,
     functions: List[Dict] | None = None,
     model: str = "gpt-4",
+    use_tool_calls: bool = False,
     **kwargs,
-) -> (str, Dict | None):
+) -> (str, Dict | List[Dict] | None):
     if messages is None:
         messages = []
     if functions is None:
@@ -142,18 +403,61 @@ def get_completion(
         messages=messages,
         functions=functions,
         model=model,
+        use_tool_calls=use_tool_calls,
+        **kwargs,
+    )
+
+    return _handle_completion_response(
+        response, messages, functions, model, use_tool_calls
+    )
+
+
+async def aget_completion(
+    connection_params: OpenAIConnectionParams,
+    messages: List[Dict] | None = None,
+    functions: List[Dict] | None = None,
+    model: str = "gpt-4",
+    use_tool_calls: bool = False,
+    **kwargs,
+) -> (str, Dict | List[Dict] | None):
+    if messages is None:
+        messages = []
+    if functions is None:
+        functions = []
+
+    response = await _aget_completion(
+        connection_params=connection_params,
+        messages=messages,
+        functions=functions,
+        model=model,
+        use_tool_calls=use_tool_calls,
         **kwargs,
     )
 
+    return _handle_completion_response(
+        response, messages, functions, model, use_tool_calls
+    )
+
+
+def _handle_completion_response(
+    response,
+    messages: List[Dict],
+    functions: List[Dict],
+    model: str,
+    use_tool_calls: bool = False,
+) -> (str, Dict | List[Dict] | None):
     function = None
     message = response.choices[0].message
-    if message.function_call:
-        function = {"name": message.function_call.name}
-        if message.function_call.arguments:
-            try:
-                function["arguments"] = json.loads(message.function_call.arguments)
-            except json.decoder.JSONDecodeError:
-                pass
+    if use_tool_calls:
+        if message.tool_calls:
+            function = [
+                _parse_function_call(t.function.name, t.function.arguments, t.id)
+                for t in message.tool_calls
+            ]
+    elif message.function_call:
+        function = _parse_function_call(
+            message.function_call.name, message.function_call.arguments
+        )
 
     calculate_cost(
         model,
@@ -174,6 +478,20 @@ def get_completion(
     return message.content, function
 
 
+def _parse_function_call(
+    name: str, arguments: str | None, tool_call_id: str | None = None
+) -> Dict:
+    function = {"name": name}
+    if tool_call_id:
+        function["id"] = tool_call_id
+    if arguments:
+        try:
+            function["arguments"] = json.loads(arguments)
+        except json.decoder.JSONDecodeError:
+            pass
+    return function
+
+
 def get_streaming_completion(
     connection_params: OpenAIConnectionParams,
     messages: List[Dict] | None = None,
@@ -181,8 +499,9 @@ def get_streaming_completion(
     model: str = "gpt-4",
     content_stream_callback: Callable[[str], None] | None = None,
     function_stream_callback: Callable[[str], None] | None = None,
+    use_tool_calls: bool = False,
     **kwargs,
-) -> (str, Dict | None):
+) -> (str, Dict | List[Dict] | None):
     if messages is None:
         messages = []
     if functions is None:
@@ -193,68 +512,148 @@ def get_streaming_completion(
         messages=messages,
         functions=functions,
         model=model,
+        use_tool_calls=use_tool_calls,
         stream=True,
         **kwargs,
     )
 
-    content = ""
-    function_name = ""
-    function_arguments = ""
-
+    stream_buffer = _StreamingCompletionBuffer(use_tool_calls)
     for chunk in response:
+        for update in stream_buffer.add_chunk(chunk):
+            if update.content and content_stream_callback:
+                content_stream_callback(update.content)
+            if update.function_name and function_stream_callback:
+                function_stream_callback(
+                    update.function_name, update.function_arguments
+                )
+
+    return stream_buffer.complete(messages, functions, model)
+
+
+async def aget_streaming_completion(
+    connection_params: OpenAIConnectionParams,
+    messages: List[Dict] | None = None,
+    functions: List[Dict] | None = None,
+    model: str = "gpt-4",
+    use_tool_calls: bool = False,
+    **kwargs,
+) -> AsyncIterator[StreamingCompletionUpdate]:
+    if messages is None:
+        messages = []
+    if functions is None:
+        functions = []
+
+    response = await _aget_completion(
+        connection_params=connection_params,
+        messages=messages,
+        functions=functions,
+        model=model,
+        use_tool_calls=use_tool_calls,
+        stream=True,
+        **kwargs,
+    )
+
+    stream_buffer = _StreamingCompletionBuffer(use_tool_calls)
+    async for chunk in response:
+        for update in stream_buffer.add_chunk(chunk):
+            yield update
+
+    yield StreamingCompletionUpdate(
+        completion=stream_buffer.complete(messages, functions, model)
+    )
+
+
+class _StreamingCompletionBuffer:
+    def __init__(self, use_tool_calls: bool = False):
+        self.use_tool_calls = use_tool_calls
+        self.content = ""
+        self.function_name = ""
+        self.function_arguments = ""
+        # Tool call name/argument buffers and ids, keyed by the tool call index.
+        self.tool_calls: Dict[int, List[str]] = {}
+        self.tool_call_ids: Dict[int, str] = {}
+
+    def add_chunk(self, chunk) -> List[StreamingCompletionUpdate]:
+        updates = []
         if len(chunk.choices) == 0:
-            continue
+            return updates
 
         delta = chunk.choices[0].delta
         if delta.content:
-            content += delta.content
-            if content_stream_callback:
-                content_stream_callback(delta.content)
+            self.content += delta.content
+            updates.append(StreamingCompletionUpdate(content=delta.content))
 
         function_call = delta.function_call
         if function_call:
             if function_call.name:
-                function_name += function_call.name
+                self.function_name += function_call.name
             if function_call.arguments:
-                function_arguments += function_call.arguments
-            if function_stream_callback:
-                function_stream_callback(function_name, function_arguments)
-
-    function = None
-    if function_name:
-        function = {"name": function_name}
-        if function_arguments:
-            try:
-                function["arguments"] = json.loads(function_arguments)
-            except json.decoder.JSONDecodeError:
-                pass
-
-    if function:
-        completion_tokens = content + json.dumps(function)
-    else:
-        completion_tokens = content
+                self.function_arguments += function_call.arguments
+            updates.append(
+                StreamingCompletionUpdate(
+                    function_name=self.function_name,
+                    function_arguments=self.function_arguments,
+                )
+            )
 
-    completion_token_count = count_tokens(completion_tokens, model)
-    prompt_tokens = json.dumps(messages)
-    prompt_token_count = count_tokens(prompt_tokens, model)
+        for tool_call in delta.tool_calls or []:
+            if not tool_call.function:
+                continue
+            buffer = self.tool_calls.setdefault(tool_call.index, ["", ""])
+            if tool_call.id:
+                self.tool_call_ids[tool_call.index] = tool_call.id
+            if tool_call.function.name:
+                buffer[0] += tool_call.function.name
+            if tool_call.function.arguments:
+                buffer[1] += tool_call.function.arguments
+            updates.append(
+                StreamingCompletionUpdate(
+                    function_name=buffer[0], function_arguments=buffer[1]
+                )
+            )
 
-    calculate_cost(
-        model,
-        {
-            "total_tokens": prompt_token_count + completion_token_count,
-            "prompt_tokens": prompt_token_count,
-            "completion_tokens": completion_token_count,
-        },
-    )
+        return updates
+
+    def complete(
+        self, messages: List[Dict], functions: List[Dict], model: str
+    ) -> (str, Dict | List[Dict] | None):
+        content = self.content
+        function = None
+        if self.use_tool_calls:
+            if self.tool_calls:
+                function = [
+                    _parse_function_call(name, arguments, self.tool_call_ids.get(index))
+                    for index, (name, arguments) in sorted(self.tool_calls.items())
+                ]
+        elif self.function_name:
+            function = _parse_function_call(self.function_name, self.function_arguments)
+
+        if function:
+            completion_tokens = content + json.dumps(function)
+        else:
+            completion_tokens = content
+
+        completion_token_count = count_tokens(completion_tokens, model)
+        prompt_tokens = json.dumps(messages)
+        prompt_token_count = count_tokens(prompt_tokens, model)
+
+        calculate_cost(
+            model,
+            {
+                "total_tokens": prompt_token_count + completion_token_count,
+                "prompt_tokens": prompt_token_count,
+                "completion_tokens": completion_token_count,
+            },
+        )
 
-    _log_completion(
-        messages,
-        functions=functions,
-        response_content=content,
-        response_function=function,
-    )
+        _log_completion(
+            messages,
+            functions=functions,
+            response_content=content,
+            response_function=function,
+        )
 
-    return content, function
+        return content, function
 
 
 def _log_completion(
@@ -291,8 +690,41 @@ def _get_completion(
     messages: List[Dict] | None = None,
     functions: List[Dict] | None = None,
     model: str = "gpt-4",
+    use_tool_calls: bool = False,
+    **kwargs,
+):
+    params = _get_completion_params(
+        connection_params, messages, functions, model, use_tool_calls
+    )
+    # Parameters passed by the caller, such as temperature, override the defaults.
+    return _get_client(connection_params).chat.completions.create(
+        **{**params, **kwargs}
+    )
+
+
+async def _aget_completion(
+    connection_params: OpenAIConnectionParams,
+    messages: List[Dict] | None = None,
+    functions: List[Dict] | None = None,
+    model: str = "gpt-4",
+    use_tool_calls: bool = False,
     **kwargs,
-) -> (str, Dict | None):
+):
+    params = _get_completion_params(
+        connection_params, messages, functions, model, use_tool_calls
+    )
+    return await _get_async_client(connection_params).chat.completions.create(
+        **{**params, **kwargs}
+    )
+
+
+def _get_completion_params(
+    connection_params: OpenAIConnectionParams,
+    messages: List[Dict] | None = None,
+    functions: List[Dict] | None = None,
+    model: str = "gpt-4",
+    use_tool_calls: bool = False,
+) -> Dict:
     if messages is None:
         messages = []
     if functions is None:
@@ -304,20 +736,14 @@ def _get_completion(
     }
 
     if connection_params.connection_type == OpenAIConnectionType.AZURE:
-        client = AzureOpenAI(
-            api_key=connection_params.api_key,
-            api_version=connection_params.api_version,
-            azure_endpoint=connection_params.azure_endpoint,
-            azure_deployment=connection_params.azure_deployment,
-        )
         params["model"] = connection_params.azure_deployment
     else:
-        client = OpenAI(
-            api_key=connection_params.api_key,
-        )
         params["model"] = model
 
     if len(functions) > 0:
-        params["functions"] = functions
+        if use_tool_calls:
+            params["tools"] = [{"type": "function", "function": f} for f in functions]
+        else:
+            params["functions"] = functions
 
-    return client.chat.completions.create(**params, **kwargs)
+    return params
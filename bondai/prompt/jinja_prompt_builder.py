@@ -1,22 +1,113 @@
+import hashlib
 import platform
+import itertools
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from jinja2 import Template
+from jinja2 import (
+    BytecodeCache,
+    Environment,
+    FileSystemBytecodeCache,
+    FunctionLoader,
+    Template,
+)
 from bondai.prompt import PromptBuilder
 
+TEMPLATE_CACHE_SIZE = 1000
+
+# Template sources by name, where the name is a hash of the source. The most
+# recently used sources are kept, as many as the environment keeps compiled
+# templates, so the sources of evicted templates are dropped with them.
+_template_sources: OrderedDict[str, str] = OrderedDict()
+_template_sources_lock = threading.Lock()
+# Identifies each JinjaPromptBuilder in the prompts memoized on messages.
+_builder_ids = itertools.count()
+
+
+def _load_template(name: str):
+    with _template_sources_lock:
+        source = _template_sources.get(name)
+    if source is None:
+        return None
+    # Sources never change for a given name, so templates are always up to date.
+    return source, None, lambda: True
+
+
+def _get_bytecode_cache() -> BytecodeCache | None:
+    try:
+        return FileSystemBytecodeCache()
+    except (OSError, RuntimeError):
+        return None
+
+
+# Shared by every JinjaPromptBuilder. Compiled templates are kept in memory by
+# the environment and their bytecode on disk, so each template is only parsed
+# and compiled once.
+template_environment = Environment(
+    loader=FunctionLoader(_load_template),
+    bytecode_cache=_get_bytecode_cache(),
+    cache_size=TEMPLATE_CACHE_SIZE,
+)
+
+
+def get_template(template_string: str) -> Template:
+    name = hashlib.sha256(template_string.encode()).hexdigest()
+    with _template_sources_lock:
+        _template_sources[name] = template_string
+        _template_sources.move_to_end(name)
+        while len(_template_sources) > TEMPLATE_CACHE_SIZE:
+            _template_sources.popitem(last=False)
+    return template_environment.get_template(name)
+
 
 class JinjaPromptBuilder(PromptBuilder):
-    def __init__(self, prompt_template: str):
+    """
+    Renders a Jinja prompt template. If memoize_messages is set, the prompt
+    rendered for a message is stored on the message and reused until one of
+    its fields changes, so only new or updated messages are rendered again.
+    Memoized prompts do not reflect changes to the platform and datetime
+    variables, so it should only be used with templates that do not use them.
+    """
+
+    def __init__(self, prompt_template: str, memoize_messages: bool = False):
         self._prompt_template: str = prompt_template
+        self._template: Template = get_template(prompt_template)
+        self._memoize_messages = memoize_messages
+        # Memoized prompts are keyed by this id rather than the builder, so
+        # that messages do not keep builders alive.
+        self._builder_id = next(_builder_ids)
 
     def _apply_prompt_template(self, template_string: str, **kwargs) -> str:
-        template = Template(template_string)
+        if template_string == self._prompt_template:
+            template = self._template
+        else:
+            template = get_template(template_string)
         return template.render(**kwargs)
 
     def build_prompt(self, **kwargs) -> str:
+        message = kwargs.get("message")
+        cache_key = None
+        if self._memoize_messages and hasattr(message, "get_cached_prompt"):
+            try:
+                cache_key = (
+                    self._builder_id,
+                    frozenset((k, v) for k, v in kwargs.items() if k != "message"),
+                )
+                prompt = message.get_cached_prompt(cache_key)
+            except TypeError:
+                # Variables that can not be hashed are never memoized.
+                cache_key = None
+                prompt = None
+            if prompt is not None:
+                return prompt
+
         default_vars = {
             "platform": platform.system(),
             "datetime": str(datetime.now()),
         }
-        return self._apply_prompt_template(
-            self._prompt_template, **default_vars, **kwargs
+        prompt = self._apply_prompt_template(
+            self._prompt_template, **{**default_vars, **kwargs}
         )
+        if cache_key is not None:
+            message.set_cached_prompt(cache_key, prompt)
+        return prompt
@@ -17,7 +17,10 @@ class Parameters(BaseModel):
 
 class AgentTool(Tool):
     def __init__(self, agent):
-        super(AgentTool, self).__init__(TOOL_NAME, TOOL_DESCRIPTION, Parameters)
+        # An agent cannot run more than one task at a time.
+        super(AgentTool, self).__init__(
+            TOOL_NAME, TOOL_DESCRIPTION, Parameters, max_concurrency=1
+        )
         if agent is None:
             raise Exception("Agent is required.")
         self._agent = agent
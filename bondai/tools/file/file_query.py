@@ -2,6 +2,7 @@ from pydantic import BaseModel
 from typing import Dict
 from bondai.tools import Tool
 from bondai.models import LLM, EmbeddingModel
+from bondai.util.caching import LLMCache
 from bondai.util import semantic_search, is_html, get_html_text, extract_file_text
 from bondai.models.openai import OpenAILLM, OpenAIEmbeddingModel, OpenAIModelNames
 
@@ -33,11 +34,16 @@ class Parameters(BaseModel):
 
 class FileQueryTool(Tool):
     def __init__(
-        self, llm: LLM | None = None, embedding_model: EmbeddingModel | None = None
+        self,
+        llm: LLM | None = None,
+        embedding_model: EmbeddingModel | None = None,
+        cache: LLMCache | None = None,
     ):
         super(FileQueryTool, self).__init__(TOOL_NAME, TOOL_DESCRIPTION, Parameters)
         if llm is None:
-            llm = OpenAILLM(OpenAIModelNames.GPT35_TURBO_16K)
+            llm = OpenAILLM(OpenAIModelNames.GPT35_TURBO_16K, cache=cache)
+        elif cache is not None:
+            raise ValueError("cache can only be set for the default llm.")
         if embedding_model is None:
             embedding_model = OpenAIEmbeddingModel(
                 OpenAIModelNames.TEXT_EMBEDDING_ADA_002
@@ -71,6 +77,10 @@ class FileQueryTool(Tool):
         )
         text = semantic_search(self._embedding_model, question, text, max_tokens)
         prompt = build_prompt(question, text)
-        response = self._llm.get_completion(prompt, QUERY_SYSTEM_PROMPT)[0]
+        messages = [
+            {"role": "system", "content": QUERY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        response = self._llm.get_completion(messages=messages)[0]
 
         return response
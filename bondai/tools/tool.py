@@ -19,6 +19,7 @@ class Tool:
         parameters: BaseModel = EmptyParameters,
         dangerous: bool = False,
         supports_streaming: bool = False,
+        max_concurrency: int | None = None,
     ):
         if name is None:
             raise Exception("name is required")
@@ -32,6 +33,9 @@ class Tool:
         self.parameters = parameters
         self.dangerous = dangerous
         self.supports_streaming = supports_streaming
+        # Maximum number of calls to this tool the agent will run concurrently
+        # when the LLM requests several tool calls in one turn (None = no limit).
+        self.max_concurrency = max_concurrency
 
     def get_tool_function(self) -> Dict:
         return {
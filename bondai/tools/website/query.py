@@ -4,6 +4,7 @@ from typing import Dict
 from bondai.tools import Tool
 from bondai.util import get_website_text, semantic_search
 from bondai.models import LLM, EmbeddingModel
+from bondai.util.caching import LLMCache
 from bondai.models.openai import OpenAILLM, OpenAIEmbeddingModel, OpenAIModelNames
 
 TOOL_NAME = "website_query"
@@ -33,11 +34,16 @@ class Parameters(BaseModel):
 
 class WebsiteQueryTool(Tool):
     def __init__(
-        self, llm: LLM | None = None, embedding_model: EmbeddingModel | None = None
+        self,
+        llm: LLM | None = None,
+        embedding_model: EmbeddingModel | None = None,
+        cache: LLMCache | None = None,
     ):
         super(WebsiteQueryTool, self).__init__(TOOL_NAME, TOOL_DESCRIPTION, Parameters)
         if llm is None:
-            llm = OpenAILLM(OpenAIModelNames.GPT35_TURBO_16K)
+            llm = OpenAILLM(OpenAIModelNames.GPT35_TURBO_16K, cache=cache)
+        elif cache is not None:
+            raise ValueError("cache can only be set for the default llm.")
         if embedding_model is None:
             embedding_model = OpenAIEmbeddingModel(
                 OpenAIModelNames.TEXT_EMBEDDING_ADA_002
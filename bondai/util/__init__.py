@@ -1,8 +1,9 @@
 from .model_logger import ModelLogger
 from .misc import load_local_resource, format_print_string
-from .semantic_search import semantic_search, split_text
+from .semantic_search import semantic_search, split_text, iter_text_chunks, embed_chunks
 from .event_mixin import EventMixin
 from .runnable import Runnable
+from .single_flight import SingleFlight
 from .document_parser import extract_file_text
 from .web import (
     get_website_html,
@@ -17,8 +18,11 @@ __all__ = [
     "ModelLogger",
     "EventMixin",
     "Runnable",
+    "SingleFlight",
     "semantic_search",
     "split_text",
+    "iter_text_chunks",
+    "embed_chunks",
     "get_website_html",
     "get_html_text",
     "get_website_text",
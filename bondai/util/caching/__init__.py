@@ -1,3 +1,20 @@
 from .llm_cache import LLMCache, PersistentLLMCache, InMemoryLLMCache
+from .embedding_cache import (
+    EmbeddingCache,
+    InMemoryEmbeddingCache,
+    PersistentEmbeddingCache,
+)
+from .document_index_cache import DocumentIndex, DocumentIndexCache
+from .semantic_llm_cache import SemanticLLMCache
 
-__all__ = ["LLMCache", "PersistentLLMCache", "InMemoryLLMCache"]
+__all__ = [
+    "LLMCache",
+    "PersistentLLMCache",
+    "InMemoryLLMCache",
+    "EmbeddingCache",
+    "InMemoryEmbeddingCache",
+    "PersistentEmbeddingCache",
+    "DocumentIndex",
+    "DocumentIndexCache",
+    "SemanticLLMCache",
+]
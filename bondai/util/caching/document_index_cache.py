@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List
+
+DEFAULT_MAX_DOCUMENTS = 64
+DEFAULT_MAX_DOCUMENT_BYTES = 256 * 1024 * 1024
+
+
+@dataclass
+class DocumentIndex:
+    # The document's chunks with their normalized embeddings and token counts,
+    # where row i of embeddings and token_counts belongs to chunks[i].
+    chunks: List[str]
+    embeddings: np.ndarray
+    token_counts: np.ndarray
+    token_count: int
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.embeddings.nbytes
+            + self.token_counts.nbytes
+            + sum(len(chunk) for chunk in self.chunks)
+        )
+
+
+class DocumentIndexCache:
+    """
+    Caches the chunks and embeddings of documents by a hash of their
+    content and embedding model, so repeated searches over the same document
+    do not split and embed it again. The least recently used documents are
+    evicted once there are more than max_documents of them or they use more
+    than max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_documents: int = DEFAULT_MAX_DOCUMENTS,
+        max_bytes: int = DEFAULT_MAX_DOCUMENT_BYTES,
+    ):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._documents: OrderedDict[str, DocumentIndex] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self._documents)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get_cache_key(self, model_name: str, text: str, max_chunk_length: int) -> str:
+        key_str = f"{model_name}\0{max_chunk_length}\0{text}"
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
+    def get(self, cache_key: str) -> DocumentIndex | None:
+        with self._lock:
+            document = self._documents.get(cache_key)
+            if document is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._documents.move_to_end(cache_key)
+            return document
+
+    def save(self, cache_key: str, document: DocumentIndex):
+        with self._lock:
+            if cache_key in self._documents:
+                self._remove(cache_key)
+            self._documents[cache_key] = document
+            self._nbytes += document.nbytes
+            while self._documents and (
+                len(self._documents) > self.max_documents
+                or self._nbytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._documents)))
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._nbytes = 0
+
+    def _remove(self, cache_key: str):
+        self._nbytes -= self._documents.pop(cache_key).nbytes
@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# SQLite limits the number of parameters in a single statement.
+SQLITE_BATCH_SIZE = 500
+
+
+class EmbeddingCache(ABC):
+    def _get_cache_key(self, model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    @abstractmethod
+    def get_cache_items(self, model: str, texts: List[str]) -> List[np.ndarray | None]:
+        pass
+
+    @abstractmethod
+    def save_cache_items(
+        self, model: str, texts: List[str], embeddings: List[np.ndarray]
+    ) -> None:
+        pass
+
+
+class InMemoryEmbeddingCache(EmbeddingCache):
+    """
+    A least recently used cache of float32 embeddings. Entries are evicted
+    once there are more than max_entries of them or they use more than
+    max_bytes, and expire ttl seconds after they were saved if ttl is set.
+    A single instance can be shared by several CachingEmbeddingModels.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._cache: OrderedDict[str, Tuple[np.ndarray, float]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get_cache_items(self, model: str, texts: List[str]) -> List[np.ndarray | None]:
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            for text in texts:
+                cache_key = self._get_cache_key(model, text)
+                item = self._cache.get(cache_key)
+                if item is not None and item[1] <= now:
+                    self._remove(cache_key)
+                    item = None
+                if item is not None:
+                    self._cache.move_to_end(cache_key)
+                    results.append(item[0])
+                else:
+                    results.append(None)
+        return results
+
+    def save_cache_items(
+        self, model: str, texts: List[str], embeddings: List[np.ndarray]
+    ) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else np.inf
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                cache_key = self._get_cache_key(model, text)
+                if cache_key in self._cache:
+                    self._remove(cache_key)
+                embedding = np.asarray(embedding, dtype="float32")
+                self._cache[cache_key] = (embedding, expires_at)
+                self._nbytes += embedding.nbytes
+
+            while self._cache and (
+                len(self._cache) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._cache)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    def _remove(self, cache_key: str):
+        embedding, _ = self._cache.pop(cache_key)
+        self._nbytes -= embedding.nbytes
+
+
+class PersistentEmbeddingCache(EmbeddingCache):
+    """
+    Stores embeddings as float32 blobs in a SQLite database, with an
+    InMemoryEmbeddingCache in front of it for frequently used entries.
+    """
+
+    def __init__(
+        self,
+        file_path: str = "./.cache/embeddings.sqlite",
+        memory_cache: InMemoryEmbeddingCache | None = None,
+    ):
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.memory_cache = (
+            memory_cache if memory_cache is not None else InMemoryEmbeddingCache()
+        )
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        with self._lock, self._connection:
+            # WAL lets several processes read the cache while one writes to it.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+            )
+
+    def get_cache_items(self, model: str, texts: List[str]) -> List[np.ndarray | None]:
+        results = self.memory_cache.get_cache_items(model, texts)
+        missing = [i for i, r in enumerate(results) if r is None]
+        if not missing:
+            return results
+
+        keys = {self._get_cache_key(model, texts[i]): i for i in missing}
+        key_list = list(keys.keys())
+        rows = []
+        with self._lock:
+            for start in range(0, len(key_list), SQLITE_BATCH_SIZE):
+                batch = key_list[start : start + SQLITE_BATCH_SIZE]
+                rows.extend(
+                    self._connection.execute(
+                        "SELECT key, embedding FROM embeddings WHERE key IN "
+                        f"({','.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall()
+                )
+
+        found_texts, found_embeddings = [], []
+        for cache_key, blob in rows:
+            i = keys[cache_key]
+            results[i] = np.frombuffer(blob, dtype="float32")
+            found_texts.append(texts[i])
+            found_embeddings.append(results[i])
+        # Entries read from disk are promoted to the in-memory tier.
+        self.memory_cache.save_cache_items(model, found_texts, found_embeddings)
+
+        # Duplicate texts in one request share a key.
+        for i in missing:
+            if results[i] is None:
+                results[i] = results[keys[self._get_cache_key(model, texts[i])]]
+        return results
+
+    def save_cache_items(
+        self, model: str, texts: List[str], embeddings: List[np.ndarray]
+    ) -> None:
+        self.memory_cache.save_cache_items(model, texts, embeddings)
+        rows = [
+            (
+                self._get_cache_key(model, text),
+                np.asarray(embedding, dtype="float32").tobytes(),
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
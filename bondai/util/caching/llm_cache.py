@@ -1,15 +1,42 @@
 import os
 import json
+import time
+import sqlite3
 import hashlib
+import threading
+from collections import OrderedDict
 from abc import ABC, abstractmethod
-from typing import Tuple, Dict, Optional
+from typing import Any, Tuple, Dict, Optional
+
+DEFAULT_MAX_LLM_CACHE_ENTRIES = 10000
+DEFAULT_MAX_LLM_CACHE_BYTES = 256 * 1024 * 1024
+LLM_CACHE_DATABASE_NAME = "llm_cache.sqlite"
 
 
 class LLMCache(ABC):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
     def _get_cache_key(self, input_parameters: Dict) -> str:
         key_str = json.dumps(input_parameters, sort_keys=True)
         return hashlib.sha256(key_str.encode()).hexdigest()
 
+    @property
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
     @abstractmethod
     def get_cache_item(self, input_parameters: Dict) -> Optional[Tuple[str, Dict]]:
         pass
@@ -20,43 +47,398 @@ class LLMCache(ABC):
 
 
 class PersistentLLMCache(LLMCache):
-    def __init__(self, cache_dir: str = "./.cache"):
+    """
+    Stores responses in a single SQLite database in cache_dir. If the database
+    can not be used, or backend is "files", responses are stored as files in
+    directories sharded by the first characters of their key instead. The
+    least recently used responses are evicted once there are more than
+    max_entries of them or they use more than max_bytes, and responses expire
+    ttl seconds after they were saved if ttl is set. Responses saved as flat
+    files by earlier versions are moved into the cache when they are read.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = "./.cache",
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        ttl: float | None = None,
+        backend: str = "sqlite",
+    ):
+        if backend not in ("sqlite", "files"):
+            raise ValueError(f"Unknown LLM cache backend: {backend}")
         self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
 
+        self._lock = threading.Lock()
+        self._store: _SQLiteStore | _ShardedFileStore | None = None
+        if backend == "sqlite":
+            try:
+                self._store = _SQLiteStore(
+                    os.path.join(cache_dir, LLM_CACHE_DATABASE_NAME)
+                )
+            except sqlite3.Error:
+                # e.g. network file systems that do not support SQLite locking.
+                self._store = None
+        if self._store is None:
+            self._store = _ShardedFileStore(cache_dir)
+        self.backend = "sqlite" if isinstance(self._store, _SQLiteStore) else "files"
+
+    @property
+    def size(self) -> int:
+        return self._store.size
+
+    @property
+    def nbytes(self) -> int:
+        return self._store.nbytes
+
     def get_cache_item(self, input_parameters: Dict) -> Optional[Tuple[str, Dict]]:
         cache_key = self._get_cache_key(input_parameters=input_parameters)
-        cache_path = os.path.join(self.cache_dir, cache_key)
+        now = time.time()
+        with self._lock:
+            item = self._store.get(cache_key, now)
+            if item is None:
+                item = self._migrate_legacy_item(cache_key, now)
+            if item is not None and self.ttl is not None:
+                if item[1] + self.ttl <= now:
+                    self._store.delete(cache_key)
+                    item = None
 
-        if os.path.exists(cache_path):
-            with open(cache_path, "r") as file:
-                return json.load(file)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(item[0])
 
     def save_cache_item(self, input_parameters: Dict, response: (str, Dict)) -> None:
-        print(input_parameters)
-        print(response)
         cache_key = self._get_cache_key(input_parameters=input_parameters)
-        print(cache_key)
-        cache_path = os.path.join(self.cache_dir, cache_key)
-        print(cache_path)
+        now = time.time()
+        with self._lock:
+            self._store.put(cache_key, json.dumps(response), now)
+            if self.ttl is not None:
+                self.evictions += self._store.delete_expired(now - self.ttl)
+            self.evictions += self._store.evict(self.max_entries, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+    def close(self):
+        with self._lock:
+            self._store.close()
+
+    def _migrate_legacy_item(self, cache_key: str, now: float) -> Tuple[str, float]:
+        legacy_path = os.path.join(self.cache_dir, cache_key)
+        if not os.path.isfile(legacy_path):
+            return None
+        with open(legacy_path, "r") as file:
+            data = file.read()
+        created_at = os.path.getmtime(legacy_path)
+        self._store.put(cache_key, data, now, created_at=created_at)
+        os.remove(legacy_path)
+        return data, created_at
+
+
+class _SQLiteStore:
+    def __init__(self, file_path: str):
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        with self._connection:
+            # WAL lets several processes read the cache while one writes to it.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at "
+                "ON llm_cache (accessed_at)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_created_at "
+                "ON llm_cache (created_at)"
+            )
+        # Kept up to date by this process so the limits can be checked without
+        # scanning the table, and recounted before anything is evicted since
+        # other processes may share the database.
+        self._count, self._nbytes = self._get_totals()
+
+    @property
+    def size(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def _get_totals(self) -> Tuple[int, int]:
+        return self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+
+    def get(self, cache_key: str, now: float) -> Tuple[str, float] | None:
+        row = self._connection.execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ?", (cache_key,)
+        ).fetchone()
+        if row is not None:
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE llm_cache SET accessed_at = ? WHERE key = ?",
+                    (now, cache_key),
+                )
+        return row
+
+    def put(
+        self, cache_key: str, data: str, now: float, created_at: float | None = None
+    ):
+        row = self._connection.execute(
+            "SELECT size FROM llm_cache WHERE key = ?", (cache_key,)
+        ).fetchone()
+        if row is not None:
+            self._count -= 1
+            self._nbytes -= row[0]
+        self._count += 1
+        self._nbytes += len(data)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cache_key, data, len(data), created_at or now, now),
+            )
+
+    def delete(self, cache_key: str):
+        row = self._connection.execute(
+            "SELECT size FROM llm_cache WHERE key = ?", (cache_key,)
+        ).fetchone()
+        if row is None:
+            return
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM llm_cache WHERE key = ?", (cache_key,)
+            )
+        self._count -= 1
+        self._nbytes -= row[0]
+
+    def delete_expired(self, created_before: float) -> int:
+        with self._connection:
+            deleted = self._connection.execute(
+                "DELETE FROM llm_cache WHERE created_at <= ?", (created_before,)
+            ).rowcount
+        if deleted:
+            self._count, self._nbytes = self._get_totals()
+        return deleted
+
+    def evict(self, max_entries: int | None, max_bytes: int | None) -> int:
+        if not self._is_over_limits(max_entries, max_bytes):
+            return 0
+        self._count, self._nbytes = self._get_totals()
+        count, nbytes = self._count, self._nbytes
+
+        evicted = []
+        rows = self._connection.execute(
+            "SELECT key, size FROM llm_cache ORDER BY accessed_at"
+        )
+        for cache_key, size in rows:
+            if (max_entries is None or count <= max_entries) and (
+                max_bytes is None or nbytes <= max_bytes
+            ):
+                break
+            evicted.append((cache_key,))
+            count -= 1
+            nbytes -= size
+        rows.close()
+
+        if evicted:
+            with self._connection:
+                self._connection.executemany(
+                    "DELETE FROM llm_cache WHERE key = ?", evicted
+                )
+            self._count, self._nbytes = count, nbytes
+        return len(evicted)
 
-        with open(cache_path, "w") as file:
-            json.dump(response, file)
+    def _is_over_limits(self, max_entries: int | None, max_bytes: int | None) -> bool:
+        return (max_entries is not None and self._count > max_entries) or (
+            max_bytes is not None and self._nbytes > max_bytes
+        )
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute("DELETE FROM llm_cache")
+        self._count, self._nbytes = 0, 0
+
+    def close(self):
+        self._connection.close()
+
+
+class _ShardedFileStore:
+    # Each response is a file under two levels of directories named after the
+    # first characters of its key, which keeps directories small. Files hold
+    # the creation time and response, and their modification time is the last
+    # access time used for eviction.
+    def __init__(self, cache_dir: str):
+        self._cache_dir = cache_dir
+        # Sizes of the stored responses in least recently used order.
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._nbytes = 0
+        entries = []
+        for dir_path, _, file_names in os.walk(cache_dir):
+            if os.path.relpath(dir_path, cache_dir).count(os.sep) != 1:
+                continue
+            for file_name in file_names:
+                if "." in file_name:
+                    continue
+                stat = os.stat(os.path.join(dir_path, file_name))
+                entries.append((stat.st_mtime, file_name, stat.st_size))
+        for _, cache_key, size in sorted(entries):
+            self._entries[cache_key] = size
+            self._nbytes += size
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def _get_path(self, cache_key: str) -> str:
+        return os.path.join(self._cache_dir, cache_key[:2], cache_key[2:4], cache_key)
+
+    def get(self, cache_key: str, now: float) -> Tuple[str, float] | None:
+        path = self._get_path(cache_key)
+        try:
+            with open(path, "r") as file:
+                item = json.load(file)
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            return None
+        if cache_key in self._entries:
+            self._entries.move_to_end(cache_key)
+        return item["response"], item["created_at"]
+
+    def put(
+        self, cache_key: str, data: str, now: float, created_at: float | None = None
+    ):
+        path = self._get_path(cache_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = json.dumps({"created_at": created_at or now, "response": data})
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+        self._remove_entry(cache_key)
+        self._entries[cache_key] = len(content)
+        self._nbytes += len(content)
+
+    def delete(self, cache_key: str):
+        try:
+            os.remove(self._get_path(cache_key))
+        except FileNotFoundError:
+            pass
+        self._remove_entry(cache_key)
+
+    def delete_expired(self, created_before: float) -> int:
+        # Expired responses are removed when they are read, since finding them
+        # would mean reading every file.
+        return 0
+
+    def evict(self, max_entries: int | None, max_bytes: int | None) -> int:
+        evicted = 0
+        while self._entries and (
+            (max_entries is not None and len(self._entries) > max_entries)
+            or (max_bytes is not None and self._nbytes > max_bytes)
+        ):
+            self.delete(next(iter(self._entries)))
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        for cache_key in list(self._entries):
+            self.delete(cache_key)
+
+    def close(self):
+        pass
+
+    def _remove_entry(self, cache_key: str):
+        size = self._entries.pop(cache_key, None)
+        if size is not None:
+            self._nbytes -= size
 
 
 class InMemoryLLMCache(LLMCache):
-    def __init__(self):
-        self.cache = {}
+    """
+    A least recently used cache of responses. Entries are evicted once there
+    are more than max_entries of them or they use more than max_bytes, and
+    expire ttl seconds after they were saved if ttl is set.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_LLM_CACHE_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_LLM_CACHE_BYTES,
+        ttl: float | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Responses with their size and expiry time in least recently used order.
+        self._cache: OrderedDict[str, Tuple[Any, int, float]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
 
     def get_cache_item(self, input_parameters: Dict) -> Optional[Tuple[str, Dict]]:
         cache_key = self._get_cache_key(input_parameters=input_parameters)
+        with self._lock:
+            item = self._cache.get(cache_key)
+            if item is not None and item[2] <= time.monotonic():
+                self._remove(cache_key)
+                item = None
 
-        # Return the cached item if it exists
-        return self.cache.get(cache_key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._cache.move_to_end(cache_key)
+            return item[0]
 
     def save_cache_item(self, input_parameters: Dict, response: (str, Dict)) -> None:
         cache_key = self._get_cache_key(input_parameters=input_parameters)
+        size = len(json.dumps(response))
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+        with self._lock:
+            if cache_key in self._cache:
+                self._remove(cache_key)
+            self._cache[cache_key] = (response, size, expires_at)
+            self._nbytes += size
+
+            while self._cache and (
+                len(self._cache) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._cache)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
 
-        # Save the response to the cache
-        self.cache[cache_key] = response
+    def _remove(self, cache_key: str):
+        _, size, _ = self._cache.pop(cache_key)
+        self._nbytes -= size
@@ -0,0 +1,202 @@
+import re
+import json
+import hashlib
+import threading
+import faiss
+import numpy as np
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from bondai.models.embedding_model import EmbeddingModel
+from .llm_cache import LLMCache, InMemoryLLMCache
+
+DEFAULT_MAX_SEMANTIC_ENTRIES = 10000
+DEFAULT_SEMANTIC_SEARCH_K = 8
+# Embeddings of requests that missed the cache, kept for when they are saved.
+MAX_PENDING_EMBEDDINGS = 64
+# Timestamps such as the datetime JinjaPromptBuilder adds to every prompt.
+DEFAULT_VOLATILE_PATTERNS = [
+    r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?([+-]\d{2}:?\d{2}|Z)?",
+]
+VOLATILE_PLACEHOLDER = "<volatile>"
+
+
+class SemanticLLMCache(LLMCache):
+    """
+    Caches responses by a normalized form of the request, so requests that
+    only differ in volatile content still hit the cache. Volatile content
+    matching any of volatile_patterns (by default, timestamps) is replaced
+    with a placeholder, and only the last last_n_messages messages are part of
+    the key if it is set.
+
+    If embedding_model and similarity_threshold are set, a request that does
+    not match exactly is served the response of the most similar earlier
+    request with the same functions and parameters, if the cosine similarity
+    of their embedded messages is at least similarity_threshold. The
+    similarity index is kept in memory for the max_entries most recent
+    requests. Responses are stored in cache, which defaults to an
+    InMemoryLLMCache.
+    """
+
+    def __init__(
+        self,
+        cache: LLMCache | None = None,
+        embedding_model: EmbeddingModel | None = None,
+        similarity_threshold: float | None = None,
+        last_n_messages: int | None = None,
+        volatile_patterns: List[str] | None = None,
+        max_entries: int = DEFAULT_MAX_SEMANTIC_ENTRIES,
+    ):
+        if similarity_threshold is not None and embedding_model is None:
+            raise ValueError("similarity_threshold requires an embedding_model.")
+        if volatile_patterns is None:
+            volatile_patterns = DEFAULT_VOLATILE_PATTERNS
+
+        self.cache = cache if cache is not None else InMemoryLLMCache()
+        self.similarity_threshold = similarity_threshold
+        self.last_n_messages = last_n_messages
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self._embedding_model = embedding_model
+        self._volatile_pattern = re.compile(
+            "|".join(f"(?:{p})" for p in volatile_patterns)
+        )
+        self._lock = threading.Lock()
+        self._index: faiss.IndexIDMap | None = None
+        # The signature and cache key of each request in the similarity index,
+        # by id, and the ids in the order they were added.
+        self._entries: Dict[int, Tuple[str, str]] = {}
+        self._entry_ids: Deque[int] = deque()
+        self._next_id = 0
+        self._pending_embeddings: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    @property
+    def stats(self) -> Dict[str, int | float]:
+        return {
+            **super().stats,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+        }
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+
+    def get_cache_item(self, input_parameters: Dict) -> Optional[Tuple[str, Dict]]:
+        signature, cache_key, text = self._normalize(input_parameters)
+        response = self.cache.get_cache_item({"semantic_cache_key": cache_key})
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+                self.exact_hits += 1
+            return response
+
+        if self.similarity_threshold is not None and text:
+            embedding = self._embed(text)
+            with self._lock:
+                self._pending_embeddings[cache_key] = embedding
+                if len(self._pending_embeddings) > MAX_PENDING_EMBEDDINGS:
+                    self._pending_embeddings.popitem(last=False)
+            for similar_key in self._search(signature, embedding):
+                response = self.cache.get_cache_item(
+                    {"semantic_cache_key": similar_key}
+                )
+                if response is not None:
+                    with self._lock:
+                        self.hits += 1
+                        self.semantic_hits += 1
+                    return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def save_cache_item(self, input_parameters: Dict, response: (str, Dict)) -> None:
+        signature, cache_key, text = self._normalize(input_parameters)
+        self.cache.save_cache_item({"semantic_cache_key": cache_key}, response)
+        if self.similarity_threshold is not None and text:
+            with self._lock:
+                embedding = self._pending_embeddings.pop(cache_key, None)
+            if embedding is None:
+                embedding = self._embed(text)
+            self._add(signature, cache_key, embedding)
+
+    def _normalize(self, input_parameters: Dict) -> Tuple[str, str, str]:
+        # Returns a hash of the request without its messages, a hash of the
+        # normalized request and the normalized text of its messages.
+        parameters = dict(input_parameters)
+        messages = parameters.pop("messages", None) or []
+        if self.last_n_messages is not None:
+            messages = messages[-self.last_n_messages :]
+
+        signature = self._hash(json.dumps(parameters, sort_keys=True))
+        messages_str = self._volatile_pattern.sub(
+            VOLATILE_PLACEHOLDER, json.dumps(messages, sort_keys=True)
+        )
+        cache_key = self._hash(f"{signature}\0{messages_str}")
+        text = "\n\n".join(
+            self._volatile_pattern.sub(VOLATILE_PLACEHOLDER, m["content"])
+            for m in messages
+            if isinstance(m, dict) and isinstance(m.get("content"), str)
+        )
+        return signature, cache_key, text
+
+    def _hash(self, value: str) -> str:
+        return hashlib.sha256(value.encode()).hexdigest()
+
+    def _embed(self, text: str) -> np.ndarray:
+        # Long prompts keep their end, where tools such as website_query put
+        # the question.
+        embedding_model = self._embedding_model
+        max_tokens = embedding_model.max_tokens
+        if embedding_model.supports_tokenization:
+            tokens = embedding_model.encode(text)
+            if len(tokens) > max_tokens:
+                start = len(tokens) - max_tokens
+                # Skip the rest of a character split by the cut.
+                while not embedding_model.is_token_boundary(tokens, start):
+                    start += 1
+                text = embedding_model.decode(tokens[start:])
+        else:
+            while embedding_model.count_tokens(text) > max_tokens:
+                text = text[len(text) // 4 :]
+
+        embedding = np.array(
+            embedding_model.create_embedding(text), dtype="float32"
+        ).reshape(1, -1)
+        faiss.normalize_L2(embedding)
+        return embedding
+
+    def _search(self, signature: str, embedding: np.ndarray) -> List[str]:
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return []
+            k = min(DEFAULT_SEMANTIC_SEARCH_K, self._index.ntotal)
+            scores, ids = self._index.search(embedding, k)
+            return [
+                self._entries[i][1]
+                for score, i in zip(scores[0], ids[0])
+                if i != -1
+                and score >= self.similarity_threshold
+                and self._entries[i][0] == signature
+            ]
+
+    def _add(self, signature: str, cache_key: str, embedding: np.ndarray):
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(embedding.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(embedding, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (signature, cache_key)
+            self._entry_ids.append(entry_id)
+
+            if len(self._entry_ids) > self.max_entries:
+                # The oldest tenth is removed at once since each removal
+                # rewrites the index.
+                count = max(1, self.max_entries // 10)
+                removed_ids = [self._entry_ids.popleft() for _ in range(count)]
+                self._index.remove_ids(np.array(removed_ids, dtype="int64"))
+                for removed_id in removed_ids:
+                    del self._entries[removed_id]
@@ -5,9 +5,15 @@ import threading
 
 class Runnable(ABC):
     def __init__(self):
-        self._force_stop: bool = False
+        # Stop requests are cooperative: execution loops check this event
+        # between steps, which works for both threads and coroutines.
+        self._stop_event: threading.Event = threading.Event()
         self._execution_thread = None
 
+    @property
+    def stop_requested(self) -> bool:
+        return self._stop_event.is_set()
+
     def _start_execution_thread(self, target: Callable, args: Tuple = ()):
         if self._execution_thread and self._execution_thread.is_alive():
             raise Exception("Execution Thread is already running")
@@ -21,12 +27,10 @@ class Runnable(ABC):
             self._execution_thread.join(timeout)
 
     def stop(self, timeout=10):
-        """Gracefully stops the thread, with a timeout."""
-        self._force_stop = True
+        """Requests a cooperative stop and waits for the thread, with a timeout."""
+        self._stop_event.set()
         if self._execution_thread and self._execution_thread.is_alive():
             self._execution_thread.join(timeout)
             if self._execution_thread.is_alive():
                 # The thread is still alive after the timeout, so kill it.
                 self._execution_thread.terminate()
-
-        self._force_stop = False
@@ -1,138 +1,392 @@
 import nltk
+import contextvars
 import faiss
 import numpy as np
-from typing import List
+from collections import deque
+from typing import IO, Deque, Iterable, Iterator, List, Tuple
 from bondai.models import EmbeddingModel
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from bondai.util.caching import DocumentIndex, DocumentIndexCache
+from concurrent.futures import Future, ThreadPoolExecutor
 
 nltk.download("punkt", quiet=True)
 
-EMBED_BATCH_SIZE = 16
+EMBED_BATCH_SIZE = 64
 MAX_EMBED_WORKERS = 5
 SENTENCE_CONCAT_COUNT = 4
+MAX_CHARS_PER_TOKEN = 16
+SEARCH_RESULT_SEPARATOR = "\n\n"
+# Streams are read and sentence-tokenized in blocks of this many characters.
+STREAM_BLOCK_SIZE = 64 * 1024
+MAX_STREAM_BUFFER_SIZE = 16 * STREAM_BLOCK_SIZE
+
+# Shared by every caller of semantic_search that does not pass its own cache.
+default_document_index_cache = DocumentIndexCache()
 
 
 def split_text(
     embedding_model: EmbeddingModel, text: str, max_chunk_length: int = None
 ) -> List[str]:
+    return list(iter_text_chunks(embedding_model, [text], max_chunk_length))
+
+
+def iter_text_chunks(
+    embedding_model: EmbeddingModel,
+    stream: str | IO[str] | Iterable[str],
+    max_chunk_length: int = None,
+    overlap: int = 0,
+    sentences_per_chunk: int = SENTENCE_CONCAT_COUNT,
+) -> Iterator[str]:
+    """
+    Yields chunks of up to sentences_per_chunk sentences and max_chunk_length
+    tokens from a stream of text, which can be a string, a file object or an
+    iterable of strings such as PDF pages. Consecutive chunks share trailing
+    sentences totalling up to overlap tokens. Only a bounded buffer of the
+    stream is held in memory at a time.
+    """
+    for chunk, _ in _iter_counted_chunks(
+        embedding_model, stream, max_chunk_length, overlap, sentences_per_chunk
+    ):
+        yield chunk
+
+
+def _iter_counted_chunks(
+    embedding_model: EmbeddingModel,
+    stream: str | IO[str] | Iterable[str],
+    max_chunk_length: int | None,
+    overlap: int,
+    sentences_per_chunk: int,
+) -> Iterator[Tuple[str, int]]:
+    # Yields each chunk with its token count, the sum of the counts of its
+    # sentences, so chunks never have to be counted again.
     if not max_chunk_length:
         max_chunk_length = embedding_model.max_tokens
+    if overlap < 0 or overlap >= max_chunk_length:
+        raise ValueError("overlap must be at least 0 and less than max_chunk_length.")
 
-    result = []
-    split = nltk.sent_tokenize(text)
-    split = concatenate_strings(split, SENTENCE_CONCAT_COUNT)
-    for s in split:
-        if embedding_model.count_tokens(s) > max_chunk_length:
-            split2 = s.split("\n")
-            for s2 in split2:
-                if embedding_model.count_tokens(s2) > max_chunk_length:
-                    split3 = split_tokens(embedding_model, s2, max_chunk_length)
-                    for s3 in split3:
-                        result.append(s3)
+    chunk: List[Tuple[str, int]] = []
+    chunk_tokens = 0
+    new_sentences = 0
+    for sentences in _iter_sentence_batches(stream):
+        pieces = []
+        for sentence, token_count in zip(
+            sentences, embedding_model.count_tokens_many(sentences)
+        ):
+            if token_count <= max_chunk_length:
+                pieces.append((sentence, token_count))
+                continue
+            # Sentences over the limit are split by line and then by tokens.
+            lines = sentence.split("\n")
+            for line, line_token_count in zip(
+                lines, embedding_model.count_tokens_many(lines)
+            ):
+                if line_token_count <= max_chunk_length:
+                    pieces.append((line, line_token_count))
                 else:
-                    result.append(s2)
-        else:
-            result.append(s)
+                    pieces.extend(
+                        (part, max_chunk_length)
+                        for part in split_tokens(
+                            embedding_model, line, max_chunk_length, overlap
+                        )
+                    )
 
-    filtered_list = [s for s in result if s.strip()]
-    return filtered_list
+        for piece, token_count in pieces:
+            if not piece.strip():
+                continue
+            if new_sentences and (
+                new_sentences >= sentences_per_chunk
+                or chunk_tokens + token_count > max_chunk_length
+            ):
+                yield "".join(p for p, _ in chunk), chunk_tokens
+                chunk, chunk_tokens = _get_overlap(chunk, overlap)
+                new_sentences = 0
+            while chunk and chunk_tokens + token_count > max_chunk_length:
+                chunk_tokens -= chunk.pop(0)[1]
+            chunk.append((piece, token_count))
+            chunk_tokens += token_count
+            new_sentences += 1
+
+    if new_sentences:
+        yield "".join(p for p, _ in chunk), chunk_tokens
+
+
+def _get_overlap(
+    chunk: List[Tuple[str, int]], overlap: int
+) -> Tuple[List[Tuple[str, int]], int]:
+    # Returns the trailing sentences of chunk that fit within overlap tokens.
+    result = []
+    token_count = 0
+    for sentence, sentence_tokens in reversed(chunk):
+        if token_count + sentence_tokens > overlap:
+            break
+        result.insert(0, (sentence, sentence_tokens))
+        token_count += sentence_tokens
+    return result, token_count
 
 
-def concatenate_strings(arr: List[str], n: int) -> List[str]:
-    arr2 = []
-    for i in range(0, len(arr), n):
-        concat_str = "".join(arr[i : i + n])
-        arr2.append(concat_str)
-    return arr2
+def _iter_sentence_batches(
+    stream: str | IO[str] | Iterable[str],
+) -> Iterator[List[str]]:
+    # Sentence-tokenizes the stream one bounded buffer at a time. The last
+    # sentence of each buffer may continue in the next block, so the buffer
+    # is carried over from its start unless the buffer has grown too large to
+    # wait any longer. The raw buffer is carried over rather than the
+    # sentence, which has its trailing whitespace stripped.
+    buffer = ""
+    for block in _iter_text_blocks(stream):
+        buffer += block
+        if len(buffer) < STREAM_BLOCK_SIZE:
+            continue
+        sentences = nltk.sent_tokenize(buffer)
+        if len(sentences) > 1 or len(buffer) >= MAX_STREAM_BUFFER_SIZE:
+            if len(sentences) > 1:
+                # Sentences are slices of the buffer, so the last one starts
+                # at its last occurrence.
+                buffer = buffer[buffer.rfind(sentences.pop()) :]
+            else:
+                buffer = ""
+            yield sentences
+    if buffer:
+        yield nltk.sent_tokenize(buffer)
+
+
+def _iter_text_blocks(stream: str | IO[str] | Iterable[str]) -> Iterator[str]:
+    if isinstance(stream, str):
+        texts = [stream]
+    elif hasattr(stream, "read"):
+        texts = iter(lambda: stream.read(STREAM_BLOCK_SIZE), "")
+    else:
+        texts = stream
+    for text in texts:
+        for start in range(0, len(text), STREAM_BLOCK_SIZE):
+            yield text[start : start + STREAM_BLOCK_SIZE]
+
+
+def embed_chunks(
+    embedding_model: EmbeddingModel,
+    chunks: Iterable[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_workers: int = MAX_EMBED_WORKERS,
+) -> Iterator[Tuple[List[str], List[List[float]]]]:
+    """
+    Embeds chunks in batches on a thread pool as they are produced, so that
+    embedding overlaps with reading and chunking the source. Yields each batch
+    with its embeddings, in order. At most two batches per worker are in
+    flight, which bounds memory use. If a batch fails to embed, once the
+    embedding model has given up retrying it, its error is raised and the
+    batches that have not started are cancelled.
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending: Deque[Tuple[List[str], Future]] = deque()
+
+        def submit(batch: List[str]):
+            # Run in a copy of the caller's context so costs are tracked.
+            future = executor.submit(
+                contextvars.copy_context().run,
+                embedding_model.create_embedding,
+                batch,
+            )
+            pending.append((batch, future))
+
+        def next_result() -> Tuple[List[str], List[List[float]]]:
+            batch, future = pending.popleft()
+            try:
+                return batch, future.result()
+            except Exception:
+                for _, pending_future in pending:
+                    pending_future.cancel()
+                raise
+
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                submit(batch)
+                batch = []
+                if len(pending) >= max_workers * 2:
+                    yield next_result()
+        if batch:
+            submit(batch)
+        while pending:
+            yield next_result()
 
 
 def split_tokens(
-    embedding_model: EmbeddingModel, input: str, max_length: int
+    embedding_model: EmbeddingModel, input: str, max_length: int, overlap: int = 0
 ) -> List[str]:
-    if embedding_model.count_tokens(input) <= max_length:
-        return input
+    """
+    Splits input into chunks of at most max_length tokens, where consecutive
+    chunks share overlap tokens.
+    """
+    if overlap < 0 or overlap >= max_length:
+        raise ValueError("overlap must be at least 0 and less than max_length.")
+
+    if not embedding_model.supports_tokenization:
+        return _split_characters(embedding_model, input, max_length, overlap)
+
+    tokens = embedding_model.encode(input)
+    if len(tokens) <= max_length:
+        return [input]
 
-    item = ""
+    # Chunk boundaries are moved to the nearest token that starts a character,
+    # ends back and starts forward, so no character is split between chunks.
     result = []
-    for i, c in enumerate(input):
-        item += c
-        if embedding_model.count_tokens(item) >= max_length:
-            result.append(item)
-            item = ""
+    start = 0
+    while True:
+        end = min(start + max_length, len(tokens))
+        boundary = end
+        while boundary > start + 1 and not embedding_model.is_token_boundary(
+            tokens, boundary
+        ):
+            boundary -= 1
+        if embedding_model.is_token_boundary(tokens, boundary):
+            end = boundary
+
+        result.append(embedding_model.decode(tokens[start:end]))
+        if end == len(tokens):
+            return result
+
+        next_start = max(end - overlap, start + 1)
+        while next_start < end and not embedding_model.is_token_boundary(
+            tokens, next_start
+        ):
+            next_start += 1
+        start = next_start
+
+
+def _split_characters(
+    embedding_model: EmbeddingModel, input: str, max_length: int, overlap: int
+) -> List[str]:
+    # For models that can not encode text, each chunk is the longest prefix of
+    # the remaining text within max_length tokens, found by binary search.
+    # Chunks are assumed to average no more than MAX_CHARS_PER_TOKEN characters
+    # per token, which bounds the text counted for each chunk.
+    result = []
+    start = 0
+    while start < len(input):
+        low = start + 1
+        high = min(len(input), start + max_length * MAX_CHARS_PER_TOKEN)
+        if embedding_model.count_tokens(input[start:high]) <= max_length:
+            low = high
+        while low < high:
+            middle = (low + high + 1) // 2
+            if embedding_model.count_tokens(input[start:middle]) <= max_length:
+                low = middle
+            else:
+                high = middle - 1
+
+        result.append(input[start:low])
+        if low == len(input):
+            break
+        overlap_chars = (low - start) * overlap // max_length
+        start = max(low - overlap_chars, start + 1)
 
     return result
 
 
 def semantic_search(
-    embedding_model: EmbeddingModel, query: str, text: str, max_tokens: int
+    embedding_model: EmbeddingModel,
+    query: str,
+    text: str,
+    max_tokens: int,
+    cache: DocumentIndexCache | None = None,
+    document_order: bool = False,
 ) -> str:
-    if embedding_model.count_tokens(text) <= max_tokens:
+    """
+    Returns the chunks of text most similar to query that fit within
+    max_tokens, joined by blank lines. Chunks are ordered by similarity, or by
+    their position in text if document_order is set.
+    """
+    if cache is None:
+        cache = default_document_index_cache
+
+    # The document is split and embedded once; later searches over the same
+    # text, from any tool, reuse its cached index.
+    cache_key = cache.get_cache_key(
+        embedding_model.model_name, text, embedding_model.max_tokens
+    )
+    document = cache.get(cache_key)
+    if document is None:
+        token_count = embedding_model.count_tokens(text)
+        if token_count <= max_tokens:
+            return text
+        document = _create_document_index(embedding_model, text, token_count)
+        cache.save(cache_key, document)
+    elif document.token_count <= max_tokens:
         return text
 
-    sentences = split_text(embedding_model, text)
-    query_embedding = embedding_model.create_embedding(query)
-    query_embedding = np.array(query_embedding).astype("float32")
+    if len(document.chunks) == 0:
+        return ""
 
-    # Convert embeddings to FAISS compatible format (they need to be normalized)
+    query_embedding = np.array(
+        embedding_model.create_embedding(query), dtype="float32"
+    ).reshape(1, -1)
     faiss.normalize_L2(query_embedding)
+    # Both sides are normalized, so the inner product is the cosine similarity.
+    scores = document.embeddings @ query_embedding[0]
 
-    # Create a FAISS index
-    index = faiss.IndexFlatIP(
-        query_embedding.shape[1]
-    )  # IndexFlatIP is for inner product (which is equivalent to cosine similarity when vectors are normalized)
+    # Chunks are taken in order of similarity until one does not fit. No more
+    # chunks than the k smallest ones can fit, so only the top k are sorted.
+    separator_tokens = embedding_model.count_tokens(SEARCH_RESULT_SEPARATOR)
+    chunk_tokens = document.token_counts + separator_tokens
+    k = int(
+        np.searchsorted(
+            np.cumsum(np.sort(chunk_tokens)),
+            max_tokens + separator_tokens,
+            side="right",
+        )
+    )
+    if k == 0:
+        return ""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
 
-    # Split the sentences into batches of up to EMBED_BATCH_SIZE sentences
-    sentence_batches = [
-        sentences[i : i + EMBED_BATCH_SIZE]
-        for i in range(0, len(sentences), EMBED_BATCH_SIZE)
+    used_tokens = np.cumsum(chunk_tokens[top])
+    selected = top[
+        : np.searchsorted(used_tokens, max_tokens + separator_tokens, side="right")
     ]
+    if document_order:
+        selected = np.sort(selected)
 
-    # Store embeddings and their corresponding sentences
-    embeddings_list = []
-    sentences_list = []
-
-    # Parallelize the calls to create_embedding using ThreadPoolExecutor
-    with ThreadPoolExecutor(MAX_EMBED_WORKERS) as executor:
-        future_to_batch = {
-            executor.submit(embedding_model.create_embedding, batch): batch
-            for batch in sentence_batches
-        }
-        for future in as_completed(future_to_batch):
-            batch = future_to_batch[future]
-            try:
-                batch_embeddings = future.result()
-                embeddings_list.extend(batch_embeddings)
-                sentences_list.extend(batch)
-            except Exception as e:
-                print(e)
-
-    embeddings_list = [
-        np.array(embedding).astype("float32") for embedding in embeddings_list
-    ]
-    # Add all sentence embeddings to the index
-    embeddings_array = np.vstack(embeddings_list)
-    faiss.normalize_L2(embeddings_array)  # Normalize the embeddings
-    index.add(embeddings_array)  # Add to FAISS index
-
-    # Query the index for the top N most similar sentences
-    D, I = index.search(
-        query_embedding, len(sentences_list)
-    )  # Search for all sentences
-
-    # Sort results by similarity
-    sorted_results = sorted(
-        zip(I[0], D[0], sentences_list), key=lambda x: x[1], reverse=True
+    return SEARCH_RESULT_SEPARATOR.join(document.chunks[i] for i in selected)
+
+
+def _create_document_index(
+    embedding_model: EmbeddingModel, text: str, token_count: int
+) -> DocumentIndex:
+    chunks = []
+    chunk_token_counts = []
+    embeddings = []
+
+    # Token counts are recorded as the chunker produces each chunk and matched
+    # with the chunks' embeddings.
+    counted_chunks = _iter_counted_chunks(
+        embedding_model, text, None, 0, SENTENCE_CONCAT_COUNT
     )
+    pending_counts: Deque[int] = deque()
 
-    filtered = []
-    str_items = ""
-    for idx, _, sentence in sorted_results:
-        if embedding_model.count_tokens(f"{str_items}\n\n{sentence}") <= max_tokens:
-            str_items += f"\n\n{sentence}"
-            filtered.append(sentence)
-        else:
-            break
+    def iter_chunks() -> Iterator[str]:
+        for chunk, chunk_tokens in counted_chunks:
+            pending_counts.append(chunk_tokens)
+            yield chunk
 
-    output = "\n\n".join(filtered)
+    # Chunks are embedded on a thread pool while the text is still being split.
+    for batch, batch_embeddings in embed_chunks(embedding_model, iter_chunks()):
+        chunks.extend(batch)
+        chunk_token_counts.extend(pending_counts.popleft() for _ in batch)
+        embeddings.extend(batch_embeddings)
 
-    return output
+    embeddings = np.array(embeddings, dtype="float32").reshape(
+        len(chunks), embedding_model.embedding_size
+    )
+    faiss.normalize_L2(embeddings)
+
+    document = DocumentIndex(
+        chunks=chunks,
+        embeddings=embeddings,
+        token_counts=np.array(chunk_token_counts, dtype=np.int64),
+        token_count=token_count,
+    )
+    return document
@@ -0,0 +1,104 @@
+import copy
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# How long, in seconds, a waiting caller waits for the leader's result before
+# doing the work itself.
+DEFAULT_WAIT_TIMEOUT = 60.0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, so that only the first
+    caller (the leader) does the work and the others wait for its result.
+    Calls can be coalesced across threads and event loops. Waiting callers
+    receive a copy of the leader's result, or its exception. A waiting
+    caller that times out does the work itself instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def join(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        Returns the future of the call in flight for key and False, or a new
+        future and True if there is none, in which case the caller is the
+        leader and must pass the future to finish once the call completes.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def finish(
+        self,
+        key: Hashable,
+        future: Future,
+        result: Any = None,
+        error: BaseException | None = None,
+    ):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    async def await_future(future: Future, timeout: float | None = None) -> Any:
+        # Shielded so a waiter being cancelled or timing out does not cancel
+        # the call.
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), timeout
+        )
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Any],
+        timeout: float | None = DEFAULT_WAIT_TIMEOUT,
+    ) -> Any:
+        future, leader = self.join(key)
+        if not leader:
+            try:
+                return copy.deepcopy(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                return fn()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    async def ado(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: float | None = DEFAULT_WAIT_TIMEOUT,
+    ) -> Any:
+        future, leader = self.join(key)
+        if not leader:
+            try:
+                result = await self.await_future(future, timeout)
+            except asyncio.TimeoutError:
+                return await fn()
+            return copy.deepcopy(result)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result
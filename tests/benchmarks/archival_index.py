@@ -0,0 +1,70 @@
+"""
+Reports recall@k and per-query search latency of each archival memory index
+type against exact (flat) search on synthetic clustered embeddings.
+
+Usage: python tests/benchmarks/archival_index.py [--vectors 100000] [--dim 256]
+"""
+import time
+import argparse
+import numpy as np
+import bondai.agents  # noqa: F401 (bondai.memory requires it to be imported first)
+from bondai.memory.archival.indexes import (
+    ArchivalIndexType,
+    ArchivalMemoryIndex,
+    evaluate_index,
+)
+
+
+def create_embeddings(count: int, dim: int, clusters: int = 500) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    assignments = rng.integers(0, clusters, size=count)
+    noise = rng.normal(scale=0.3, size=(count, dim)).astype("float32")
+    return centers[assignments] + noise
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    embeddings = create_embeddings(args.vectors + args.queries, args.dim)
+    queries = embeddings[args.vectors :]
+    embeddings = embeddings[: args.vectors]
+    ids = np.arange(args.vectors, dtype="int64")
+
+    configurations = [
+        ("flat", ArchivalIndexType.FLAT, {}),
+        ("ivf_flat nprobe=8", ArchivalIndexType.IVF_FLAT, {"nlist": 256, "nprobe": 8}),
+        (
+            "ivf_flat nprobe=32",
+            ArchivalIndexType.IVF_FLAT,
+            {"nlist": 256, "nprobe": 32},
+        ),
+        (
+            "ivf_pq nprobe=32",
+            ArchivalIndexType.IVF_PQ,
+            {"nlist": 256, "nprobe": 32, "pq_m": args.dim // 8},
+        ),
+        ("hnsw efSearch=64", ArchivalIndexType.HNSW, {"ef_search": 64}),
+        ("hnsw efSearch=256", ArchivalIndexType.HNSW, {"ef_search": 256}),
+    ]
+    for name, index_type, params in configurations:
+        index = ArchivalMemoryIndex(args.dim, index_type=index_type, **params)
+        start = time.perf_counter()
+        index.add(embeddings, ids)
+        build_time = time.perf_counter() - start
+        result = evaluate_index(index, embeddings, ids, queries, k=args.k)
+        print(
+            f"{name:20} build {build_time:8.2f} s  "
+            f"recall@{args.k} {result['recall']:.3f}  "
+            f"latency {result['latency_ms']:8.3f} ms  "
+            f"(flat {result['flat_latency_ms']:8.3f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares the legacy truncation loop in Agent._build_llm_context (remove the
+oldest message, re-render and re-count everything that is left) against the
+single-pass prefix-sum truncation on long message histories.
+
+Usage: python tests/benchmarks/context_truncation.py [--messages 1000] [--overflow 100] [--jinja]
+"""
+import os
+import time
+import argparse
+
+# No requests are sent; a key is only needed to construct the default models.
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from typing import Dict, List
+from bondai.agents import Agent, ToolUsageMessage, DEFAULT_MESSAGE_PROMPT_TEMPLATE
+from bondai.agents.util import count_message_tokens, format_llm_messages
+from bondai.models import LLM
+from bondai.prompt import JinjaPromptBuilder
+
+
+class CharacterCountLLM(LLM):
+    """Approximates tiktoken with one token per four characters."""
+
+    def __init__(self, max_tokens: int):
+        self._max_tokens = max_tokens
+
+    @property
+    def max_tokens(self) -> int:
+        return self._max_tokens
+
+    @property
+    def supports_streaming(self) -> bool:
+        return False
+
+    def get_completion(self, messages=None, functions=None, **kwargs):
+        raise NotImplementedError()
+
+    def get_streaming_completion(self, messages=None, functions=None, **kwargs):
+        raise NotImplementedError()
+
+    def count_tokens(self, prompt: str) -> int:
+        return len(prompt) // 4
+
+
+def simple_message_prompt_builder(message, message_type: str) -> str:
+    return f"{message.timestamp}\n{message.tool_name}\n{message.tool_output}"
+
+
+def legacy_truncate(agent: Agent, system_prompt: str, messages) -> List[Dict]:
+    def count(llm_context):
+        return sum(count_message_tokens(agent._llm, m) for m in llm_context)
+
+    max_tokens = agent._max_context_length * agent._max_context_pressure_ratio
+    reduced_messages = list(messages)
+    llm_context = format_llm_messages(
+        system_prompt, reduced_messages, agent._message_prompt_builder
+    )
+    while count(llm_context) > max_tokens and len(reduced_messages) > 0:
+        reduced_messages.pop(0)
+        llm_context = format_llm_messages(
+            system_prompt, reduced_messages, agent._message_prompt_builder
+        )
+    return llm_context
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--overflow", type=int, default=100)
+    parser.add_argument("--jinja", action="store_true")
+    args = parser.parse_args()
+
+    messages = [
+        ToolUsageMessage(
+            tool_name="website_query",
+            tool_arguments={"url": f"https://example.com/{i}"},
+            tool_output=f"result {i} " * 40,
+            success=True,
+        )
+        for i in range(args.messages)
+    ]
+
+    message_prompt_builder = (
+        JinjaPromptBuilder(DEFAULT_MESSAGE_PROMPT_TEMPLATE)
+        if args.jinja
+        else simple_message_prompt_builder
+    )
+    # Size the context so that roughly `overflow` messages must be dropped.
+    probe = Agent(
+        llm=CharacterCountLLM(10**9),
+        message_prompt_builder=message_prompt_builder,
+        system_prompt_builder=lambda **kwargs: "system prompt",
+    )
+    _, total_tokens = probe._build_llm_context(messages, truncate_context=False)
+    per_message = total_tokens / args.messages
+    max_context_tokens = int(
+        (total_tokens - per_message * args.overflow) / probe._max_context_pressure_ratio
+    )
+
+    agent = Agent(
+        llm=CharacterCountLLM(max_context_tokens),
+        message_prompt_builder=message_prompt_builder,
+        system_prompt_builder=lambda **kwargs: "system prompt",
+        max_context_length=max_context_tokens,
+        enable_final_answer_tool=False,
+    )
+
+    start = time.perf_counter()
+    legacy_context = legacy_truncate(agent, "system prompt", messages)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    context, _ = agent._build_llm_context(messages)
+    cold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    agent._build_llm_context(messages)
+    warm_time = time.perf_counter() - start
+
+    assert context == legacy_context, "Truncated contexts do not match."
+    print(f"Messages: {args.messages}, kept: {len(context) - 1}")
+    print(f"Legacy truncation:      {legacy_time * 1000:10.1f} ms")
+    print(f"Prefix-sum (cold):      {cold_time * 1000:10.1f} ms")
+    print(f"Prefix-sum (cached):    {warm_time * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares the legacy AgentMessageList.add (append, then re-sort the whole list)
+with bisect insertion, and times building an agent's per-step context list
+from concatenated message lists.
+
+Usage: python tests/benchmarks/message_list.py [--messages 5000]
+"""
+import time
+import argparse
+from typing import List
+from bondai.agents import AgentMessageList, SystemMessage, AgentMessage
+
+
+class LegacyAgentMessageList:
+    def __init__(self):
+        self._items: List[AgentMessage] = []
+        self._ids = set()
+
+    def add(self, item: AgentMessage):
+        if item.id not in self._ids:
+            self._ids.add(item.id)
+            self._items.append(item)
+            self._items = list(sorted(self._items, key=lambda x: x.timestamp))
+
+
+def time_adds(message_list, messages: List[AgentMessage]) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        message_list.add(message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    messages = [SystemMessage(message=f"Message {i}") for i in range(args.messages)]
+    legacy = time_adds(LegacyAgentMessageList(), messages)
+    message_list = AgentMessageList()
+    bisect_insertion = time_adds(message_list, messages)
+
+    local_messages = [SystemMessage(message="Local message")]
+    start = time.perf_counter()
+    AgentMessageList(message_list + local_messages)
+    context_build = time.perf_counter() - start
+
+    print(f"Legacy add ({args.messages} messages): {legacy * 1000:10.2f} ms")
+    print(f"Bisect add ({args.messages} messages): {bisect_insertion * 1000:10.2f} ms")
+    print(f"Context list build:                {context_build * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
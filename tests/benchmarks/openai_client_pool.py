@@ -0,0 +1,80 @@
+"""
+Measures per-call latency of embedding requests against a local mock OpenAI
+server, comparing a new client per request (the previous behavior) with the
+pooled clients used by openai_wrapper.
+
+Usage: python tests/benchmarks/openai_client_pool.py [--calls 200]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openai import OpenAI
+from bondai.models.openai import OpenAIConnectionParams, OpenAIConnectionType
+from bondai.models.openai.openai_wrapper import create_embedding
+
+EMBEDDING_RESPONSE = json.dumps(
+    {
+        "object": "list",
+        "data": [{"object": "embedding", "index": 0, "embedding": [0.0] * 1536}],
+        "model": "text-embedding-ada-002",
+        "usage": {"prompt_tokens": 1, "total_tokens": 1},
+    }
+).encode()
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(EMBEDDING_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(EMBEDDING_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_calls(calls: int, fn) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    connection_params = OpenAIConnectionParams(
+        connection_type=OpenAIConnectionType.OPENAI, api_key="benchmark"
+    )
+
+    def unpooled_call():
+        client = OpenAI(api_key="benchmark")
+        client.embeddings.create(input=["hello"], model="text-embedding-ada-002")
+
+    def pooled_call():
+        create_embedding("hello", connection_params=connection_params)
+
+    unpooled = time_calls(args.calls, unpooled_call)
+    pooled = time_calls(args.calls, pooled_call)
+    server.shutdown()
+
+    print(f"New client per call: {unpooled * 1000:8.2f} ms/call")
+    print(f"Pooled client:       {pooled * 1000:8.2f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares the legacy character-by-character split_tokens, which re-counts the
+tokens of the growing chunk after every character, with token-level
+splitting on a long single-line input such as minified code or CSV.
+
+Usage: python tests/benchmarks/split_tokens.py [--chars 20000] [--max-length 512]
+"""
+import time
+import random
+import string
+import argparse
+import tiktoken
+from typing import List
+from bondai.models import EmbeddingModel
+from bondai.util.semantic_search import split_tokens
+
+
+class TiktokenEmbeddingModel(EmbeddingModel):
+    def __init__(self):
+        self._encoding = tiktoken.get_encoding("cl100k_base")
+
+    @property
+    def max_tokens(self) -> int:
+        return 8191
+
+    @property
+    def embedding_size(self) -> int:
+        return 1536
+
+    def create_embedding(self, prompt: str) -> List[List[float]]:
+        raise NotImplementedError()
+
+    def count_tokens(self, prompt: str) -> int:
+        return len(self._encoding.encode(prompt))
+
+    @property
+    def supports_tokenization(self) -> bool:
+        return True
+
+    def encode(self, prompt: str) -> List[int]:
+        return self._encoding.encode(prompt)
+
+    def decode(self, tokens: List[int]) -> str:
+        return self._encoding.decode(tokens)
+
+
+def legacy_split_tokens(
+    embedding_model: EmbeddingModel, input: str, max_length: int
+) -> List[str]:
+    item = ""
+    result = []
+    for c in input:
+        item += c
+        if embedding_model.count_tokens(item) >= max_length:
+            result.append(item)
+            item = ""
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=20000)
+    parser.add_argument("--max-length", type=int, default=512)
+    args = parser.parse_args()
+
+    random.seed(0)
+    alphabet = string.ascii_letters + string.digits + ",;{}()=."
+    text = "".join(random.choice(alphabet) for _ in range(args.chars))
+    embedding_model = TiktokenEmbeddingModel()
+
+    start = time.perf_counter()
+    legacy = legacy_split_tokens(embedding_model, text, args.max_length)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = split_tokens(embedding_model, text, args.max_length)
+    token_time = time.perf_counter() - start
+
+    print(
+        f"Legacy split_tokens:      {legacy_time * 1000:10.2f} ms "
+        f"({len(legacy)} chunks, {sum(len(c) for c in legacy)} of {len(text)} chars)"
+    )
+    print(
+        f"Token-level split_tokens: {token_time * 1000:10.2f} ms "
+        f"({len(chunks)} chunks, {sum(len(c) for c in chunks)} of {len(text)} chars)"
+    )
+
+
+if __name__ == "__main__":
+    main()
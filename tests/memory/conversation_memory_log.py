@@ -0,0 +1,86 @@
+"""
+Checks that PersistentConversationMemoryDataSource reloads messages as they
+were last stored: changes saved with update and duplicate add records are
+replayed with the last record winning.
+
+Usage: python tests/memory/conversation_memory_log.py
+"""
+import os
+import json
+import tempfile
+from bondai.agents import ConversationMessage
+from bondai.memory.conversation import PersistentConversationMemoryDataSource
+
+
+def test_update_survives_reload(file_path: str):
+    memory = PersistentConversationMemoryDataSource(file_path=file_path)
+    message = ConversationMessage(
+        sender_name="user", recipient_name="agent", message="Hello"
+    )
+    memory.add(message)
+    message.success = True
+    message.cost = 1.5
+    memory.update(message)
+    memory.close()
+
+    reloaded = PersistentConversationMemoryDataSource(file_path=file_path)
+    (reloaded_message,) = reloaded.messages
+    assert reloaded_message.success is True, reloaded_message
+    assert reloaded_message.cost == 1.5, reloaded_message
+    reloaded.close()
+
+
+def test_duplicate_add_last_wins(file_path: str):
+    memory = PersistentConversationMemoryDataSource(file_path=file_path)
+    message = ConversationMessage(
+        sender_name="user", recipient_name="agent", message="Hello"
+    )
+    # Both adds are appended since the log has not been loaded yet.
+    memory.add(message)
+    message.message_summary = "Greeting"
+    memory.add(message)
+    memory.close()
+
+    with open(file_path, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    assert len(records) == 2, records
+
+    reloaded = PersistentConversationMemoryDataSource(file_path=file_path)
+    (reloaded_message,) = reloaded.messages
+    assert reloaded_message.message_summary == "Greeting", reloaded_message
+    reloaded.close()
+
+
+def test_update_after_remove_is_ignored(file_path: str):
+    memory = PersistentConversationMemoryDataSource(file_path=file_path)
+    message = ConversationMessage(
+        sender_name="user", recipient_name="agent", message="Hello"
+    )
+    memory.add(message)
+    memory.close()
+
+    # The log is not loaded, so the update is appended after the removal.
+    memory = PersistentConversationMemoryDataSource(file_path=file_path)
+    memory.remove(message)
+    memory.update(message)
+    memory.close()
+
+    reloaded = PersistentConversationMemoryDataSource(file_path=file_path)
+    assert len(reloaded.messages) == 0, reloaded.messages
+    reloaded.close()
+
+
+def main():
+    tests = [
+        test_update_survives_reload,
+        test_duplicate_add_last_wins,
+        test_update_after_remove_is_ignored,
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        for test in tests:
+            test(os.path.join(directory, f"{test.__name__}.json"))
+            print(f"{test.__name__}: ok")
+
+
+if __name__ == "__main__":
+    main()
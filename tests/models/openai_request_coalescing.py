@@ -0,0 +1,134 @@
+"""
+Checks that OpenAILLM coalesces concurrent identical completion requests with
+a temperature of 0 into a single API call against a local mock OpenAI server,
+and that sampled requests are not coalesced.
+
+Usage: python tests/models/openai_request_coalescing.py
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bondai.models.openai import (
+    OpenAILLM,
+    OpenAIModelNames,
+    OpenAIConnectionParams,
+    OpenAIConnectionType,
+)
+
+COMPLETION_RESPONSE = json.dumps(
+    {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "Hello"},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+).encode()
+
+requests = []
+requests_lock = threading.Lock()
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with requests_lock:
+            requests.append(body)
+        # Keeps the request in flight long enough for the others to join it.
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(COMPLETION_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_completions(llm: OpenAILLM, calls: int, **kwargs):
+    requests.clear()
+    results = []
+
+    def call():
+        results.append(
+            llm.get_completion(messages=[{"role": "user", "content": "Hi"}], **kwargs)
+        )
+
+    threads = [threading.Thread(target=call) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+async def aget_completions(llm: OpenAILLM, calls: int, **kwargs):
+    requests.clear()
+    return await asyncio.gather(
+        *[
+            llm.aget_completion(messages=[{"role": "user", "content": "Hi"}], **kwargs)
+            for _ in range(calls)
+        ]
+    )
+
+
+def test_coalesces_deterministic_requests(llm: OpenAILLM):
+    results = get_completions(llm, 2, temperature=0)
+    assert results == [("Hello", None)] * 2, results
+    assert len(requests) == 1, requests
+    assert requests[0]["temperature"] == 0, requests
+
+
+def test_coalesces_deterministic_async_requests(llm: OpenAILLM):
+    results = asyncio.run(aget_completions(llm, 2, temperature=0))
+    assert results == [("Hello", None)] * 2, results
+    assert len(requests) == 1, requests
+
+
+def test_does_not_coalesce_sampled_requests(llm: OpenAILLM):
+    results = get_completions(llm, 2, temperature=0.7)
+    assert results == [("Hello", None)] * 2, results
+    assert len(requests) == 2, requests
+
+    get_completions(llm, 2)
+    assert len(requests) == 2, requests
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    llm = OpenAILLM(
+        OpenAIModelNames.GPT4,
+        connection_params=OpenAIConnectionParams(
+            connection_type=OpenAIConnectionType.OPENAI, api_key="test"
+        ),
+        enable_request_coalescing=True,
+    )
+    tests = [
+        test_coalesces_deterministic_requests,
+        test_coalesces_deterministic_async_requests,
+        test_does_not_coalesce_sampled_requests,
+    ]
+    for test in tests:
+        test(llm)
+        print(f"{test.__name__}: ok")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()